@@ -0,0 +1,225 @@
+'''
+End to end benchmark of the extractor against the local stub Gemius API.
+
+Drives either the ExtractorService (default) or the whole Component.run (--mode component, requires the keboola
+docker package) and reports requests/sec, rows/sec, peak RSS and wall time.
+
+Usage: python -m benchmark.bench_extractor --rows 10000 --days 30 --countries CZ SK --workers 4
+
+@author: esner
+'''
+import argparse
+import ast
+import csv
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmark.stub_server import StubGemiusProcess, StubConfig
+from gemius.client import Client
+from gemius.async_client import AsyncClient
+from gemius.extractor_service import ExtractorService
+from gemius.stats_planner import StatsRequestPlanner
+from kbc.rate_limit import AdaptiveRateLimiter
+from kbc.instrumentation import PerformanceMetrics
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['service', 'component'], default='service')
+    parser.add_argument('--datasets', nargs='+', default=['stats'],
+                        help='dataset types to download (stats, nodes, geos, platforms, metrics, trees, demography)')
+    parser.add_argument('--rows', type=int, default=1000, help='rows per stats response')
+    parser.add_argument('--dimension-rows', type=int, default=1000, help='rows per dimension response')
+    parser.add_argument('--metric-columns', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='stub latency per request [s]')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of HTTP 500 per request')
+    parser.add_argument('--countries', nargs='+', default=['CZ'])
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--async-client', action='store_true')
+    parser.add_argument('--max-in-flight', type=int, default=100)
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='stub answers data requests above this rate with HTTP 429 [req/s], 0 to disable')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='client rate limit [req/s], 0 to disable')
+    parser.add_argument('--process-workers', type=int, default=0,
+                        help='process pool size (component mode only), 0 to disable')
+    parser.add_argument('--stats-nodes', type=int, default=0,
+                        help='filter stats by this number of node ids (the stub returns one row per node), 0 for all')
+    parser.add_argument('--stats-node-subtrees', nargs='+', default=[],
+                        help='filter stats by node subtrees (root_id or root_id:depth, stub nodes have parent id // 10)')
+    parser.add_argument('--heavy-filter-values', type=int, default=0,
+                        help='stub delays stats requests filtering more nodes than this by --heavy-latency')
+    parser.add_argument('--heavy-latency', type=float, default=0.0, help='delay of the heavy stats requests [s]')
+    parser.add_argument('--split-timeout', type=float, default=0.0,
+                        help='stats requests slower than this are split [s], 0 to disable')
+    parser.add_argument('--split-max-mb', type=float, default=0.0,
+                        help='stats responses bigger than this are split [MB], 0 to disable')
+    parser.add_argument('--output-format', choices=['csv', 'parquet'], default='csv', help='stats output format')
+    parser.add_argument('--keep-output', action='store_true', help='do not delete the output folder')
+    return parser.parse_args(argv)
+
+
+METRICS_TABLE = 'metrics.csv'
+
+
+def build_config(args, base_url):
+    datasets = []
+    for ds_type in args.datasets:
+        filters = []
+        if ds_type == 'stats':
+            filters.append({'filter': 'metric', 'source_table': METRICS_TABLE})
+            if args.stats_nodes:
+                filters.append({'filter': 'node', 'source_table': str([str(i) for i in range(args.stats_nodes)])})
+            if args.stats_node_subtrees:
+                filters.append({'filter': 'node_subtree', 'source_table': str(args.stats_node_subtrees)})
+        datasets.append({'dataset_type': ds_type, 'period_type': 'daily', 'filters': filters,
+                         'output_format': args.output_format})
+
+    return {'user': 'bench',
+            '#pass': 'bench',
+            'api_base_url': base_url,
+            'period_from': (date.today() - timedelta(days=args.days + 1)).isoformat(),
+            'period_to': date.today().isoformat(),
+            'datasets': datasets,
+            'max_workers': args.workers,
+            'streaming': args.stream,
+            'async_client': args.async_client,
+            'max_in_flight': args.max_in_flight,
+            'process_workers': args.process_workers,
+            'rate_limit': args.rate_limit,
+            'stats_split_timeout': args.split_timeout,
+            'stats_split_max_size_mb': args.split_max_mb}
+
+
+def run_service(config, metrics, out_path):
+    '''
+    Equivalent of Component._retrieve_datasets without the keboola environment.
+    '''
+    rate_limiter = None
+    if config['rate_limit']:
+        max_concurrency = config['max_in_flight'] if config['async_client'] else config['max_workers']
+        rate_limiter = AdaptiveRateLimiter(config['rate_limit'], max_concurrency=max_concurrency)
+    performance = PerformanceMetrics()
+    if config['async_client']:
+        client = AsyncClient(config['user'], config['#pass'], config['api_base_url'],
+                             max_in_flight=config['max_in_flight'], rate_limiter=rate_limiter,
+                             metrics=performance)
+    else:
+        client = Client(config['user'], config['#pass'], config['api_base_url'],
+                        pool_maxsize=max(10, config['max_workers'] + 1), rate_limiter=rate_limiter,
+                        metrics=performance)
+    result_files = []
+    split_max_bytes = int(config['stats_split_max_size_mb'] * 1024 * 1024) or None
+    stats_planner = StatsRequestPlanner(split_timeout=config['stats_split_timeout'] or None,
+                                        split_max_bytes=split_max_bytes)
+    with ExtractorService(client, config['max_workers'], stream=config['streaming'],
+                          stats_planner=stats_planner) as service:
+        catalogue = service.get_period_catalogue()
+        for index, dataset in enumerate(config['datasets']):
+            periods = catalogue.get_periods(config['period_from'], config['period_to'], dataset['period_type'])
+            if dataset['dataset_type'] == 'stats':
+                filter_params = {'metric': [m['id'] for m in metrics]}
+                for stats_filter in dataset['filters']:
+                    if stats_filter['filter'] != 'metric':
+                        filter_params[stats_filter['filter']] = ast.literal_eval(stats_filter['source_table'])
+                result_files += service.get_n_save_stats_in_available_periods(
+                    out_path, index, periods, metrics, output_format=dataset['output_format'], **filter_params)
+            else:
+                result_files += service.get_n_save_dataset_in_available_periods(
+                    dataset['dataset_type'], out_path, index, periods)
+    if rate_limiter:
+        print('rate limiter: {}'.format(rate_limiter.stats()))
+    print(performance.summary_table())
+    return result_files
+
+
+def run_component(config, metrics, data_path):
+    from component import Component
+    os.makedirs(os.path.join(data_path, 'out', 'tables'))
+    os.makedirs(os.path.join(data_path, 'out', 'files'))
+    os.makedirs(os.path.join(data_path, 'in', 'tables'))
+    # metric filter input mapping
+    with open(os.path.join(data_path, 'in', 'tables', METRICS_TABLE), 'w', newline='') as metrics_file:
+        writer = csv.DictWriter(metrics_file, fieldnames=['id', 'name'])
+        writer.writeheader()
+        writer.writerows(metrics)
+    storage = {'input': {'tables': [{'source': 'in.c-benchmark.metrics', 'destination': METRICS_TABLE}]}}
+    with open(os.path.join(data_path, 'config.json'), 'w') as config_file:
+        json.dump({'parameters': config, 'storage': storage}, config_file)
+    os.environ['KBC_DATADIR'] = data_path
+    os.environ.setdefault('KBC_CONFIGID', 'benchmark')
+    Component().run()
+
+
+def count_rows(folder):
+    '''
+    Returns number of result rows and size of the result files in bytes.
+    '''
+    rows = 0
+    size = 0
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if name.endswith('.parquet'):
+                import pyarrow.parquet
+                rows += pyarrow.parquet.ParquetFile(file_path).metadata.num_rows
+            elif name.endswith('.csv'):
+                with open(file_path, 'rb') as result_file:
+                    # minus header
+                    rows += max(0, sum(1 for _ in result_file) - 1)
+            else:
+                continue
+            size += os.path.getsize(file_path)
+    return rows, size
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    stub_config = StubConfig(rows=args.rows, dimension_rows=args.dimension_rows, metric_columns=args.metric_columns,
+                             latency=args.latency, error_rate=args.error_rate, countries=args.countries,
+                             days=args.days, throttle_rate=args.throttle_rate,
+                             heavy_filter_values=args.heavy_filter_values, heavy_latency=args.heavy_latency)
+    work_dir = tempfile.mkdtemp(prefix='gemius-bench-')
+    try:
+        with StubGemiusProcess(stub_config) as stub:
+            config = build_config(args, stub.base_url)
+            metrics = [{'id': str(i), 'name': name} for i, name in enumerate(stub_config.metric_names)]
+            start = time.perf_counter()
+            if args.mode == 'component':
+                run_component(config, metrics, work_dir)
+            else:
+                run_service(config, metrics, work_dir)
+            wall_time = time.perf_counter() - start
+
+        rows, output_size = count_rows(work_dir)
+        report = {'mode': args.mode,
+                  'wall_time_s': round(wall_time, 3),
+                  'requests': stub.counters['requests'],
+                  'injected_errors': stub.counters['errors'],
+                  'throttled': stub.counters['throttled'],
+                  'requests_per_s': round(stub.counters['requests'] / wall_time, 1),
+                  'rows': rows,
+                  'rows_per_s': round(rows / wall_time, 1),
+                  'output_mb': round(output_size / 1024 / 1024, 2),
+                  # ru_maxrss is in kilobytes on Linux
+                  'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    finally:
+        if args.keep_output:
+            print('Output kept in {}'.format(work_dir))
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    for key, value in report.items():
+        print('{:<16} {}'.format(key, value))
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+'''
+Compares rows/sec of the positional stats writer (ExtractorService._write_stats_resp_in_period) against
+the previous csv.DictReader/csv.DictWriter based writer on an in-memory stats response.
+
+No network is involved, the response lines are generated up front and the output goes to a null sink.
+
+Usage: python -m benchmark.bench_stats_writer [rows] [metric_columns]
+
+@author: esner
+'''
+import csv
+import hashlib
+import sys
+import time
+
+from benchmark.stub_server import StubConfig
+from gemius.extractor_service import ExtractorService, STATS_BASE_HEADER, PERIOD_HEADER
+
+PERIOD = {'begin': '2018-10-01', 'end': '2018-10-01', 'period type': 'daily'}
+
+
+class HashSink():
+    '''
+    File-like sink keeping only the digest of the written data, so both writers can be checked for identical output.
+    '''
+
+    def __init__(self):
+        self._hash = hashlib.sha1()
+
+    def write(self, s):
+        self._hash.update(s.encode('utf-8'))
+        return len(s)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def legacy_write_stats_resp_in_period(lines, out_file, fieldnames, period, append_data, write_header):
+    '''
+    The previous writer: a dict per row, updated with the period and append data and written by csv.DictWriter.
+    '''
+    def clean_header(lines):
+        lines = iter(lines)
+        header = next(lines, None)
+        if header is None:
+            return
+        yield header.replace('%', 'prc')
+        yield from lines
+
+    writer = csv.DictWriter(out_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL, fieldnames=fieldnames,
+                            extrasaction='ignore')
+    reader = csv.DictReader(clean_header(lines), delimiter='\t', quotechar='"')
+    if write_header:
+        writer.writeheader()
+
+    period_data = {'begin_period': period['begin'],
+                   'end_period': period['end'],
+                   'period_type': period['period type']}
+
+    for row in reader:
+        row.update(period_data)
+        row.update(append_data)
+        writer.writerow(row)
+
+
+def positional_write_stats_resp_in_period(lines, out_file, fieldnames, period, append_data, write_header):
+    writer = csv.writer(out_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    ExtractorService(None)._write_stats_resp_in_period(lines, writer, period, append_data, write_header, fieldnames)
+
+
+def build_lines(config):
+    header = ['geo_id', 'node_id', 'platform_id', 'target_group'] + config.metric_names
+    lines = ['\t'.join(header)]
+    for i in range(config.rows):
+        lines.append('\t'.join([str(i % 50), str(i), str(i % 3), 'Population']
+                               + ['{:.3f}'.format((i * 7919 + m) % 100000 / 100) for m in
+                                  range(config.metric_columns)]))
+    return lines
+
+
+def _run(write_func, lines, fieldnames, append_data):
+    sink = HashSink()
+    start = time.perf_counter()
+    write_func(lines, sink, fieldnames, PERIOD, append_data, True)
+    elapsed = time.perf_counter() - start
+    return (len(lines) - 1) / elapsed, sink.hexdigest()
+
+
+def main(rows=1000000, metric_columns=5):
+    config = StubConfig(rows=rows, metric_columns=metric_columns)
+    lines = build_lines(config)
+    fieldnames = [name.replace('%', 'prc') for name in config.metric_names] + ['country', 'filter'] + \
+        STATS_BASE_HEADER + PERIOD_HEADER
+    append_data = {'country': 'CZ', 'filter': str({'metric': [str(i) for i in range(metric_columns)]})}
+
+    before, before_digest = _run(legacy_write_stats_resp_in_period, lines, fieldnames, append_data)
+    after, after_digest = _run(positional_write_stats_resp_in_period, lines, fieldnames, append_data)
+
+    print('rows: {}, metric columns: {}'.format(rows, metric_columns))
+    print('DictReader/DictWriter: {:12.1f} rows/s'.format(before))
+    print('positional:            {:12.1f} rows/s'.format(after))
+    print('speedup:               {:12.2f}x'.format(after / before))
+    print('identical output:      {}'.format(before_digest == after_digest))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
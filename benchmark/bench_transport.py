@@ -0,0 +1,60 @@
+'''
+Compares requests/sec of the pooled keep-alive transport against the previous
+session-per-request behaviour of HttpClientBase, using a local stub server.
+
+Usage: python -m benchmark.bench_transport [n_requests]
+
+NOTE: the stub runs plain HTTP on localhost, so the measured gain contains only the TCP handshake
+and session/adapter setup; against the real HTTPS API the TLS handshake is saved as well.
+
+@author: esner
+'''
+import sys
+import time
+
+import requests
+
+from benchmark.stub_server import StubGemiusProcess, StubConfig
+from gemius.client import Client
+
+
+class SessionPerRequestClient(Client):
+    '''
+    Reproduces the previous transport: a fresh Session + HTTPAdapter for every call.
+    '''
+
+    def _request(self, method, url, *args, **kwargs):
+        if not self._is_login_request(url):
+            # replaces Client._request, which injects the session token
+            kwargs['params'] = self._with_session(kwargs.get('params'), self.session)
+        s = self.requests_retry_session(session=requests.Session())
+        try:
+            r = s.request(method, url, *args, **kwargs)
+            r.content
+            return r
+        finally:
+            s.close()
+
+
+def _run(client_cls, base_url, n_requests):
+    with client_cls('user', 'pass', service_base_url=base_url) as client:
+        start = time.perf_counter()
+        for _ in range(n_requests):
+            client.get_standard_dataset('geos', '2018-10-01', '2018-10-01', 'CZ', output_type='csv')
+        elapsed = time.perf_counter() - start
+    return n_requests / elapsed
+
+
+def main(n_requests=2000):
+    with StubGemiusProcess(StubConfig(dimension_rows=10)) as server:
+        before = _run(SessionPerRequestClient, server.base_url, n_requests)
+        after = _run(Client, server.base_url, n_requests)
+
+    print('requests: {}'.format(n_requests))
+    print('session per request: {:10.1f} req/s'.format(before))
+    print('pooled keep-alive:   {:10.1f} req/s'.format(after))
+    print('speedup:             {:10.2f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
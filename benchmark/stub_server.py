@@ -0,0 +1,276 @@
+'''
+Local stub of the Gemius Audience API used by the benchmarks.
+
+Mimics open-session, available-periods, stats, nodes, geos, platforms, metrics, trees and demography with
+synthetic tab separated payloads of configurable size. Latency and error rate can be injected.
+
+@author: esner
+'''
+import json
+import multiprocessing
+import random
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+STUB_SESSION = 'stub-session-token'
+
+DIMENSION_ENDPOINTS = ['nodes', 'geos', 'platforms', 'trees']
+
+
+class StubConfig():
+    '''
+    Stub API settings.
+
+    rows -- number of rows of each stats response
+    dimension_rows -- number of rows of each dimension (nodes, geos, ...) response
+    metric_columns -- number of metric columns in stats responses
+    latency -- seconds to wait before each response
+    error_rate -- probability (0-1) that a data request fails with HTTP 500
+    throttle_rate -- data requests per second served, requests above it get HTTP 429 with Retry-After (0 - no limit)
+    heavy_filter_values -- stats requests filtering more than this number of nodes wait heavy_latency seconds
+                           before responding (0 - disabled)
+    countries -- list of countries in available periods
+    days -- number of daily periods per country, ending yesterday
+    '''
+
+    def __init__(self, rows=1000, dimension_rows=1000, metric_columns=5, latency=0.0, error_rate=0.0,
+                 countries=('CZ',), days=30, seed=0, throttle_rate=0.0, retry_after=1, heavy_filter_values=0,
+                 heavy_latency=0.0):
+        self.rows = rows
+        self.dimension_rows = dimension_rows
+        self.metric_columns = metric_columns
+        self.latency = latency
+        self.error_rate = error_rate
+        self.countries = list(countries)
+        self.days = days
+        self.seed = seed
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.heavy_filter_values = heavy_filter_values
+        self.heavy_latency = heavy_latency
+
+    @property
+    def metric_names(self):
+        return ['Metric {}'.format(i) if i % 2 else '%Metric {}'.format(i) for i in range(self.metric_columns)]
+
+
+class StubPayloads():
+    '''
+    Pre-generated response bodies, so the payload generation does not distort the measurement.
+    '''
+
+    def __init__(self, config):
+        rnd = random.Random(config.seed)
+        self.config = config
+        self.stats_header = '\t'.join(['geo_id', 'node_id', 'platform_id', 'target_group'] + config.metric_names)
+        # row i belongs to node i
+        self.stats_rows = ['\t'.join([str(i % 50), str(i), str(i % 3), 'Population']
+                                     + ['{:.3f}'.format(rnd.random() * 1000) for _ in range(config.metric_columns)])
+                           for i in range(config.rows)]
+        self.stats = self._tsv(self.stats_header.split('\t'), (row.split('\t') for row in self.stats_rows))
+        self.dimension = self._tsv(['id', 'name', 'parent_id'],
+                                   ([str(i), 'Item {}'.format(i), str(i // 10)] for i in range(config.dimension_rows)))
+        self.metrics = self._tsv(['id', 'name'],
+                                 ([str(i), name] for i, name in enumerate(config.metric_names)))
+        self.demography = b'\r\n'.join([
+            self._tsv(['continuous', 'id', 'name'], [['0', '1', 'gender'], ['1', '2', 'age']]),
+            self._tsv(['id', 'name', 'trait_id'], [['1', 'male', '1'], ['2', 'female', '1']]),
+            self._tsv(['max', 'min', 'trait_id'], [['99', '15', '2']])])
+        self.available_periods = self._available_periods(config)
+
+    def stats_for_nodes(self, nodes):
+        '''
+        Stats payload with the rows of the requested node ids only.
+        '''
+        lines = [self.stats_header] + [self.stats_rows[int(n)] for n in nodes if n.isdigit()
+                                       and int(n) < len(self.stats_rows)]
+        return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+    def _tsv(self, header, rows):
+        lines = ['\t'.join(header)] + ['\t'.join(row) for row in rows]
+        return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+    def _available_periods(self, config):
+        last_day = date.today() - timedelta(days=1)
+        rows = []
+        for country in config.countries:
+            for i in range(config.days, 0, -1):
+                day = last_day - timedelta(days=i - 1)
+                rows.append([country, day.isoformat(), day.isoformat(), 'daily'])
+        return self._tsv(['country', 'begin', 'end', 'period type'], rows)
+
+
+class StubGemiusHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so the connections can be kept alive
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self._read_body()
+        self.server.count_request()
+        if urlparse(self.path).path.endswith('open-session'):
+            self._send(json.dumps({'data': {'session': STUB_SESSION}}).encode('utf-8'), 'application/json')
+        else:
+            self._send(b'', status=404)
+
+    def do_GET(self):
+        server = self.server
+        server.count_request()
+        url = urlparse(self.path)
+        endpoint = url.path.rstrip('/').rsplit('/', 1)[-1]
+        query = parse_qs(url.query)
+
+        if query.get('session', [None])[0] != STUB_SESSION:
+            self._send(b'Invalid session', status=403)
+            return
+        if server.config.latency:
+            time.sleep(server.config.latency)
+        if endpoint != 'available-periods' and server.should_throttle():
+            self._send(b'Too many requests', status=429, headers={'Retry-After': str(server.config.retry_after)})
+            return
+        if endpoint != 'available-periods' and server.should_fail():
+            self._send(b'Injected error', status=500)
+            return
+        if endpoint == 'stats' and server.is_heavy(query):
+            time.sleep(server.config.heavy_latency)
+
+        payload = server.get_payload(endpoint, query)
+        if payload is None:
+            self._send(b'Unknown endpoint', status=404)
+        else:
+            self._send(payload, 'text/tab-separated-values; charset=utf-8')
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+
+    def _send(self, body, content_type='text/plain', status=200, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubGemiusServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        ThreadingHTTPServer.__init__(self, (host, port), StubGemiusHandler)
+        self.config = config or StubConfig()
+        self.payloads = StubPayloads(self.config)
+        self.request_count = 0
+        self.error_count = 0
+        self.throttled_count = 0
+        # token bucket of the throttling, one second burst
+        self._tokens = self.config.throttle_rate
+        self._last_refill = time.monotonic()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}/v1/'.format(*self.server_address)
+
+    def count_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def should_fail(self):
+        with self._lock:
+            fail = self._random.random() < self.config.error_rate
+            if fail:
+                self.error_count += 1
+            return fail
+
+    def should_throttle(self):
+        if not self.config.throttle_rate:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.config.throttle_rate,
+                               self._tokens + (now - self._last_refill) * self.config.throttle_rate)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return False
+            self.throttled_count += 1
+            return True
+
+    def is_heavy(self, query):
+        return 0 < self.config.heavy_filter_values < len(query.get('node', []))
+
+    def get_payload(self, endpoint, query=None):
+        if endpoint == 'stats':
+            if query and query.get('node'):
+                return self.payloads.stats_for_nodes(query['node'])
+            return self.payloads.stats
+        elif endpoint in DIMENSION_ENDPOINTS:
+            return self.payloads.dimension
+        elif endpoint == 'metrics':
+            return self.payloads.metrics
+        elif endpoint == 'demography':
+            return self.payloads.demography
+        elif endpoint == 'available-periods':
+            return self.payloads.available_periods
+        return None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def _serve(config, conn):
+    server = StubGemiusServer(config)
+    conn.send(server.base_url)
+    server.start()
+    # wait for stop request, then report counters
+    conn.recv()
+    conn.send({'requests': server.request_count, 'errors': server.error_count, 'throttled': server.throttled_count})
+    server.stop()
+
+
+class StubGemiusProcess():
+    '''
+    Runs the stub server in a separate process so it does not compete with the measured code for the GIL.
+    '''
+
+    def __init__(self, config=None):
+        self.config = config or StubConfig()
+        self.base_url = None
+        self.counters = None
+        self._conn = None
+        self._process = None
+
+    def __enter__(self):
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(self.config, child_conn), daemon=True)
+        self._process.start()
+        self.base_url = self._conn.recv()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._conn.send('stop')
+        self.counters = self._conn.recv()
+        self._process.join()
@@ -4,13 +4,29 @@ Created on 10. 10. 2018
 @author: esner
 '''
 from kbc.env_handler import KBCEnvHandler
-from gemius.extractor_service import ExtractorService
-from gemius.client import Client
+from gemius.extractor_service import ExtractorService, OUTPUT_MODE_FULL, OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_PARQUET
+from gemius.client import Client, DEAFULT_V1_BASE
+from gemius.async_client import AsyncClient
+from gemius.stats_planner import StatsRequestPlanner
+from gemius.response_cache import ResponseCache, DEFAULT_TTL, DEFAULT_MAX_SIZE
+from gemius.client import DEFAULT_CACHE_STATS_AFTER_DAYS
+from gemius.extraction_state import ExtractionState
+from gemius.run_plan import RunPlan, DatasetPlan, RequestHistory
+from kbc.sliced_writer import DEFAULT_SLICE_MAX_ROWS, DEFAULT_SLICE_MAX_BYTES
+from kbc.client_base import DEFAULT_POOL_MAXSIZE
+from kbc.async_client_base import DEFAULT_MAX_IN_FLIGHT
+from kbc.rate_limit import AdaptiveRateLimiter
+from kbc.instrumentation import PerformanceMetrics
+from kbc.profiling import RunProfiler, resolve_profiling_mode, DEFAULT_SAMPLE_INTERVAL
+from kbc.filter_source import FilterSourceLoader, unique_values
 import logging
 import collections
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 import ast
-import csv
 
 from datetime import datetime
 
@@ -20,6 +36,40 @@ KEY_PERIOD_FROM = 'period_from'
 KEY_PERIOD_TO = 'period_to'
 KEY_RELATIVE_PERIOD = 'relative_period'
 KEY_DATASETS = 'datasets'
+# API url override, used by the local benchmarks
+KEY_BASE_URL = 'api_base_url'
+KEY_MAX_WORKERS = 'max_workers'
+KEY_ASYNC_CLIENT = 'async_client'
+KEY_MAX_IN_FLIGHT = 'max_in_flight'
+KEY_STREAMING = 'streaming'
+KEY_MAX_FILTER_VALUES = 'stats_max_filter_values'
+KEY_MAX_URL_BYTES = 'stats_max_url_bytes'
+KEY_SPLIT_TIMEOUT = 'stats_split_timeout'
+KEY_SPLIT_MAX_SIZE_MB = 'stats_split_max_size_mb'
+KEY_CACHE_ENABLED = 'cache_enabled'
+KEY_CACHE_TTL_HOURS = 'cache_ttl_hours'
+KEY_CACHE_MAX_SIZE_MB = 'cache_max_size_mb'
+KEY_CACHE_STATS_AFTER_DAYS = 'cache_stats_after_days'
+# persistent cache folder, the data folder is deleted after each job
+KEY_CACHE_DIR = 'cache_dir'
+KEY_INCREMENTAL_FETCH = 'incremental_fetch'
+KEY_INCREMENTAL_LOOKBACK_DAYS = 'incremental_lookback_days'
+KEY_SLICED_OUTPUT = 'sliced_output'
+KEY_SLICE_MAX_ROWS = 'slice_max_rows'
+KEY_SLICE_MAX_SIZE_MB = 'slice_max_size_mb'
+KEY_PROCESS_WORKERS = 'process_workers'
+KEY_RATE_LIMIT = 'rate_limit'
+KEY_RATE_LIMIT_MAX = 'rate_limit_max'
+KEY_PROFILING = 'profiling'
+KEY_PROFILING_SAMPLE_INTERVAL_MS = 'profiling_sample_interval_ms'
+KEY_DRY_RUN = 'dry_run'
+# filter source options
+KEY_FILTER_COLUMN = 'column'
+KEY_FILTER_NAME_COLUMN = 'name_column'
+KEY_FILTER_SORT = 'sort'
+
+PERFORMANCE_REPORT_FILE = 'performance-report.json'
+RUN_PLAN_FILE = 'run-plan.json'
 
 KEY_MAND_PERIOD_GROUP = [KEY_PERIOD_FROM, KEY_PERIOD_TO]
 KEY_MAND_DATE_GROUP = [KEY_RELATIVE_PERIOD, KEY_MAND_PERIOD_GROUP]
@@ -30,8 +80,8 @@ MANDATORY_PARS = [KEY_USER, KEY_PASS, KEY_DATASETS, KEY_MAND_DATE_GROUP]
 APP_VERSION = '0.2.3'
 class Component(KBCEnvHandler):
 
-    def __init__(self):
-        KBCEnvHandler.__init__(self, MANDATORY_PARS)
+    def __init__(self, data_path=None):
+        KBCEnvHandler.__init__(self, MANDATORY_PARS, data_path)
 
     def run(self, debug=False):
         '''
@@ -51,20 +101,171 @@ class Component(KBCEnvHandler):
             from_date = super().get_past_date(params.get(KEY_RELATIVE_PERIOD))
             to_date = datetime.utcnow()
 
-        gemius_srv = ExtractorService(
-            Client(params.get(KEY_USER), params.get(KEY_PASS)))
+        profiler = self._create_profiler(params)
+        with profiler:
+            state = ExtractionState(self.get_state_file())
+            # reuse the session of the last run, a new one is opened when it has expired
+            session_owner = ExtractionState.session_owner(params.get(KEY_USER),
+                                                          params.get(KEY_BASE_URL) or DEAFULT_V1_BASE)
+
+            dry_run = bool(params.get(KEY_DRY_RUN))
+            with self._create_service(params, state.get_session(session_owner)) as gemius_srv:
+                plan = self._build_run_plan(gemius_srv, params, from_date, to_date, state)
+                if not dry_run:
+                    result_files, client_stats = self._retrieve_datasets(gemius_srv, plan, state)
+            state.set_session(session_owner, gemius_srv.client.session)
+
+            if dry_run:
+                # only the available periods were downloaded
+                logging.info('Dry run, no data retrieved.')
+                self._write_run_plan(plan)
+            else:
+                if client_stats['response_cache']:
+                    logging.info('Response cache stats: %s', client_stats['response_cache'])
+                if client_stats['rate_limiter']:
+                    logging.info('Rate limiter stats: %s', client_stats['rate_limiter'])
+                self._write_performance_report(gemius_srv.client, client_stats)
+                # estimates of the next runs
+                plan.history.update(gemius_srv.client.metrics.to_dict())
+                state.set_request_history(plan.history.to_dict())
+
+                logging.info('Building manifest files..')
+                self._process_results(result_files, self.cfg_params.get('bucket'))
+            self.write_state_file(state.to_dict())
+        self._write_file_manifests(profiler.artifacts, ['profiling'])
+
+        logging.info('Extraction finished sucessfully!')
+
+    def _write_performance_report(self, client, client_stats):
+        '''
+        Logs the request / write statistics summary and stores the full report in out/files.
 
+        :param client_stats: response cache and rate limiter stats of the clients which retrieved the data
+        '''
+        logging.info('Performance summary:\n%s', client.metrics.summary_table())
+        report = client.metrics.to_dict()
+        report['version'] = APP_VERSION
+        report.update(client_stats)
+
+        os.makedirs(self.files_out_path, exist_ok=True)
+        report_path = os.path.join(self.files_out_path, PERFORMANCE_REPORT_FILE)
+        with open(report_path, 'w') as out:
+            json.dump(report, out, indent=2)
+        self._write_file_manifests([report_path], ['performance-report'])
+
+    def _write_run_plan(self, plan):
+        '''
+        Logs the plan summary and stores the whole plan in out/files.
+        '''
+        logging.info('Run plan:\n%s', plan.summary_table())
+        report = plan.to_dict()
+        report['version'] = APP_VERSION
+
+        os.makedirs(self.files_out_path, exist_ok=True)
+        plan_path = os.path.join(self.files_out_path, RUN_PLAN_FILE)
+        with open(plan_path, 'w') as out:
+            json.dump(report, out, indent=2)
+        self._write_file_manifests([plan_path], ['run-plan'])
+
+    def _create_profiler(self, params, prefix='profile'):
+        interval = float(params[KEY_PROFILING_SAMPLE_INTERVAL_MS]) / 1000 if params.get(
+            KEY_PROFILING_SAMPLE_INTERVAL_MS) else DEFAULT_SAMPLE_INTERVAL
+        return RunProfiler(resolve_profiling_mode(params.get(KEY_PROFILING)), self.files_out_path, prefix,
+                           sample_interval=interval)
+
+    def _write_file_manifests(self, file_paths, tags, is_permanent=False):
+        for file_path in file_paths:
+            self.configuration.write_file_manifest(file_path, file_tags=tags, is_permanent=is_permanent)
+
+    def _create_service(self, params, session_token=None, rate_share=1):
+        '''
+        :param rate_share: number of processes sharing the configured rate limit, each gets its part
+        '''
+        max_workers = int(params.get(KEY_MAX_WORKERS) or 1)
+        split_max_bytes = int(float(params[KEY_SPLIT_MAX_SIZE_MB]) * 1024 * 1024) if params.get(
+            KEY_SPLIT_MAX_SIZE_MB) else None
+        stats_planner = StatsRequestPlanner(params.get(KEY_MAX_FILTER_VALUES), params.get(KEY_MAX_URL_BYTES),
+                                            split_timeout=float(params.get(KEY_SPLIT_TIMEOUT) or 0) or None,
+                                            split_max_bytes=split_max_bytes)
+        slice_max_bytes = int(params[KEY_SLICE_MAX_SIZE_MB]) * 1024 * 1024 if params.get(
+            KEY_SLICE_MAX_SIZE_MB) else DEFAULT_SLICE_MAX_BYTES
+        return ExtractorService(self._create_client(params, max_workers, session_token, rate_share), max_workers,
+                                stream=bool(params.get(KEY_STREAMING)), stats_planner=stats_planner,
+                                sliced_output=bool(params.get(KEY_SLICED_OUTPUT)),
+                                slice_max_rows=int(params.get(KEY_SLICE_MAX_ROWS) or DEFAULT_SLICE_MAX_ROWS),
+                                slice_max_bytes=slice_max_bytes)
+
+    def _create_client(self, params, max_workers, session_token=None, rate_share=1):
+        cache_params = {'response_cache': self._create_response_cache(params),
+                        'cache_stats_after_days': int(params.get(KEY_CACHE_STATS_AFTER_DAYS)
+                                                      or DEFAULT_CACHE_STATS_AFTER_DAYS),
+                        'session_token': session_token,
+                        'metrics': PerformanceMetrics()}
+        if params.get(KEY_ASYNC_CLIENT):
+            logging.info('Using async client..')
+            max_in_flight = int(params.get(KEY_MAX_IN_FLIGHT) or DEFAULT_MAX_IN_FLIGHT)
+            return AsyncClient(params.get(KEY_USER), params.get(KEY_PASS), params.get(KEY_BASE_URL) or DEAFULT_V1_BASE,
+                               max_in_flight=max_in_flight,
+                               rate_limiter=self._create_rate_limiter(params, max_in_flight, rate_share), **cache_params)
+        # keep at least one pooled connection per pending response
+        return Client(params.get(KEY_USER), params.get(KEY_PASS), params.get(KEY_BASE_URL) or DEAFULT_V1_BASE,
+                      pool_maxsize=max(DEFAULT_POOL_MAXSIZE, max_workers + 1),
+                      rate_limiter=self._create_rate_limiter(params, max_workers, rate_share), **cache_params)
+
+    def _create_rate_limiter(self, params, max_concurrency, rate_share=1):
+        if not params.get(KEY_RATE_LIMIT):
+            return None
+        rate = float(params[KEY_RATE_LIMIT]) / rate_share
+        max_rate = float(params.get(KEY_RATE_LIMIT_MAX) or params[KEY_RATE_LIMIT]) / rate_share
+        logging.info('Requests limited to %s req/s', rate)
+        return AdaptiveRateLimiter(rate, max_rate=max_rate, max_concurrency=max_concurrency)
+
+    def _create_response_cache(self, params):
+        '''
+        Returns ResponseCache in the configured cache_dir, by default in the data folder, which does not outlive
+        the job - the responses are then reused only within the run (e.g. by overlapping datasets or lookback).
+        '''
+        if not params.get(KEY_CACHE_ENABLED):
+            return None
+        ttl = float(params[KEY_CACHE_TTL_HOURS]) * 3600 if params.get(KEY_CACHE_TTL_HOURS) else DEFAULT_TTL
+        max_size = int(params[KEY_CACHE_MAX_SIZE_MB]) * 1024 * 1024 if params.get(
+            KEY_CACHE_MAX_SIZE_MB) else DEFAULT_MAX_SIZE
+        cache_dir = params.get(KEY_CACHE_DIR) or os.path.join(self.data_path, 'cache')
+        logging.info('Caching responses in %s', cache_dir)
+        return ResponseCache(cache_dir, ttl, max_size)
+
+    def _build_run_plan(self, gemius_srv, params, from_date, to_date, state):
+        '''
+        Expands the datasets into the requests of the run - datasets x countries x periods x filter chunks.
+        Downloads only the available periods and the dimensions the requests depend on - metric names of manually
+        entered metric ids and node trees of the node subtree filters, no data.
+        '''
         datasets = params.get(KEY_DATASETS)
+        incremental = params.get(KEY_INCREMENTAL_FETCH)
+        lookback_days = int(params.get(KEY_INCREMENTAL_LOOKBACK_DAYS) or 0)
+        if params.get(KEY_ASYNC_CLIENT):
+            concurrency = int(params.get(KEY_MAX_IN_FLIGHT) or DEFAULT_MAX_IN_FLIGHT)
+        else:
+            concurrency = int(params.get(KEY_MAX_WORKERS) or 1)
+        rate_limit = float(params.get(KEY_RATE_LIMIT_MAX) or params.get(KEY_RATE_LIMIT) or 0) or None
+
+        plan = RunPlan(RequestHistory(state.get_request_history()), concurrency,
+                       int(params.get(KEY_PROCESS_WORKERS) or 0), rate_limit)
+
+        # all datasets share one available-periods download
+        period_catalogue = gemius_srv.get_period_catalogue()
 
-        result_files = []
         index = 0
         for dataset in datasets:
             p_type = dataset.get('period_type')
             logging.info(
-                'Downloading dataset %s in period %s - %s [%s]', dataset["dataset_type"], from_date, to_date, p_type)
+                'Planning dataset %s in period %s - %s [%s]', dataset["dataset_type"], from_date, to_date, p_type)
             index += 1
-            periods = gemius_srv.get_periods_in_interval(
-                from_date, to_date, p_type)
+            periods = period_catalogue.get_periods(from_date, to_date, p_type)
+
+            dataset_key = ExtractionState.dataset_key(dataset)
+            if incremental:
+                periods = state.filter_new_periods(dataset_key, periods, lookback_days)
 
             countries_no_period = [
                 c for c in periods.keys() if len(periods[c]) == 0]
@@ -77,15 +278,151 @@ class Component(KBCEnvHandler):
                 logging.warning(
                     'Some countries contain no specified periods [from:%s,to:%s] type:%s', from_date, to_date, p_type)
 
-            res = self.retrieve_n_save_dataset(
-                dataset, periods, index, gemius_srv)
-
-            result_files.extend(res)
+            filter_params = metrics = None
+            if dataset.get('dataset_type') == 'stats':
+                filter_params, metrics = self._get_stats_filters(dataset)
+                # resolved once over all countries of the dataset
+                metrics = self.resolve_metric_names(metrics, periods, gemius_srv)
+            units = gemius_srv.plan_dataset_requests(dataset.get('dataset_type'), periods,
+                                                     dataset.get('output_mode') or OUTPUT_MODE_FULL, filter_params)
+            plan.add(DatasetPlan(index, dataset, dataset_key, periods, units, filter_params, metrics))
+
+        estimate = plan.estimate()
+        logging.info('Planned %s requests, estimated %.1f MB in %.1f s (%s requests without history)',
+                     estimate['requests'], estimate['estimated_bytes'] / 1024 / 1024, estimate['estimated_seconds'],
+                     estimate['requests_without_history'])
+        return plan
+
+    def _retrieve_datasets(self, gemius_srv, plan, state):
+        '''
+        Retrieves the dataset x country groups of the plan. In the main process all the planned requests go through
+        one request queue of the service (max_workers / max_in_flight requests in flight across the groups), the
+        groups are written one after another in the config order. In the process pool the groups are distributed
+        over the processes, longest first.
+        '''
+        open_intervals = {ds.index: state.get_open_intervals(ds.dataset_key) for ds in plan.datasets}
 
-        logging.info('Building manifest files..')
-        self._process_results(result_files, self.cfg_params.get('bucket'))
+        result_files = []
+        units_stats = []
+        if plan.process_workers > 1:
+            groups = plan.queue()
+            work_units = [(ds.dataset, {country: ds.periods[country]}, ds.index, ds.metrics, ds.filter_params,
+                           self._get_group_open_intervals(open_intervals[ds.index], country))
+                          for ds, country in groups]
+            if work_units:
+                units_res, units_stats = self._retrieve_in_process_pool(work_units, plan.process_workers,
+                                                                        gemius_srv.client.session,
+                                                                        gemius_srv.client.metrics)
+                for (ds, _), unit_res in zip(groups, units_res):
+                    result_files.extend(self._store_open_intervals(state, ds.dataset_key, unit_res))
+        else:
+            groups = plan.groups()
+            with gemius_srv.shared_request_queue(unit for ds, country in groups for unit in ds.units[country]):
+                for ds, country in groups:
+                    res = self.retrieve_n_save_dataset(ds.dataset, {country: ds.periods[country]}, ds.index,
+                                                       gemius_srv, ds.metrics, ds.filter_params,
+                                                       self._get_group_open_intervals(open_intervals[ds.index],
+                                                                                      country))
+                    result_files.extend(self._store_open_intervals(state, ds.dataset_key, res))
+
+        for ds in plan.datasets:
+            state.update(ds.dataset_key, ds.periods)
+
+        client_stats = self._get_client_stats(gemius_srv.client)
+        if units_stats:
+            # the main process client sent only the planning requests
+            client_stats = self._sum_client_stats([client_stats] + units_stats)
+        return result_files, client_stats
+
+    @staticmethod
+    def _get_client_stats(client):
+        return {'response_cache': client.response_cache.stats() if client.response_cache else None,
+                'rate_limiter': client.rate_limiter.stats() if client.rate_limiter else None}
+
+    @staticmethod
+    def _sum_client_stats(units_stats):
+        '''
+        Sums the response cache and rate limiter stats of several clients. Only the counters are kept,
+        the current rate and concurrency of a limiter do not add up across the clients. The cache size is the largest
+        one seen by a client, the clients share the cache folder.
+        '''
+        total = {'response_cache': None, 'rate_limiter': None}
+        for unit_stats in units_stats:
+            cache, limiter = unit_stats['response_cache'], unit_stats['rate_limiter']
+            if cache:
+                total_cache = total['response_cache'] or {'hits': 0, 'misses': 0, 'evictions': 0, 'size_bytes': 0}
+                for key in ['hits', 'misses', 'evictions']:
+                    total_cache[key] += cache[key]
+                total_cache['size_bytes'] = max(total_cache['size_bytes'], cache['size_bytes'])
+                total['response_cache'] = total_cache
+            if limiter:
+                total_limiter = total['rate_limiter'] or {'requests': 0, 'throttled': 0, 'wait_time_s': 0}
+                for key in ['requests', 'throttled', 'wait_time_s']:
+                    total_limiter[key] += limiter[key]
+                total_limiter['wait_time_s'] = round(total_limiter['wait_time_s'], 3)
+                total['rate_limiter'] = total_limiter
+        cache = total['response_cache']
+        if cache:
+            lookups = cache['hits'] + cache['misses']
+            cache['hit_ratio'] = round(cache['hits'] / lookups, 3) if lookups else 0.0
+        return total
+
+    @staticmethod
+    def _get_group_open_intervals(dataset_open_intervals, country):
+        if country not in dataset_open_intervals:
+            return None
+        return {country: dataset_open_intervals[country]}
+
+    @staticmethod
+    def _store_open_intervals(state, dataset_key, res_files):
+        '''
+        Moves the open change intervals from the result metadata of the changes mode to the state.
+        '''
+        for res in res_files:
+            if 'open_intervals' in res:
+                state.set_open_intervals(dataset_key, res.pop('country'), res.pop('open_intervals'))
+        return res_files
 
-        logging.info('Extraction finished sucessfully!')
+    def _retrieve_in_process_pool(self, work_units, process_workers, session_token=None, metrics=None):
+        '''
+        Retrieves the dataset x country work units in a pool of processes, each with its own client
+        (starting with the session_token). Performance statistics of the workers are merged into metrics.
+        Returns list of the result files metadata of each unit and list of the response cache and rate limiter
+        stats of each unit, in the order of work_units.
+        '''
+        process_workers = min(process_workers, len(work_units))
+        logging.info('Retrieving %s work units in %s processes..', len(work_units), process_workers)
+        # spawned workers do not inherit the open sessions, threads and event loops of the parent
+        with ProcessPoolExecutor(max_workers=process_workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            # the workers run at once, each limited to its share of the configured rate
+            results = pool.map(_retrieve_work_unit, [self.data_path] * len(work_units), work_units,
+                               [session_token] * len(work_units), [process_workers] * len(work_units))
+            res_files = []
+            units_stats = []
+            for unit_res, unit_report, unit_client_stats, unit_artifacts in results:
+                res_files.append(unit_res)
+                units_stats.append(unit_client_stats)
+                if metrics is not None:
+                    metrics.merge(unit_report)
+                self._write_file_manifests(unit_artifacts, ['profiling'])
+            return res_files, units_stats
+
+    def retrieve_work_unit(self, dataset, periods, index, metrics=None, filter_params=None, open_intervals=None,
+                           session_token=None, rate_share=1):
+        '''
+        Retrieves single work unit with a new client, used by the process pool workers. The client is limited
+        to 1 / rate_share of the configured rate.
+        Returns the result files metadata, the performance report, the response cache and rate limiter stats
+        and the profiling files of the unit.
+        '''
+        profiler = self._create_profiler(self.cfg_params,
+                                         'profile-unit-{}-{}'.format(index, '-'.join(sorted(periods))))
+        with profiler, self._create_service(self.cfg_params, session_token, rate_share) as gemius_srv:
+            res = self.retrieve_n_save_dataset(dataset, periods, index, gemius_srv, metrics, filter_params,
+                                               open_intervals)
+        return (res, gemius_srv.client.metrics.to_dict(), self._get_client_stats(gemius_srv.client),
+                profiler.artifacts)
 
     def _process_results(self, res_files, output_bucket):
         for res in res_files:
@@ -95,6 +432,18 @@ class Component(KBCEnvHandler):
             else:
                 suffix = ''
 
+            if res.get('format') == OUTPUT_FORMAT_PARQUET:
+                self._write_file_manifests([res['full_path']], [dest_bucket + suffix, res['type'], 'parquet'],
+                                           is_permanent=True)
+                continue
+
+            if res.get('columns'):
+                # sliced table folder, slices carry no header
+                self.create_sliced_tables(res['name'], pkey=res['pkey'], incremental=True,
+                                          dest_bucket=dest_bucket + suffix, columns=res['columns'],
+                                          table_name=res['type'])
+                continue
+
             # build manifest
             self.configuration.write_table_manifest(
                 file_name=res['full_path'],
@@ -102,79 +451,107 @@ class Component(KBCEnvHandler):
                 primary_key=res['pkey'],
                 incremental=True)
 
-    def retrieve_n_save_dataset(self, dataset, periods, index, gemius_srv):
+    def retrieve_n_save_dataset(self, dataset, periods, index, gemius_srv, metrics=None, filter_params=None,
+                                open_intervals=None):
         dataset_type = dataset.get('dataset_type')
         if dataset_type == 'stats':
             res = self.retrieve_n_save_stats(
-                dataset, periods, index, gemius_srv)
+                dataset, periods, index, gemius_srv, metrics, filter_params)
         else:
             res = gemius_srv.get_n_save_dataset_in_available_periods(
-                dataset_type, self.tables_out_path, index, periods)
+                dataset_type, self.tables_out_path, index, periods,
+                output_mode=dataset.get('output_mode') or OUTPUT_MODE_FULL, open_intervals=open_intervals)
 
         return res
 
-    def retrieve_n_save_stats(self, dataset, periods, index, service):
-        filters = dataset.get('filters')
-        filter_dict = collections.OrderedDict()
-        met_filter = None
-        for f in filters:            
-            filter_dict.update(self._build_filter(f))
-            if f['filter'] == 'metric':
-                met_filter = f
-        
-        if not met_filter:
-            raise ValueError('Metrics must be defined for Stats dataset!!')
+    def retrieve_n_save_stats(self, dataset, periods, index, service, metrics=None, filter_params=None):
+        if filter_params is None or metrics is None:
+            filter_params, metrics = self._get_stats_filters(dataset)
+            metrics = self.resolve_metric_names(metrics, periods, service)
+
+        output_format = dataset.get('output_format') or OUTPUT_FORMAT_CSV
+        # Parquet files are not tables, they are stored in Storage Files
+        output_path = self.tables_out_path
+        if output_format == OUTPUT_FORMAT_PARQUET:
+            output_path = self.files_out_path
+            os.makedirs(output_path, exist_ok=True)
 
+        return service.get_n_save_stats_in_available_periods(output_path, index, periods, metrics,
+                                                             output_format=output_format, **filter_params)
+
+    def resolve_metric_names(self, metrics, periods, service):
+        '''
+        Returns list of {'id', 'name'} metrics of the stats dataset, names of manually entered metric ids (result
+        column names) are resolved from the metrics available in the periods.
+        '''
+        if any(m['name'] is None for m in metrics):
+            metrics = service.build_metrics_catalogue(periods).to_records([m['id'] for m in metrics])
+        return metrics
+
+    def _get_stats_filters(self, dataset):
+        '''
+        Returns the stats filter params and the list of {'id', 'name'} metrics (names None when entered manually),
+        each filter table is read once.
+        '''
+        met_filter = self._get_metric_filter(dataset)
         metrics = self._get_metrics(met_filter)
-        #all_periods = service.get_periods_in_interval(begin = None, end = None, period_type =None)
-        
-        #res = service.get_unique_available_metrics_in_periods(all_periods, filter_dict.get('metric'))
-        
-        
-        return service.get_n_save_stats_in_available_periods(self.tables_out_path, index, periods, metrics, **filter_dict)
+        filter_dict = collections.OrderedDict()
+        for f in dataset.get('filters'):
+            if f is met_filter:
+                filter_dict[f['filter']] = [m['id'] for m in metrics]
+            else:
+                filter_dict.update(self._build_filter(f))
+        return filter_dict, metrics
+
+    def _get_metric_filter(self, dataset):
+        for f in dataset.get('filters'):
+            if f['filter'] == 'metric':
+                return f
+        raise ValueError('Metrics must be defined for Stats dataset!!')
 
     def _get_metrics(self, met_filter):
         src = met_filter.get('source_table')
-        
-        
+
         if src.startswith('['):
-            # is manually entered
-            values = [{'id':v, 'name': 'N/A'} for v in ast.literal_eval(src)]
-            
-        else:
-            # is from table
-            table = super().get_input_table_by_name(src)
+            # is manually entered, names are resolved later
+            values = [{'id': v, 'name': None}
+                      for v in unique_values(ast.literal_eval(src), met_filter.get(KEY_FILTER_SORT))]
 
-            with open(table['full_path'], 'r') as input_:
-                reader = csv.reader(input_)
-                next(reader)
-                values = [{'id':row[0], 'name':row[1]} for row in reader]
+        else:
+            # is from table, names are in the column next to the ids unless specified
+            loader = self._get_filter_source_loader(met_filter)
+            values = [{'id': m_id, 'name': name}
+                      for m_id, name in loader.load_with(met_filter.get(KEY_FILTER_NAME_COLUMN))]
 
         return values
-    
+
     def _build_filter(self, filter_):
         key = filter_.get('filter')
         src = filter_.get('source_table')
 
         if src.startswith('['):
             # is manually entered
-            values = ast.literal_eval(src)
+            values = unique_values(ast.literal_eval(src), filter_.get(KEY_FILTER_SORT))
         else:
             # is from table
-            values = self._get_values_from_table(src)
+            values = self._get_filter_source_loader(filter_).load()
 
         return {key: values}
 
-    def _get_values_from_table(self, input_table_name):
-        table = super().get_input_table_by_name(input_table_name)
+    def _get_filter_source_loader(self, filter_):
+        table = super().get_input_table_by_name(filter_.get('source_table'))
+        return FilterSourceLoader(table['full_path'], column=filter_.get(KEY_FILTER_COLUMN),
+                                  sort=filter_.get(KEY_FILTER_SORT, False))
 
-        with open(table['full_path'], 'r') as input_:
-            reader = csv.reader(input_)
-            next(reader)
-            values = [row[0] for row in reader]
 
-        return values
 
+def _retrieve_work_unit(data_path, work_unit, session_token=None, rate_share=1):
+    '''
+    Process pool worker entrypoint.
+    '''
+    comp = Component(data_path)
+    comp.set_default_logger()
+    return comp.retrieve_work_unit(*work_unit, session_token=session_token, rate_share=rate_share)
 
 
 """
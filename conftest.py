@@ -0,0 +1 @@
+# makes the component packages (kbc, gemius) importable by the tests in tests/
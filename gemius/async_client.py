@@ -0,0 +1,172 @@
+'''
+Asyncio variant of the Gemius client.
+
+@author: esner
+'''
+import asyncio
+import logging
+
+import requests
+
+from gemius.client import GemiusRequestBuilder, DEAFULT_V1_BASE, ENDPOINT_OPEN_SESSION, ENDPOINT_AVAILABLE_PERIODS, \
+    ENDPOINT_STATS, SUPPORTED_ENDPOINTS, DEFAULT_CACHE_STATS_AFTER_DAYS, SESSION_RETRIES
+from gemius.period_catalogue import PeriodCatalogue
+from kbc.async_client_base import AsyncHttpClientBase, DEFAULT_MAX_IN_FLIGHT
+
+
+class AsyncClient(GemiusRequestBuilder, AsyncHttpClientBase):
+    '''
+    Same surface as gemius.client.Client, all request methods are coroutines returning fully read
+    BufferedResponse objects (or parsed JSON).
+
+    The login is performed lazily with the first request, so the client may be created outside of the event loop.
+    Expired sessions are renewed the same way as in gemius.client.Client.
+    '''
+    # marker used by ExtractorService to drive the client from its own event loop
+    is_async = True
+
+    def __init__(self, user, password, service_base_url=DEAFULT_V1_BASE, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 response_cache=None, cache_stats_after_days=DEFAULT_CACHE_STATS_AFTER_DAYS, rate_limiter=None,
+                 session_token=None, metrics=None):
+        '''
+
+        :param max_in_flight: maximum number of concurrent requests
+        :param response_cache: optional gemius.response_cache.ResponseCache, see gemius.client.Client
+        :param rate_limiter: optional kbc.rate_limit.AdaptiveRateLimiter shared by all requests of the client
+        :param session_token: optional token of a previously opened session, used instead of the login
+        :param metrics: optional kbc.instrumentation.PerformanceMetrics collecting the request statistics
+        '''
+        AsyncHttpClientBase.__init__(self, base_url=service_base_url, max_in_flight=max_in_flight,
+                                     rate_limiter=rate_limiter, metrics=metrics)
+        self.user = user
+        self.password = password
+        self.response_cache = response_cache
+        self.cache_stats_after_days = cache_stats_after_days
+        # (generation, token), see gemius.client.Client
+        self._session_state = (0, session_token)
+        self._login_lock = None
+
+    @property
+    def session(self):
+        return self._session_state[1]
+
+    async def _ensure_logged_in(self):
+        if self.session:
+            return
+        await self._relogin(self._session_state[0])
+
+    async def _relogin(self, expired_generation):
+        # created lazily so it is bound to the running loop
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if self._session_state[0] == expired_generation:
+                if self.session:
+                    logging.warning('Gemius session expired, logging in again..')
+                self._session_state = (expired_generation + 1, await self.login())
+
+    async def _request(self, method, url, params=None, **kwargs):
+        if self._is_login_request(url):
+            return await AsyncHttpClientBase._request(self, method, url, params=params, **kwargs)
+
+        attempt = 0
+        while True:
+            generation, session = self._session_state
+            r = await AsyncHttpClientBase._request(self, method, url, params=self._with_session(params, session),
+                                                   **kwargs)
+            if attempt >= SESSION_RETRIES or not self._is_session_expired(r):
+                r.client_retries += attempt
+                return r
+            await self._relogin(generation)
+            attempt += 1
+
+    async def login(self):
+        url = self.base_url + ENDPOINT_OPEN_SESSION
+        try:
+            r = await self.post(url, params=self._login_params())
+        except requests.HTTPError as e:
+            logging.error("Failed to perform login request!", exc_info=e)
+            raise e
+
+        return r.get('data').get('session')
+
+    async def get_available_periods(self, period_type=None, country=None, output='json'):
+        await self._ensure_logged_in()
+        url = self.base_url + ENDPOINT_AVAILABLE_PERIODS
+
+        params = self._available_periods_params(period_type, country, output)
+        if output == 'json':
+            return await self.get(url, params=params)
+        else:
+            return await self._get_raw(url, params)
+
+    async def get_all_available_periods(self, begin=None, end=None, period_type=None, country_list=None):
+        available_periods_raw = await self.get_available_periods(
+            period_type, output='csv')
+
+        return PeriodCatalogue.from_tsv(available_periods_raw.content).get_periods(begin, end, period_type,
+                                                                                   country_list)
+
+    async def get_stats_data(self, begin_period=None, end_period=None, country=None, output_type=None, stream=False,
+                             timeout=None, max_content_length=None, **additional_params):
+        '''
+        Get stats data, see gemius.client.Client.get_stats_data
+
+        The response is always read completely, stream is accepted for compatibility only.
+        '''
+        await self._ensure_logged_in()
+        url = self.base_url + ENDPOINT_STATS
+        params = self._stats_params(begin_period, end_period, country, output_type, **additional_params)
+
+        if output_type == 'JSON':
+            return await self.get(url, params=params)
+        else:
+            return await self._get_raw(url, params, **self._fail_fast_kwargs(timeout, max_content_length))
+
+    async def get_standard_dataset(self, endpoint_name, begin_period=None, end_period=None, country=None,
+                                   output_type=None, stream=False):
+        '''
+        get specified standard dataset [geos, available-periods,platforms,metrics,trees,nodes,demography]
+
+        output_type -- json,csv [default json]
+        '''
+        await self._ensure_logged_in()
+        url = self.base_url + endpoint_name
+
+        params = self._standard_params(begin_period, end_period, country, output_type)
+
+        if output_type == 'json':
+            return await self.get(url, params=params)
+        else:
+            return await self._get_raw(url, params)
+
+    async def get_dataset_generic(self, endpoint_name, begin_period=None, end_period=None, country=None,
+                                  output_type=None, stream=False, timeout=None, max_content_length=None,
+                                  **additional_params):
+        '''
+        generic get specified dataset. Responses of closed periods are served from the response cache if set.
+
+        output_type -- json,csv [default json]
+        timeout, max_content_length -- stats request limits, see gemius.client.Client.get_stats_data
+        '''
+        if self._is_cacheable(endpoint_name, end_period, output_type):
+            key, res = self._get_cached_response(endpoint_name, begin_period, end_period, country, additional_params)
+            if res is None:
+                res = await self._get_dataset(endpoint_name, begin_period, end_period, country, output_type, stream,
+                                              timeout, max_content_length, **additional_params)
+                self.response_cache.put(key, res.content, res.encoding)
+            return res
+
+        return await self._get_dataset(endpoint_name, begin_period, end_period, country, output_type, stream,
+                                       timeout, max_content_length, **additional_params)
+
+    async def _get_dataset(self, endpoint_name, begin_period, end_period, country, output_type, stream,
+                           timeout=None, max_content_length=None, **additional_params):
+        if endpoint_name == 'stats':
+            return await self.get_stats_data(begin_period, end_period, country, output_type, stream, timeout,
+                                             max_content_length, **additional_params)
+        elif endpoint_name in SUPPORTED_ENDPOINTS:
+            return await self.get_standard_dataset(endpoint_name, begin_period, end_period, country, output_type,
+                                                   stream)
+        else:
+            raise ValueError('Unsupported enpoint! [{}]'.format(endpoint_name))
@@ -0,0 +1,164 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+VALID_FROM = 'valid_from'
+VALID_TO = 'valid_to'
+
+# period columns appended to each dimension row: begin_period, end_period, period_type
+PERIOD_COLUMNS_COUNT = 3
+
+KEY_SEPARATOR = '\x1f'
+ATTRIBUTES_HASH_CHARS = 16
+
+
+class ChangeIntervalWriter():
+    '''
+    csv writer wrapper collapsing consecutive per-period snapshots of a dimension into change intervals.
+
+    Expects the rows written by ExtractorService._write_ds_resp_in_period: header first, then data rows ending with
+    the begin_period, end_period, period_type columns, ordered by period. Instead of one row per period it writes one
+    row per business key and interval of unchanged attributes, with valid_from (begin of the first period)
+    and valid_to (end of the last period) columns. A key missing in some period closes its interval.
+
+    The output is loaded incrementally with the business key and valid_from as the primary key, so the intervals
+    still open at the end of the previous run (open_intervals) are continued: an interval adjacent to or overlapping
+    (lookback) the first period of this run with the same attributes keeps its valid_from and the row (built from
+    the data of this run) replaces the previous one. Only the attributes hash and the validity of the open intervals
+    are kept between the runs, so an overlapping interval whose attributes were restated in the lookback periods
+    cannot be rewritten and keeps its previous valid_to.
+
+    finish() must be called after the last row to write the still open intervals.
+    '''
+
+    def __init__(self, writer, key_columns, open_intervals=None):
+        '''
+
+        :param writer: csv.writer
+        :param key_columns: business key columns, the rest of the columns (except period ones) are the attributes
+        :param open_intervals: intervals open at the end of the previous run as returned by open_intervals()
+        '''
+        self.writer = writer
+        self.key_columns = key_columns
+        self._key_idx = None
+        # key -> [data row, attributes hash, valid_from, valid_to], data is None for the intervals of the previous run
+        # not seen in this run yet
+        self._open = {}
+        self._period = None
+        self._period_keys = set()
+        self._previous = {}
+        for key, (attributes_hash, valid_from, valid_to) in (open_intervals or {}).items():
+            self._previous[tuple(key.split(KEY_SEPARATOR))] = [None, attributes_hash, _from_iso(valid_from),
+                                                                _from_iso(valid_to)]
+        # keys of the previous intervals overlapped by this run
+        self._overlapped = set()
+        self._restated = 0
+        self._last_open = None
+
+    def writerow(self, row):
+        if self._key_idx is None:
+            header = row[:-PERIOD_COLUMNS_COUNT]
+            missing = [c for c in self.key_columns if c not in header]
+            if missing:
+                raise ValueError('Key columns {} not found in the dataset header {}'.format(missing, header))
+            self._key_idx = [header.index(c) for c in self.key_columns]
+            self.writer.writerow(header + [VALID_FROM, VALID_TO])
+            return
+
+        data = row[:-PERIOD_COLUMNS_COUNT]
+        begin, end = row[-PERIOD_COLUMNS_COUNT], row[-PERIOD_COLUMNS_COUNT + 1]
+        if (begin, end) != self._period:
+            self._start_period((begin, end))
+
+        key = tuple(data[i] for i in self._key_idx)
+        attributes_hash = self._hash(data)
+        self._period_keys.add(key)
+
+        interval = self._open.get(key)
+        if interval is not None and interval[1] == attributes_hash:
+            interval[0] = data
+            interval[3] = end
+            return
+        if interval is not None:
+            self._write_interval(key, interval)
+        self._open[key] = [data, attributes_hash, begin, end]
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def finish(self):
+        if self._period is None:
+            # no period in this run, nothing is known about the open intervals
+            self._last_open = {key: list(interval) for key, interval in self._previous.items()}
+            return
+        self._start_period(None)
+        self._last_open = {}
+        for key, interval in self._open.items():
+            self._write_interval(key, interval)
+            self._last_open[key] = interval
+        self._open = {}
+        if self._restated:
+            logging.warning('%s intervals of the previous run changed in the lookback periods, their previous rows '
+                            'keep the original valid_to', self._restated)
+
+    def open_intervals(self):
+        '''
+        Returns {key: [attributes hash, valid_from, valid_to]} of the intervals open in the last period, to be
+        continued by the next run. Available after finish().
+        '''
+        return {KEY_SEPARATOR.join(key): [attributes_hash, _to_iso(valid_from), _to_iso(valid_to)]
+                for key, (data, attributes_hash, valid_from, valid_to) in (self._last_open or {}).items()}
+
+    def _start_period(self, period):
+        # close intervals of keys missing in the finished period
+        if self._period is not None:
+            for key in [k for k in self._open if k not in self._period_keys]:
+                self._write_interval(key, self._open.pop(key))
+        elif period is not None:
+            self._continue_previous(period[0])
+        self._period_keys = set()
+        self._period = period
+
+    def _continue_previous(self, first_begin):
+        '''
+        Opens the intervals of the previous run reaching at least the day before the first period, cut before it.
+        They are extended when the key continues with the same attributes. Intervals ending earlier were closed
+        by the previous run already.
+        '''
+        day_before = _from_iso(first_begin) - timedelta(days=1)
+        for key, (data, attributes_hash, valid_from, valid_to) in self._previous.items():
+            if valid_to >= day_before:
+                self._open[key] = [data, attributes_hash, valid_from, min(valid_to, day_before)]
+                if valid_to > day_before:
+                    self._overlapped.add(key)
+        self._previous = {}
+
+    def _write_interval(self, key, interval):
+        data, attributes_hash, valid_from, valid_to = interval
+        if data is None:
+            # interval of the previous run not continued, its row ending the day before this run is written already
+            if key in self._overlapped:
+                self._restated += 1
+            return
+        self.writer.writerow(data + [valid_from, valid_to])
+
+    @staticmethod
+    def _hash(data):
+        # compared only with the previous hash of the same key, 64 bits keep the state small
+        return hashlib.md5(KEY_SEPARATOR.join(data).encode('utf-8')).hexdigest()[:ATTRIBUTES_HASH_CHARS]
+
+
+def _from_iso(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def _to_iso(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
@@ -4,13 +4,12 @@ Created on 5. 10. 2018
 @author: esner
 '''
 import logging
+import threading
 import requests
+from datetime import datetime, date
 
-import pandas as pd
-from io import StringIO
-from io import BytesIO
-
-from kbc.client_base import HttpClientBase
+from kbc.client_base import HttpClientBase, BufferedResponse
+from gemius.period_catalogue import PeriodCatalogue
 
 DEAFULT_V1_BASE = 'https://api-audience.gemius.com/v1/'
 
@@ -25,38 +24,221 @@ ENDPOINT_DEMOGRAPHY = 'demography'
 ENDPOINT_TREES = 'trees'
 SUPPORTED_ENDPOINTS = [ENDPOINT_STATS, ENDPOINT_AVAILABLE_PERIODS, ENDPOINT_GEOS, ENDPOINT_PLATFORMS,
                        ENDPOINT_METRICS, ENDPOINT_NODES, ENDPOINT_DEMOGRAPHY, ENDPOINT_TREES]
+# endpoints whose data do not change once the period is over
+CACHEABLE_DIMENSION_ENDPOINTS = [ENDPOINT_GEOS, ENDPOINT_PLATFORMS, ENDPOINT_METRICS, ENDPOINT_NODES,
+                                 ENDPOINT_DEMOGRAPHY, ENDPOINT_TREES]
+# stats of periods ended at least this many days ago are considered final
+DEFAULT_CACHE_STATS_AFTER_DAYS = 7
+# responses of requests with an expired / invalid session
+SESSION_EXPIRED_STATUSES = (401, 403)
+# start of an error response body searched for a session related message
+SESSION_HINT_MAX_CHARS = 1000
+# max number of re-logins per request
+SESSION_RETRIES = 1
+
+
+class GemiusRequestBuilder:
+    '''
+    Request building and response parsing shared by the sync and async Gemius clients.
+    '''
+
+    def _login_params(self):
+        return {'login': self.user, 'password': self.password}
+
+    def _available_periods_params(self, period_type=None, country=None, output='json'):
+        params = {'period_type': period_type,
+                  'country': country,
+                  'output': output}
+        return params
+
+    def _stats_params(self, begin_period=None, end_period=None, country=None, output_type=None, **additional_params):
+        strict = False
+        multi_params = {}
+        multi_params.update({'geo': additional_params.pop('geo', {})})
+        multi_params.update(
+            {'platform': additional_params.pop('platform', {})})
+        multi_params.update({'node': additional_params.pop('node', {})})
+        multi_params.update({'metric': additional_params.pop('metric', {})})
+        multi_params.update({'target': additional_params.pop('target', {})})
+
+        single_params = {'begin': self._convert_date(begin_period),
+                         'end': self._convert_date(end_period),
+                         'output': output_type,
+                         'country': country,
+                         'strict': strict}
 
+        return self._build_params_with_duplicate_keys(
+            single_params, multi_params)
 
-class Client(HttpClientBase):
+    def _standard_params(self, begin_period=None, end_period=None, country=None, output_type=None):
+        params = {'begin': begin_period,
+                  'end': end_period,
+                  'output': output_type,
+                  'country': country}
+        return params
 
-    def __init__(self, user, password, service_base_url=DEAFULT_V1_BASE):
-        HttpClientBase.__init__(self, base_url=service_base_url)
-        self.user = user
-        self.password = password
-        self.session = self.login()
-        self.session_param = {'session': self.session}
+    def _is_login_request(self, url):
+        return url == self.base_url + ENDPOINT_OPEN_SESSION
+
+    def _with_session(self, params, session):
+        '''
+        Adds session token to the request params, the token is injected at request time so the requests
+        sent after a re-login use the new one.
+        '''
+        if isinstance(params, bytes):
+            return params + b'&session=' + str(session).encode('utf-8')
+        params = dict(params or {})
+        params['session'] = session
+        return params
+
+    def _is_session_expired(self, res):
+        '''
+        Detects responses rejecting the session token - 401/403 or an error mentioning the session.
+        '''
+        if res.status_code in SESSION_EXPIRED_STATUSES:
+            return True
+        if res.status_code >= 400:
+            return 'session' in res.text[:SESSION_HINT_MAX_CHARS].lower()
+        return False
+
+    @staticmethod
+    def _fail_fast_kwargs(timeout, max_content_length):
+        '''
+        Request kwargs of a stats request with limits, such request is not retried when it times out or its
+        response is too big, it raises kbc.client_base.HeavyRequestError instead.
+        '''
+        if timeout is None and max_content_length is None:
+            return {}
+        return {'fail_fast': True, 'timeout': timeout, 'max_content_length': max_content_length}
+
+    def _is_cacheable(self, endpoint_name, end_period, output_type):
+        if self.response_cache is None or output_type != 'csv' or end_period is None:
+            return False
+        if endpoint_name == ENDPOINT_STATS:
+            closed_after_days = self.cache_stats_after_days
+        elif endpoint_name in CACHEABLE_DIMENSION_ENDPOINTS:
+            closed_after_days = 0
+        else:
+            return False
+        end_date = date.fromisoformat(self._convert_date(end_period)[:10])
+        return (datetime.utcnow().date() - end_date).days > closed_after_days
+
+    def _get_cached_response(self, endpoint_name, begin_period, end_period, country, additional_params):
+        '''
+        Returns tuple (cache key, BufferedResponse or None when not cached)
+        '''
+        key = self.response_cache.make_key(endpoint_name, country, self._convert_date(begin_period),
+                                           self._convert_date(end_period), additional_params)
+        cached = self.response_cache.get(key)
+        if cached is None:
+            return key, None
+        content, encoding = cached
+        if self.metrics is not None:
+            self.metrics.record_cache_hit(endpoint_name, country, len(content))
+        return key, BufferedResponse(content, encoding=encoding, url=self.base_url + endpoint_name)
+
+    def _convert_date(self, date_obj):
+        if isinstance(date_obj, str):
+            return date_obj
+        else:
+            return date_obj.strftime("%Y-%m-%d")
+
+    def _build_params_with_duplicate_keys(self, params_dict, params_lists_dict):
+        
+        # single params
+        single_param_string = '&'.join([key + '=' + str(params_dict[key])
+                                  for key in params_dict.keys() if params_dict[key] is not None])
+
+        multi_param_string = '&'.join([self._build_multi_param_string(key, params_lists_dict[key])
+                                  for key in params_lists_dict.keys() if params_lists_dict[key]
+                                  ])
+        param_string = '&'.join([single_param_string, multi_param_string])
+        return param_string.encode('utf-8')
+
+    def _build_multi_param_string(self, key, values):
+        return '&'.join([key + '=' + str(value) for value in values])
 
 
+class Client(GemiusRequestBuilder, HttpClientBase):
+
+    def __init__(self, user, password, service_base_url=DEAFULT_V1_BASE, response_cache=None,
+                 cache_stats_after_days=DEFAULT_CACHE_STATS_AFTER_DAYS, rate_limiter=None, session_token=None,
+                 metrics=None, **pool_params):
+        '''
+        Logs in and keeps one pooled keep-alive HTTP session for all subsequent calls.
+
+        Requests rejected because of an expired session are retried after a re-login, only one thread logs in
+        while the others wait for the new session.
+
+        :param response_cache: optional gemius.response_cache.ResponseCache, csv responses of closed periods
+                               (dimensions and stats older than cache_stats_after_days) are then served from it
+        :param cache_stats_after_days: stats of periods that ended more days ago are cached
+        :param rate_limiter: optional kbc.rate_limit.AdaptiveRateLimiter shared by all requests of the client
+        :param session_token: optional token of a previously opened session, used instead of the login
+                              (e.g. stored from the last run), a new session is opened once it expires
+        :param metrics: optional kbc.instrumentation.PerformanceMetrics collecting the request statistics
+        :param pool_params: optional connection pool settings (pool_connections, pool_maxsize, pool_block)
+                            passed to the HttpClientBase.
+        '''
+        HttpClientBase.__init__(self, base_url=service_base_url, rate_limiter=rate_limiter, metrics=metrics,
+                                **pool_params)
+        self.user = user
+        self.password = password
+        self.response_cache = response_cache
+        self.cache_stats_after_days = cache_stats_after_days
+        self._login_lock = threading.Lock()
+        # (generation, token) replaced at once, the generation tells whether the session was renewed meanwhile
+        self._session_state = (0, session_token)
+        if not session_token:
+            try:
+                self._session_state = (1, self.login())
+            except Exception:
+                self.close()
+                raise
+
+    @property
+    def session(self):
+        return self._session_state[1]
 
     def login(self):
-        params = {'login': self.user, 'password': self.password}
-        url = DEAFULT_V1_BASE + ENDPOINT_OPEN_SESSION
+        url = self.base_url + ENDPOINT_OPEN_SESSION
         try:
-            r = self.post(url, params=params)
+            r = self.post(url, params=self._login_params())
         except requests.HTTPError as e:
             logging.error("Failed to perform login request!", exc_info=e)
             raise e
 
         return r.get('data').get('session')
 
+    def _relogin(self, expired_generation):
+        with self._login_lock:
+            # the others waiting for the lock use the session opened by the first one
+            if self._session_state[0] == expired_generation:
+                logging.warning('Gemius session expired, logging in again..')
+                self._session_state = (expired_generation + 1, self.login())
+
+    def _request(self, method, url, *args, **kwargs):
+        if self._is_login_request(url):
+            return HttpClientBase._request(self, method, url, *args, **kwargs)
+
+        params = kwargs.pop('params', None)
+        attempt = 0
+        while True:
+            generation, session = self._session_state
+            r = HttpClientBase._request(self, method, url, *args, params=self._with_session(params, session),
+                                        **kwargs)
+            if attempt >= SESSION_RETRIES or not self._is_session_expired(r):
+                r.client_retries = getattr(r, 'client_retries', 0) + attempt
+                return r
+            r.close()
+            self._relogin(generation)
+            attempt += 1
+
     def get_available_periods(self, period_type=None, country=None, output='json'):
 
-        url = DEAFULT_V1_BASE + ENDPOINT_AVAILABLE_PERIODS
+        url = self.base_url + ENDPOINT_AVAILABLE_PERIODS
 
-        params = {'period_type': period_type,
-                  'country': country,
-                  'output': output}
-        params.update(self.session_param)
+        params = self._available_periods_params(period_type, country, output)
         if output == 'json':
             return self.get(url, params=params)
         else:
@@ -66,33 +248,12 @@ class Client(HttpClientBase):
         available_periods_raw = self.get_available_periods(
             period_type, output='csv')
 
-        # use pandas DataFrame for simolicity in this case
-        date_periods_df = pd.read_table(BytesIO(
-            available_periods_raw.content), infer_datetime_format=True, parse_dates=['begin', 'end'])
-
-        if begin and end:
-            date_periods_df = date_periods_df[(date_periods_df['begin'] >= begin) & (date_periods_df['begin'] < end)]                
-
-        if country_list and country_list[0] is not None:
-            date_periods_df = date_periods_df[date_periods_df['country']
-                                              in country_list]
-
-        countries = date_periods_df['country'].drop_duplicates()
-        periods_result = {}
-        for country in countries:
-            # API filter not working, filter period type in code
-            periods_result[country] = self._filter_period(date_periods_df, country, period_type)
-
-        return periods_result
-
-    def _filter_period(self, period_df, country, period_type = None):
-        if not period_type or period_type=='all':
-            return period_df.loc[(period_df['country'] == country), ['begin', 'end', 'period type']].to_dict('records')
-        else:
-            return period_df.loc[(period_df['country'] == country) &
-                                                          (period_df['period type'] == period_type), ['begin', 'end', 'period type']].to_dict('records')
+        # API filter not working, filter period type in code
+        return PeriodCatalogue.from_tsv(available_periods_raw.content).get_periods(begin, end, period_type,
+                                                                                   country_list)
 
-    def get_stats_data(self, begin_period=None, end_period=None, country=None, output_type=None, **additional_params):
+    def get_stats_data(self, begin_period=None, end_period=None, country=None, output_type=None, stream=False,
+                       timeout=None, max_content_length=None, **additional_params):
         '''
         Get stats data.
 
@@ -100,6 +261,11 @@ class Client(HttpClientBase):
         :param end_period: Optional end of end period.
         :param country: Optional country.
         :param output_type: Optional 'json' or 'csv'.
+        :param stream: if True the csv response body is not downloaded immediately, consume it from res.raw
+        :param timeout: Optional read timeout in seconds. When timeout or max_content_length is set the request
+                        raises kbc.client_base.HeavyRequestError instead of being retried once it times out
+                        (or gets HTTP 504) or its Content-Length exceeds max_content_length.
+        :param max_content_length: Optional max response size in bytes.
         :param geo List of selected geolocation ids. Optional. When missing, statistics are listed for all possible values. .
         :param platform  List of selected platform. Optional. When missing, statistics are listed for all possible values. 
         :param node  List of selected node ids. Optional. When missing, statistics are listed for all possible values. 
@@ -113,84 +279,60 @@ class Client(HttpClientBase):
         :rtype: requests.Response if output_type == 'csv' else JSON dictionary
 
         '''
-        url = DEAFULT_V1_BASE + ENDPOINT_STATS
-        strict = False
-        multi_params = {}
-        multi_params.update({'geo': additional_params.pop('geo', {})})
-        multi_params.update(
-            {'platform': additional_params.pop('platform', {})})
-        multi_params.update({'node': additional_params.pop('node', {})})
-        multi_params.update({'metric': additional_params.pop('metric', {})})
-        multi_params.update({'target': additional_params.pop('target', {})})
-
-        single_params = {'begin': self._convert_date(begin_period),
-                         'end': self._convert_date(end_period),
-                         'output': output_type,
-                         'country': country,
-                         'strict': strict}
-
-        single_params.update(self.session_param)
-
-        params = self._build_params_with_duplicate_keys(
-            single_params, multi_params)
+        url = self.base_url + ENDPOINT_STATS
+        params = self._stats_params(begin_period, end_period, country, output_type, **additional_params)
 
         if output_type == 'JSON':
             return self.get(url, params=params)
         else:
-            return self._get_raw(url, params)
-
-    def _convert_date(self, date_obj):
-        if isinstance(date_obj, str):
-            return date_obj
-        else:
-            return date_obj.strftime("%Y-%m-%d")
-
-    def _build_params_with_duplicate_keys(self, params_dict, params_lists_dict):
-        
-        # single params
-        single_param_string = '&'.join([key + '=' + str(params_dict[key])
-                                  for key in params_dict.keys() if params_dict[key] is not None])
+            return self._get_raw(url, params, stream=stream, **self._fail_fast_kwargs(timeout, max_content_length))
 
-        multi_param_string = '&'.join([self._build_multi_param_string(key, params_lists_dict[key])
-                                  for key in params_lists_dict.keys() if params_lists_dict[key]
-                                  ])
-        param_string = '&'.join([single_param_string, multi_param_string])
-        return param_string.encode('utf-8')
-
-    def _build_multi_param_string(self, key, values):
-        return '&'.join([key + '=' + str(value) for value in values])
-
-    def get_standard_dataset(self, endpoint_name, begin_period=None, end_period=None, country=None, output_type=None):
+    def get_standard_dataset(self, endpoint_name, begin_period=None, end_period=None, country=None, output_type=None,
+                             stream=False):
         '''
         get specified standard dataset [geos, available-periods,platforms,metrics,trees,nodes,demography]
 
         output_type -- json,csv [default json]
+        stream -- if True the csv response body is not downloaded immediately, consume it from res.raw
         '''
 
-        url = DEAFULT_V1_BASE + endpoint_name
+        url = self.base_url + endpoint_name
 
-        params = {'begin': begin_period,
-                  'end': end_period,
-                  'output': output_type,
-                  'country': country}
-        params.update(self.session_param)
+        params = self._standard_params(begin_period, end_period, country, output_type)
 
         # special case for stats data
 
         if output_type == 'json':
             return self.get(url, params=params)
         else:
-            return self._get_raw(url, params)
+            return self._get_raw(url, params, stream=stream)
 
-    def get_dataset_generic(self, endpoint_name, begin_period=None, end_period=None, country=None, output_type=None, **additional_params):
+    def get_dataset_generic(self, endpoint_name, begin_period=None, end_period=None, country=None, output_type=None,
+                            stream=False, timeout=None, max_content_length=None, **additional_params):
         '''
-        generic get specified dataset
+        generic get specified dataset. Responses of closed periods are served from the response cache if set.
 
         output_type -- json,csv [default json]
+        timeout, max_content_length -- stats request limits, see get_stats_data
         '''
+        if self._is_cacheable(endpoint_name, end_period, output_type):
+            key, res = self._get_cached_response(endpoint_name, begin_period, end_period, country, additional_params)
+            if res is None:
+                # cached responses are always downloaded completely
+                res = self._get_dataset(endpoint_name, begin_period, end_period, country, output_type, False,
+                                        timeout, max_content_length, **additional_params)
+                self.response_cache.put(key, res.content, res.encoding)
+            return res
+
+        return self._get_dataset(endpoint_name, begin_period, end_period, country, output_type, stream,
+                                 timeout, max_content_length, **additional_params)
+
+    def _get_dataset(self, endpoint_name, begin_period, end_period, country, output_type, stream, timeout=None,
+                     max_content_length=None, **additional_params):
         if endpoint_name == 'stats':
-            return self.get_stats_data(begin_period, end_period, country, output_type, **additional_params)
+            return self.get_stats_data(begin_period, end_period, country, output_type, stream, timeout,
+                                       max_content_length, **additional_params)
         elif endpoint_name in SUPPORTED_ENDPOINTS:
-            return self.get_standard_dataset(endpoint_name, begin_period, end_period, country, output_type)
+            return self.get_standard_dataset(endpoint_name, begin_period, end_period, country, output_type, stream)
         else:
             raise ValueError('Unsupported enpoint! [{}]'.format(endpoint_name))
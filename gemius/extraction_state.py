@@ -0,0 +1,112 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+KEY_LAST_PERIODS = 'last_periods'
+# encrypted by the platform (# prefix)
+KEY_SESSION = '#session'
+KEY_SESSION_OWNER = 'session_owner'
+# response size and latency of past requests, see gemius.run_plan.RequestHistory
+KEY_REQUEST_HISTORY = 'request_history'
+# change intervals open at the end of the last run, see gemius.change_tracking.ChangeIntervalWriter
+KEY_OPEN_INTERVALS = 'open_intervals'
+
+KEY_PERIOD_BEGIN = 'begin'
+
+
+class ExtractionState():
+    '''
+    Keeps begin of the last successfully extracted period per dataset and country, persisted in the component
+    state file between runs.
+
+    State structure: {"last_periods": {"<dataset key>": {"<country>": "<iso begin of the last period>"}}}
+
+    Also keeps the API session token of the last run, so it can be reused instead of a new login, the request
+    history the run plan estimates are based on and the open change intervals of the datasets in the changes mode:
+    {"open_intervals": {"<dataset key>": {"<country>": {"<key>": [attributes hash, valid_from, valid_to]}}}}
+    '''
+
+    def __init__(self, state=None):
+        self.state = dict(state or {})
+        self._last_periods = dict(self.state.get(KEY_LAST_PERIODS) or {})
+
+    @staticmethod
+    def dataset_key(dataset):
+        '''
+        Identifies dataset by its type, period type and filters, so changing the filters starts a new extraction.
+        '''
+        filters_hash = hashlib.md5(json.dumps(dataset.get('filters') or [], sort_keys=True).encode('utf-8'))
+        return '{}-{}-{}'.format(dataset.get('dataset_type'), dataset.get('period_type'),
+                                 filters_hash.hexdigest()[:10])
+
+    @staticmethod
+    def session_owner(user, base_url):
+        '''
+        Identifies the account the session belongs to, the token is not reused after credentials change.
+        '''
+        return hashlib.md5('{}@{}'.format(user, base_url).encode('utf-8')).hexdigest()
+
+    def get_session(self, owner):
+        '''
+        Returns session token stored for the owner, None if there is none.
+        '''
+        if self.state.get(KEY_SESSION_OWNER) != owner:
+            return None
+        return self.state.get(KEY_SESSION) or None
+
+    def set_session(self, owner, token):
+        self.state[KEY_SESSION_OWNER] = owner
+        self.state[KEY_SESSION] = token
+
+    def get_request_history(self):
+        return dict(self.state.get(KEY_REQUEST_HISTORY) or {})
+
+    def set_request_history(self, history):
+        self.state[KEY_REQUEST_HISTORY] = history
+
+    def get_open_intervals(self, dataset_key):
+        '''
+        Returns {country: open intervals} of the dataset stored by the last run.
+        '''
+        return dict((self.state.get(KEY_OPEN_INTERVALS) or {}).get(dataset_key) or {})
+
+    def set_open_intervals(self, dataset_key, country, intervals):
+        self.state.setdefault(KEY_OPEN_INTERVALS, {}).setdefault(dataset_key, {})[country] = intervals
+
+    def filter_new_periods(self, dataset_key, periods, lookback_days=0):
+        '''
+        Returns periods dictionary (as returned by ExtractorService.get_periods_in_interval) containing only periods
+        beginning after the last extracted period minus lookback_days.
+        '''
+        last_periods = self._last_periods.get(dataset_key, {})
+        new_periods = {}
+        for country, country_periods in periods.items():
+            last_begin = last_periods.get(country)
+            if last_begin is None:
+                new_periods[country] = country_periods
+                continue
+            since = datetime.fromisoformat(last_begin) - timedelta(days=lookback_days)
+            new_periods[country] = [p for p in country_periods if p[KEY_PERIOD_BEGIN] > since]
+        return new_periods
+
+    def update(self, dataset_key, periods):
+        '''
+        Marks all periods as extracted.
+        '''
+        last_periods = self._last_periods.setdefault(dataset_key, {})
+        for country, country_periods in periods.items():
+            if not country_periods:
+                continue
+            last_begin = max(p[KEY_PERIOD_BEGIN] for p in country_periods)
+            if country not in last_periods or datetime.fromisoformat(last_periods[country]) < last_begin:
+                last_periods[country] = last_begin.isoformat()
+
+    def to_dict(self):
+        state = dict(self.state)
+        state[KEY_LAST_PERIODS] = self._last_periods
+        return state
@@ -6,9 +6,28 @@ Created on 9. 10. 2018
 
 import csv
 import os
+import shutil
 
+import asyncio
+import collections
+import hashlib
 import io
-import pandas as pd
+import itertools
+import logging
+import time
+from operator import itemgetter
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from kbc.sliced_writer import SlicedFileWriter, DEFAULT_SLICE_MAX_ROWS, DEFAULT_SLICE_MAX_BYTES
+from kbc.parquet_writer import ParquetRowWriter
+from kbc.client_base import HeavyRequestError
+from gemius.stats_planner import StatsRequestPlanner
+from gemius.period_catalogue import PeriodCatalogue
+from gemius.metrics_catalogue import MetricsCatalogue
+from gemius.change_tracking import ChangeIntervalWriter, VALID_FROM
+from gemius.node_tree import NodeTreeIndex, NODE_SUBTREE_FILTER
+from gemius.run_plan import RequestUnit
 
 PERIOD_HEADER = ['begin_period', 'end_period', 'period_type']
 
@@ -17,9 +36,14 @@ KEY_PERIOD_END = 'end'
 KEY_PERIOD_TYPE = 'period type'
 
 ENDPOINT_DEMOGRAPHY = 'demography'
+ENDPOINT_METRICS = 'metrics'
 DEMOGRAPHY_TRAITS_HEADER = 'continuous\tid\tname'
 DEMOGRAPHY_ASNWERS_HEADER = 'id\tname\ttrait_id'
 DEMOGRAPHY_DFTS_HEADER = 'max\tmin\ttrait_id'
+# demography response sections by their header line, in the order of the result files
+DEMOGRAPHY_SECTIONS = collections.OrderedDict([(DEMOGRAPHY_TRAITS_HEADER, 'traits'),
+                                               (DEMOGRAPHY_ASNWERS_HEADER, 'answers'),
+                                               (DEMOGRAPHY_DFTS_HEADER, 'defaults')])
 
 STATS_BASE_HEADER = ['geo_id', 'node_id', 'platform_id', 'target_group']
 
@@ -30,34 +54,132 @@ DS_PKEYS = {"nodes": DEFAULT_DS_PKEY + ['parent_id'],
             "geos": DEFAULT_DS_PKEY + ['parent_id'],
             "platforms": DEFAULT_DS_PKEY + ['parent_id']
             }
+# dimension datasets output modes
+OUTPUT_MODE_FULL = 'full'
+# one row per key and interval of unchanged attributes (valid_from, valid_to)
+OUTPUT_MODE_CHANGES = 'changes'
+# only the last available period snapshot
+OUTPUT_MODE_LATEST = 'latest'
+OUTPUT_MODES = [OUTPUT_MODE_FULL, OUTPUT_MODE_CHANGES, OUTPUT_MODE_LATEST]
+CHANGE_TRACKED_DATASETS = ['nodes', 'geos', 'platforms', 'trees']
+# tracked as attributes in the changes mode, e.g. re-parenting a node is a change of the node
+CHANGE_ATTRIBUTE_COLUMNS = ['parent_id']
+
 STATS_PKEY = ['geo_id', 'node_id', 'platform_id', 'target_group',
               'begin_period', 'end_period', 'period_type']
 
+# stats output formats
+OUTPUT_FORMAT_CSV = 'csv'
+# typed Parquet file, metric columns as doubles
+OUTPUT_FORMAT_PARQUET = 'parquet'
+OUTPUT_FORMATS = [OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_PARQUET]
+# low cardinality stats columns stored dictionary encoded in Parquet
+STATS_DICTIONARY_COLUMNS = STATS_BASE_HEADER + ['country', 'filter'] + PERIOD_HEADER
+
 
 class ExtractorService():
 
-    def __init__(self, client):
+    def __init__(self, client, max_workers=1, stream=False, stats_planner=None, sliced_output=False,
+                 slice_max_rows=DEFAULT_SLICE_MAX_ROWS, slice_max_bytes=DEFAULT_SLICE_MAX_BYTES):
+        '''
+
+        :param client: gemius.client.Client or gemius.async_client.AsyncClient instance. The async client is driven
+                       from the service's own event loop, requests are then bounded by the client's max_in_flight
+                       instead of max_workers.
+        :param max_workers: max number of period requests fetched in parallel (per country). The client's connection
+                            pool should be at least this big.
+        :param stream: if True the responses are requested with stream=True and the response lines are fed straight
+                       into the output writers, so the memory does not grow with the response size. Each pending
+                       streamed response holds a pooled connection, the pool should have max_workers + 1 connections.
+        :param stats_planner: gemius.stats_planner.StatsRequestPlanner splitting large stats filters into multiple
+                              requests, default limits are used when not specified.
+        :param sliced_output: if True the stats and dimension results are written as sliced tables - folders of gzip
+                              compressed slices without header, the result metadata then contain 'columns'.
+        :param slice_max_rows: max rows in one slice
+        :param slice_max_bytes: max uncompressed size of one slice
+        '''
         self.client = client
+        self.max_workers = max(1, int(max_workers or 1))
+        self.stream = stream
+        self.stats_planner = stats_planner or StatsRequestPlanner()
+        self.sliced_output = sliced_output
+        self.slice_max_rows = slice_max_rows
+        self.slice_max_bytes = slice_max_bytes
+        self._period_catalogue = None
+        # (country, begin, end) -> NodeTreeIndex, periods with identical trees share one index
+        self._node_trees = {}
+        self._node_trees_by_digest = {}
+        # statistics of the written rows go to the client's metrics collector
+        self.metrics = getattr(client, 'metrics', None)
+        self.is_async = getattr(client, 'is_async', False)
+        self._loop = asyncio.new_event_loop() if self.is_async else None
+        # responses of the shared_request_queue() in progress
+        self._shared_responses = None
+
+    def close(self):
+        '''
+        Closes the client (and the event loop in async mode).
+        '''
+        if self.is_async:
+            self._loop.run_until_complete(self.client.close())
+            self._loop.close()
+        else:
+            self.client.close()
 
-    def _get_ds_pkey(self, ds_type):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _call(self, client_method, *args, **kwargs):
+        '''
+        Calls client method, in async mode runs the returned coroutine to completion.
+        '''
+        res = client_method(*args, **kwargs)
+        if self.is_async:
+            res = self._loop.run_until_complete(res)
+        return res
+
+    def _get_ds_pkey(self, ds_type, output_mode=OUTPUT_MODE_FULL):
         if DS_PKEYS.get(ds_type):
-            return DS_PKEYS[ds_type]
+            pkey = DS_PKEYS[ds_type]
         else:
-            return DEFAULT_DS_PKEY
+            pkey = DEFAULT_DS_PKEY
+
+        if output_mode == OUTPUT_MODE_CHANGES:
+            return self._get_change_key(pkey) + [VALID_FROM]
+        elif output_mode == OUTPUT_MODE_LATEST:
+            # snapshot replaces the previous one in the incrementally loaded table
+            return self._get_business_key(pkey)
+        return pkey
+
+    @staticmethod
+    def _get_business_key(pkey):
+        return [col for col in pkey if col not in PERIOD_HEADER]
 
-    def get_n_save_stats_in_available_periods(self, output_folder_path, file_uid, periods, metrics, **filter_params):
+    @classmethod
+    def _get_change_key(cls, pkey):
+        return [col for col in cls._get_business_key(pkey) if col not in CHANGE_ATTRIBUTE_COLUMNS]
+
+    def get_n_save_stats_in_available_periods(self, output_folder_path, file_uid, periods, metrics,
+                                              output_format=OUTPUT_FORMAT_CSV, **filter_params):
         '''
         Get stats data and save to specified folder
         :param output_folder_path: output folder to save result file
         :param metrics: list of metric columns to expect in form [name] - names must match exactly the names of columns in filter
         :param file_uid: unique identifier to be added to the result file name
                     so there are no conflicts when iterating multiple_times with different settings (content agnostic)
+        :param output_format: csv (default) or parquet - typed Parquet file per country, metrics as doubles,
+                    dimension, country, filter and period columns dictionary encoded. Sliced output applies to csv only.
         :param country: Optional country.
         :param output_type: Optional 'json' or 'csv'.
         :param geo List of selected geolocation ids. Optional. When missing, statistics are listed for all possible values. .
         :param platform  List of selected platform. Optional. When missing, statistics are listed for all possible values.
         :param node  List of selected node ids. Optional. When missing, statistics are listed for all possible values.
         :param metric  List of selected selected metric. Optional. When missing, values for all metrics are shown.
+        :param node_subtree  List of node subtrees in form root_id or root_id:depth. Optional. Expanded into
+                        the node ids by the node tree of each country and period (added to the node filter).
         :param target  List of  selected target group. Optional. When missing, statistics are listed for target group "Population".
                         One target group is described by string with two parts separated by semicolon (';'):
                         [name] - name of target group. It will be shown in results. Optional. When missing, definition will be used.
@@ -65,71 +187,145 @@ class ExtractorService():
 
         '''
 
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError('Unsupported output format "{}", supported formats: {}'.format(output_format,
+                                                                                            OUTPUT_FORMATS))
         res_files = []
         country_list = periods.keys()
 
         append_headers = ['country', 'filter']
 
         # clean metric names
-        header_cleaned = [col['name'].replace('%', 'prc') for col in
-                          metrics] + append_headers + STATS_BASE_HEADER + PERIOD_HEADER
+        metric_columns = [col['name'].replace('%', 'prc') for col in metrics]
+        header_cleaned = metric_columns + append_headers + STATS_BASE_HEADER + PERIOD_HEADER
 
         for country in country_list:
             # build additional data
             append_data = {'country': country,
                            'filter': str(filter_params)}
+            # split large filters, results of all chunks end up in the same file
+            params_chunks = self._get_params_chunks('stats', country, periods.get(country), filter_params)
+            if not callable(params_chunks) and len(params_chunks) > 1:
+                logging.info('Stats filters of %s split into %s requests per period', country, len(params_chunks))
 
             file_path = os.path.join(
-                output_folder_path, 'stats' + '-' + str(file_uid) + '-' + country + '.csv')
+                output_folder_path, 'stats' + '-' + str(file_uid) + '-' + country + '.' + output_format)
 
-            with open(file_path, 'w+', newline='', encoding='utf-8') as out_file:
-                writer = csv.DictWriter(out_file, delimiter=',',
-                                        quotechar='"', quoting=csv.QUOTE_MINIMAL, fieldnames=header_cleaned,
-                                        extrasaction='ignore')
+            if output_format == OUTPUT_FORMAT_PARQUET:
+                out_file = writer = ParquetRowWriter(file_path, numeric_columns=metric_columns,
+                                                     dictionary_columns=STATS_DICTIONARY_COLUMNS)
+            else:
+                out_file = self._open_output(file_path)
+                writer = csv.writer(out_file, delimiter=',',
+                                    quotechar='"', quoting=csv.QUOTE_MINIMAL)
 
+            with out_file:
                 self._get_n_write_ds_in_periods_in_country(
-                    'stats', writer, periods, country, append_headers, append_data, type_='Stats', **filter_params)
-
-            # remove if empty
-            if os.stat(out_file.name).st_size > 0:
-                res_files += [{'full_path': file_path,
-                               'type': 'stats',
-                               'name': os.path.basename(out_file.name),
-                               'pkey': STATS_PKEY}]
-            else:
-                os.remove(out_file)
+                    'stats', writer, periods, country, append_headers, append_data, type_='Stats',
+                    params_chunks=params_chunks, fieldnames=header_cleaned)
+
+            res_files += self._build_result(out_file, 'stats', STATS_PKEY)
 
         return res_files
 
+    def _plan_subtree_filters(self, country, period_list, filter_params, subtree_specs):
+        '''
+        Returns function period -> list of stats request params, with the node subtrees expanded by the node tree
+        of the period and added to the node filter. Periods where none of the subtree roots exist get no requests,
+        an empty node filter would select all the nodes.
+        '''
+        trees = self.get_node_trees(country, period_list)
+        plans = {}
+        node_counts = []
+        missing_roots = set()
+        last_nodes = last_plan = None
+        for period in period_list:
+            node_ids, missing = trees[self._period_key(period)].expand(subtree_specs)
+            missing_roots.update(missing)
+            # explicitly listed nodes go first
+            nodes = list(collections.OrderedDict.fromkeys(list(filter_params.get('node') or []) + node_ids))
+            if nodes != last_nodes:
+                last_nodes = nodes
+                last_plan = self.stats_planner.plan(dict(filter_params, node=nodes)) if nodes else []
+            plans[self._period_key(period)] = last_plan
+            node_counts.append(len(nodes))
+
+        if missing_roots:
+            logging.warning('Node subtree roots %s not found in the node tree of some %s periods',
+                            sorted(missing_roots), country)
+        logging.info('Node subtrees of %s expanded into %s - %s nodes per period', country,
+                     min(node_counts, default=0), max(node_counts, default=0))
+        return lambda period: plans[self._period_key(period)]
+
+    def get_node_trees(self, country, period_list):
+        '''
+        Returns {(begin, end): NodeTreeIndex} of the country periods. The nodes of each period are downloaded
+        once per service instance.
+        '''
+        def get_nodes(period):
+            return self.client.get_dataset_generic('nodes', period[KEY_PERIOD_BEGIN], period[KEY_PERIOD_END], country,
+                                                   output_type='csv')
+
+        new_periods = [p for p in period_list if (country,) + self._period_key(p) not in self._node_trees]
+        for period, res in self._map_ordered(get_nodes, new_periods):
+            digest = hashlib.md5(res.content).hexdigest()
+            tree = self._node_trees_by_digest.get(digest)
+            if tree is None:
+                tree = self._node_trees_by_digest[digest] = NodeTreeIndex.from_tsv(res.content)
+            self._node_trees[(country,) + self._period_key(period)] = tree
+        return {self._period_key(p): self._node_trees[(country,) + self._period_key(p)] for p in period_list}
+
+    @staticmethod
+    def _period_key(period):
+        return period[KEY_PERIOD_BEGIN], period[KEY_PERIOD_END]
+
+    def get_period_catalogue(self):
+        '''
+        Returns catalogue of all available periods, downloaded once per service instance.
+        '''
+        if self._period_catalogue is None:
+            res = self._call(self.client.get_available_periods, output='csv')
+            self._period_catalogue = PeriodCatalogue.from_tsv(res.content)
+            logging.info('Loaded %s available periods in %s countries', self._period_catalogue.size,
+                         len(self._period_catalogue.countries))
+        return self._period_catalogue
+
     def get_periods_in_interval(self, begin=None, end=None, period_type='daily', country_list=None):
-        return self.client.get_all_available_periods(
-            begin, end, period_type, country_list)
+        return self.get_period_catalogue().get_periods(begin, end, period_type, country_list)
 
-    def get_unique_available_metrics_in_periods(self, periods, metric_ids=None):
-        country_list = periods.keys()
+    def build_metrics_catalogue(self, periods):
+        '''
+        Builds catalogue of metrics available in the periods. Each distinct country and period is requested once,
+        in parallel when max_workers > 1 (or with the async client).
 
-        resdf = None
+        periods -- dictionary with periods as returned by @self.get_periods_in_interval
+        '''
+        metric_requests = collections.OrderedDict.fromkeys(
+            (country, period[KEY_PERIOD_BEGIN], period[KEY_PERIOD_END])
+            for country in periods.keys() for period in periods.get(country))
 
-        for country in country_list:
-            for period in periods.get(country):
-                res = self.client.get_standard_dataset('metrics', begin_period=period[KEY_PERIOD_BEGIN],
-                                                       end_period=period[KEY_PERIOD_END], output_type='csv')
-                if resdf is None:
-                    resdf = pd.read_table(io.BytesIO(res.content))
-                else:
-                    resdf.append(pd.read_table(io.BytesIO(res.content)))
+        def get_metrics(request):
+            country, begin, end = request
+            return self.client.get_dataset_generic(ENDPOINT_METRICS, begin, end, country, output_type='csv')
 
-        resdf = resdf[['id', 'name']].drop_duplicates()
+        catalogue = MetricsCatalogue()
+        for request, res in self._map_ordered(get_metrics, metric_requests):
+            catalogue.add_response(res.content)
 
-        if metric_ids:
-            s = pd.Series(metric_ids, name='id')
-            resdf = resdf[resdf['id'].isin(metric_ids)]
-            if not s.isin(resdf['id']):
-                raise ValueError('Some metric IDs are not valid! {}')
+        logging.info('Loaded %s metrics from %s responses (%s unique)', len(catalogue), catalogue.responses,
+                     catalogue.unique_responses)
+        return catalogue
 
-        return resdf.to_dict('records')
+    def get_unique_available_metrics_in_periods(self, periods, metric_ids=None):
+        '''
+        Returns list of {'id', 'name'} dicts of metrics available in the periods, limited to metric_ids if specified.
+
+        Raises ValueError if some of the metric_ids is not available.
+        '''
+        return self.build_metrics_catalogue(periods).to_records(metric_ids)
 
-    def get_n_save_dataset_in_available_periods(self, endpoint_name, output_folder_path, file_uid, periods):
+    def get_n_save_dataset_in_available_periods(self, endpoint_name, output_folder_path, file_uid, periods,
+                                                output_mode=OUTPUT_MODE_FULL, open_intervals=None):
         '''
         Gets and saves specified dataset to output folder
 
@@ -138,9 +334,25 @@ class ExtractorService():
         periods -- dictionary with periods (containing country spec) as returned by @self.get_periods_in_interval
         file_uid -- unique identifier to be added to the result file name
                     so there are no conflicts when iterating multiple_times with different settings (content agnostic)
+        output_mode -- one of OUTPUT_MODES, modes other than full are supported only for CHANGE_TRACKED_DATASETS:
+                       full - all rows of all periods
+                       changes - one row per key and interval of unchanged attributes with valid_from, valid_to
+                                 columns instead of the period ones, CHANGE_ATTRIBUTE_COLUMNS are not part of the key
+                       latest - only the last period of each country
+        open_intervals -- changes mode only, {country: intervals} open at the end of the previous run, continued
+                          by this run (see ChangeIntervalWriter). The result metadata then contain 'open_intervals'
+                          of the country to be passed to the next run.
         Returns list of result file paths
 
         '''
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError('Unsupported output mode "{}", supported: {}'.format(output_mode, OUTPUT_MODES))
+        if output_mode != OUTPUT_MODE_FULL and endpoint_name not in CHANGE_TRACKED_DATASETS:
+            raise ValueError('Output mode "{}" is supported only for {} datasets'.format(output_mode,
+                                                                                       CHANGE_TRACKED_DATASETS))
+        if output_mode == OUTPUT_MODE_LATEST:
+            periods = self._get_latest_periods(periods)
+
         # separate demography (different structure
         if endpoint_name == ENDPOINT_DEMOGRAPHY:
             return self.get_n_save_demography(output_folder_path, file_uid, periods)
@@ -149,25 +361,29 @@ class ExtractorService():
         country_list = periods.keys()
 
         append_headers = ['country']
+        pkey = self._get_ds_pkey(endpoint_name, output_mode)
 
         for country in country_list:
             file_path = os.path.join(
                 output_folder_path, endpoint_name + '-' + str(file_uid) + country + '.csv')
 
-            with open(file_path, 'w+', newline='', encoding='utf-8') as out_file:
+            with self._open_output(file_path) as out_file:
                 writer = csv.writer(out_file, delimiter=',',
                                     quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                if output_mode == OUTPUT_MODE_CHANGES:
+                    writer = ChangeIntervalWriter(writer, self._get_change_key(self._get_ds_pkey(endpoint_name)),
+                                                  (open_intervals or {}).get(country))
                 self._get_n_write_ds_in_periods_in_country(
                     endpoint_name, writer, periods, country, append_headers, [country])
+                if output_mode == OUTPUT_MODE_CHANGES:
+                    writer.finish()
 
-            # remove if empty
-            if os.stat(out_file.name).st_size > 0:
-                res_files += [{'full_path': file_path,
-                               'type': endpoint_name,
-                               'name': os.path.basename(out_file.name),
-                               'pkey': self._get_ds_pkey(endpoint_name)}]
-            else:
-                os.remove(out_file)
+            country_res = self._build_result(out_file, endpoint_name, pkey)
+            if output_mode == OUTPUT_MODE_CHANGES:
+                for res in country_res:
+                    res['country'] = country
+                    res['open_intervals'] = writer.open_intervals()
+            res_files += country_res
 
         return res_files
 
@@ -186,115 +402,405 @@ class ExtractorService():
             res_files.extend(res)
         return res_files
 
+    def plan_dataset_requests(self, endpoint_name, periods, output_mode=OUTPUT_MODE_FULL, filter_params=None):
+        '''
+        Returns {country: [RequestUnit]} - the data requests get_n_save_dataset_in_available_periods (or
+        get_n_save_stats_in_available_periods for stats) makes, in their order. The requests are built by the same
+        code as when retrieving the dataset, they can be sent through shared_request_queue().
+
+        endpoint_name -- dataset type
+        periods -- dictionary with periods as returned by @self.get_periods_in_interval
+        filter_params -- stats filter params
+
+        No data are fetched, except the node trees of the periods when the stats are filtered by node subtrees
+        (kept by the service for the retrieval).
+        '''
+        if output_mode == OUTPUT_MODE_LATEST:
+            periods = self._get_latest_periods(periods)
+
+        units = collections.OrderedDict()
+        for country, period_list in periods.items():
+            params_chunks = self._get_params_chunks(endpoint_name, country, period_list, filter_params)
+            units[country] = [self._to_request_unit(endpoint_name, country, request)
+                              for request in self._iter_requests(period_list, params_chunks)]
+        return units
+
+    @contextmanager
+    def shared_request_queue(self, units):
+        '''
+        Sends the planned requests (RequestUnit) of several datasets x countries through one queue, so up to
+        max_workers (max_in_flight) requests are in flight across the dataset boundaries - the next dataset is
+        requested while the previous one is being written.
+
+        The datasets retrieved within the context take their responses from the queue, they must request exactly
+        the units, in their order (as planned by plan_dataset_requests), otherwise RuntimeError is raised.
+        '''
+        map_func = self._get_unit
+        if self.stats_planner.split_enabled:
+            map_func = self._returning_heavy_errors(map_func)
+        responses = self._map_ordered(map_func, units)
+        self._shared_responses = responses
+        try:
+            yield self
+            if next(responses, None) is not None:
+                raise RuntimeError('Some of the planned requests were not retrieved')
+        finally:
+            self._shared_responses = None
+            responses.close()
+
     # ============== PRIVATE METHODS
 
+    def _record_write(self, endpoint_name, country, rows, start):
+        if self.metrics is not None:
+            self.metrics.record_write(endpoint_name, country, rows, time.perf_counter() - start)
+
+    def _open_output(self, file_path):
+        '''
+        Opens result file, or sliced table folder in sliced output mode.
+        '''
+        if self.sliced_output:
+            return SlicedFileWriter(file_path, self.slice_max_rows, self.slice_max_bytes)
+        return open(file_path, 'w+', newline='', encoding='utf-8')
+
+    def _build_result(self, out_file, ds_type, pkey):
+        '''
+        Returns list with result metadata of the closed output, empty outputs are removed.
+        '''
+        file_path = out_file.name
+        if isinstance(out_file, ParquetRowWriter):
+            # the file is created with the first batch
+            if out_file.rows_written == 0:
+                return []
+            return [{'full_path': file_path,
+                     'type': ds_type,
+                     'name': os.path.basename(file_path),
+                     'pkey': pkey,
+                     'format': OUTPUT_FORMAT_PARQUET}]
+        if self.sliced_output:
+            if out_file.rows_written == 0:
+                shutil.rmtree(file_path)
+                return []
+            return [{'full_path': file_path,
+                     'type': ds_type,
+                     'name': os.path.basename(file_path),
+                     'pkey': pkey,
+                     'columns': out_file.columns}]
+
+        # remove if empty
+        if os.stat(file_path).st_size > 0:
+            return [{'full_path': file_path,
+                     'type': ds_type,
+                     'name': os.path.basename(file_path),
+                     'pkey': pkey}]
+        os.remove(file_path)
+        return []
+
+    @staticmethod
+    def _get_latest_periods(periods):
+        '''
+        Returns periods dict limited to the last (latest end, then begin) period of each country.
+        '''
+        return {country: [max(p_list, key=lambda p: (p[KEY_PERIOD_END], p[KEY_PERIOD_BEGIN]))] if p_list else []
+                for country, p_list in periods.items()}
+
     def _get_n_write_ds_in_periods_in_country(self, endpoint_name, writer, periods, country, append_headers,
-                                              append_data, type_='Standard', **additional_params):
+                                              append_data, type_='Standard', params_chunks=None, fieldnames=None,
+                                              **additional_params):
         write_header = True
-        for period in periods.get(country):
-            res = self.client.get_dataset_generic(
-                endpoint_name, period[KEY_PERIOD_BEGIN], period[KEY_PERIOD_END], country, output_type='csv',
-                **additional_params)
-
-            # use stats writer
-            if type_ == 'Stats':
-                self._write_stats_resp_in_period(res.text, writer, period, append_data, write_header)
-            else:
-                self._write_ds_resp_in_period(res.text, writer, period, append_headers, append_data, write_header)
+        for period, res in self._get_ds_in_periods(endpoint_name, periods.get(country), country, params_chunks,
+                                                   **additional_params):
+            start = time.perf_counter()
+            with self._open_resp_text(res) as lines:
+                # use stats writer
+                if type_ == 'Stats':
+                    rows = self._write_stats_resp_in_period(lines, writer, period, append_data, write_header,
+                                                            fieldnames)
+                else:
+                    rows = self._write_ds_resp_in_period(lines, writer, period, append_headers, append_data,
+                                                         write_header)
+            self._record_write(endpoint_name, country, rows, start)
 
             write_header = False
         return True
 
-    def _get_n_write_demography_in_period_in_country(self, output_folder_path, file_uid, periods, country,
-                                                     append_headers, append_data):
+    def _get_params_chunks(self, endpoint_name, country, period_list, filter_params=None):
+        '''
+        Returns the params of the requests of each period of the dataset - list of params dicts (one request each),
+        or function period -> list when the stats node subtrees are expanded by the node tree of each period.
         '''
-        Method to get and process demography endpoint response. Creates three file types when available
+        if endpoint_name != 'stats':
+            return [{}]
+        subtree_specs = (filter_params or {}).get(NODE_SUBTREE_FILTER)
+        request_params = {key: values for key, values in (filter_params or {}).items()
+                          if key != NODE_SUBTREE_FILTER}
+        if subtree_specs:
+            return self._plan_subtree_filters(country, period_list, request_params, subtree_specs)
+        return self.stats_planner.plan(request_params)
+
+    @staticmethod
+    def _iter_requests(period_list, params_chunks):
         '''
+        Returns list of (period, params) requests of the periods, each period requested once per params chunk.
+        '''
+        if callable(params_chunks):
+            chunks_for = params_chunks
+        else:
+            def chunks_for(period):
+                return params_chunks
+        return [(period, params) for period in period_list for params in chunks_for(period)]
 
-        write_header = True
-        res_files = []
-        # res file paths
-        traits_path = os.path.join(
-            output_folder_path, ENDPOINT_DEMOGRAPHY + '-' + 'traits' + '-' + file_uid + '-' + country + '.csv')
-        answers_path = os.path.join(
-            output_folder_path, ENDPOINT_DEMOGRAPHY + '-' + 'answers' + '-' + file_uid + '-' + country + '.csv')
-        defaults_path = os.path.join(
-            output_folder_path, ENDPOINT_DEMOGRAPHY + '-' + 'defaults' + '-' + file_uid + '-' + country + '.csv')
-
-        traits = defaults = answers = False
-        # res file writers
-        with open(traits_path, 'w+', newline='', encoding='utf-8') as traits_f:
-            with open(answers_path, 'w+', newline='', encoding='utf-8')as answers_f:
-                with open(defaults_path, 'w+', newline='', encoding='utf-8') as defaults_f:
-                    traits_writer = csv.writer(
-                        traits_f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-                    answers_writer = csv.writer(
-                        answers_f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-                    defaults_writer = csv.writer(
-                        defaults_f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-                    # iterate periods
-                    for period in periods.get(country):
-                        res = self.client.get_dataset_generic(
-                            ENDPOINT_DEMOGRAPHY, period[KEY_PERIOD_BEGIN], period[KEY_PERIOD_END], country,
-                            output_type='csv')
-                        # split file by empty line
-                        dem_files = res.text.split('\r\n\r\n')
-
-                        for line in dem_files:
-                            if DEMOGRAPHY_TRAITS_HEADER in line:
-                                traits = True
-                                # traits
-                                self._write_ds_resp_in_period(
-                                    line, traits_writer, period, append_headers, append_data, write_header)
-
-                            elif DEMOGRAPHY_ASNWERS_HEADER in line:
-                                answers = True
-                                # answers
-                                self._write_ds_resp_in_period(
-                                    line, answers_writer, period, append_headers, append_data, write_header)
-                            elif DEMOGRAPHY_DFTS_HEADER in line:
-                                defaults = True
-                                # defaults
-                                self._write_ds_resp_in_period(
-                                    line, defaults_writer, period, append_headers, append_data, write_header)
-                        write_header = False
-
-            # cleanup empty files, add metadata
-            if traits:
-                res_files += [{'full_path': traits_path,
-                               'type': ENDPOINT_DEMOGRAPHY + "_traits",
-                               'name': os.path.basename(traits_path),
-                               'pkey': DEFAULT_DS_PKEY}]
-            else:
-                os.remove(traits_path)
-            if answers:
-                res_files += [{'full_path': answers_path,
-                               'type': ENDPOINT_DEMOGRAPHY + "_answers",
-                               'name': os.path.basename(answers_path),
-                               'pkey': DEFAULT_DS_PKEY}]
+    @staticmethod
+    def _to_request_unit(endpoint_name, country, request):
+        period, params = request
+        return RequestUnit(endpoint_name, country, period[KEY_PERIOD_BEGIN], period[KEY_PERIOD_END], params)
+
+    def _get_unit(self, unit, limits=None):
+        '''
+        Requests the csv data of the unit (returns coroutine in async mode).
+
+        limits -- stats request limits, the stats planner limits by default (when splitting is enabled)
+        '''
+        if limits is None:
+            limits = self.stats_planner.request_limits() if unit.endpoint == 'stats' else {}
+        return self.client.get_dataset_generic(unit.endpoint, unit.begin, unit.end, unit.country, output_type='csv',
+                                               stream=self.stream, **limits, **unit.params)
+
+    def _get_ds_in_periods(self, endpoint_name, period_list, country, params_chunks=None, **additional_params):
+        '''
+        Yields (period, response) tuples for all periods, always in the order of period_list.
+
+        params_chunks -- optional list of request params dicts, when specified each period is requested once per chunk
+                         (in the order of chunks) instead of using additional_params. May be a function returning
+                         the list for a period.
+
+        Within shared_request_queue() the responses are taken from the queue.
+        '''
+        requests = self._iter_requests(period_list, params_chunks or [additional_params])
+        # stats requests over the limits are split at run time
+        split = endpoint_name == 'stats' and self.stats_planner.split_enabled
+
+        def get_ds(request, limits=None):
+            return self._get_unit(self._to_request_unit(endpoint_name, country, request), limits)
+
+        if self._shared_responses is not None:
+            responses = self._take_shared_responses(endpoint_name, country, requests)
+        else:
+            responses = self._map_ordered(self._returning_heavy_errors(get_ds) if split else get_ds, requests)
+        for request, res in responses:
+            if isinstance(res, HeavyRequestError):
+                for part_res in self._iter_split_stats(get_ds, request, res):
+                    yield request[0], part_res
             else:
-                os.remove(answers_path)
-            if defaults:
-                res_files += [{'full_path': defaults_path,
-                               'type': ENDPOINT_DEMOGRAPHY + "_defaults",
-                               'name': os.path.basename(defaults_path),
-                               'pkey': DEFAULT_DS_PKEY}]
+                yield request[0], res
+
+    def _take_shared_responses(self, endpoint_name, country, requests):
+        '''
+        Yields (request, response) of the requests from the shared request queue.
+        '''
+        for request in requests:
+            unit = self._to_request_unit(endpoint_name, country, request)
+            planned, res = next(self._shared_responses, (None, None))
+            if planned != unit:
+                if hasattr(res, 'close'):
+                    res.close()
+                raise RuntimeError('Request {} {} {} does not match the planned request {}'.format(
+                    endpoint_name, country, request[0][KEY_PERIOD_BEGIN], planned))
+            yield request, res
+
+    def _returning_heavy_errors(self, func):
+        '''
+        Wraps the request function so HeavyRequestError is returned instead of raised and the other requests
+        mapped by _map_ordered go on.
+        '''
+        if self.is_async:
+            async def wrapper(item):
+                try:
+                    return await func(item)
+                except HeavyRequestError as e:
+                    return e
+        else:
+            def wrapper(item):
+                try:
+                    return func(item)
+                except HeavyRequestError as e:
+                    return e
+        return wrapper
+
+    def _iter_split_stats(self, get_ds, request, error):
+        '''
+        Yields responses of the stats request which exceeded the limits, bisected by its filter values.
+        The halves are requested one by one from the consuming thread, halves over the limits are bisected again.
+        A request which cannot be split any further is sent without the limits (with the standard retries).
+        '''
+        period, params = request
+        filter_sizes = {key: len(values) for key, values in params.items() if isinstance(values, list)}
+        halves = self.stats_planner.bisect(params)
+        if halves is None:
+            logging.warning('Stats request of period %s %s cannot be split any further (%s), '
+                            'requesting it without limits', period[KEY_PERIOD_BEGIN], filter_sizes, error)
+            yield self._call(get_ds, request, {})
+            return
+
+        logging.warning('Stats request of period %s %s split in two (%s)', period[KEY_PERIOD_BEGIN], filter_sizes,
+                        error)
+        for half in halves:
+            try:
+                res = self._call(get_ds, (period, half))
+            except HeavyRequestError as e:
+                yield from self._iter_split_stats(get_ds, (period, half), e)
             else:
-                os.remove(defaults_path)
+                yield res
+
+    @contextmanager
+    def _open_resp_text(self, res):
+        '''
+        Opens the utf-8 decoded response body as a text stream for csv.reader, the response is released on exit.
+
+        Streamed responses not read yet are decoded as they are read from the connection, without a copy of the whole
+        body. Line breaks are left untranslated (newline=''), so the csv module keeps the line breaks inside quoted
+        fields, and only \r and \n end a line (unlike str.splitlines()).
+        '''
+        raw = getattr(res, 'raw', None)
+        if raw is not None and not getattr(res, '_content_consumed', True):
+            # transparently decompress gzip / deflate encoded bodies, keep the body open at EOF for TextIOWrapper
+            raw.decode_content = True
+            raw.auto_close = False
+            body = raw
+        else:
+            body = io.BytesIO(res.content)
+        try:
+            yield io.TextIOWrapper(body, encoding='utf-8', newline='')
+        finally:
+            res.close()
+
+    def _map_ordered(self, func, items):
+        '''
+        Yields (item, func(item)) tuples in the order of items. With max_workers > 1 the calls run in a thread pool,
+        at most max_workers + 1 results are pending at a time (the next item is submitted before the oldest result
+        is yielded) so the memory stays bounded. Each pending streamed response holds a pooled connection, hence
+        the max_workers + 1 connections of the client pool.
+        '''
+        if self.is_async:
+            yield from self._map_ordered_async(func, items)
+            return
+
+        if self.max_workers == 1:
+            for item in items:
+                yield item, func(item)
+            return
+
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for item in items:
+                    pending.append((item, executor.submit(func, item)))
+                    if len(pending) > self.max_workers:
+                        item_done, future = pending.popleft()
+                        yield item_done, future.result()
+                while pending:
+                    item_done, future = pending.popleft()
+                    yield item_done, future.result()
+            finally:
+                for item_done, future in pending:
+                    future.cancel()
+
+    def _map_ordered_async(self, coro_func, items):
+        '''
+        Async version of _map_ordered, keeps up to client.max_in_flight + 1 coroutines scheduled on the service loop
+        (the client's semaphore lets max_in_flight of them send requests) and yields the results in the order
+        of items.
+        '''
+        window = self.client.max_in_flight
+        pending = collections.deque()
+        try:
+            for item in items:
+                pending.append((item, self._loop.create_task(coro_func(item))))
+                if len(pending) > window:
+                    item_done, task = pending.popleft()
+                    yield item_done, self._loop.run_until_complete(task)
+            while pending:
+                item_done, task = pending.popleft()
+                yield item_done, self._loop.run_until_complete(task)
+        finally:
+            if pending:
+                for item_done, task in pending:
+                    task.cancel()
+                self._loop.run_until_complete(asyncio.gather(*[t for i, t in pending], return_exceptions=True))
 
+    def _get_n_write_demography_in_period_in_country(self, output_folder_path, file_uid, periods, country,
+                                                     append_headers, append_data):
+        '''
+        Method to get and process demography endpoint response. Creates three file types when available.
+
+        The response lines are routed to the traits, answers and defaults files as they arrive, files are opened
+        on the first occurrence of their section.
+        '''
+        outputs = {}
+        writers = {}
+        # header is written once per section file
+        write_header = {}
+        with ExitStack() as stack:
+            for period, res in self._get_ds_in_periods(ENDPOINT_DEMOGRAPHY, periods.get(country), country):
+                with self._open_resp_text(res) as resp_text:
+                    for section, lines in self._iter_demography_sections(resp_text):
+                        if section not in writers:
+                            file_path = os.path.join(output_folder_path, ENDPOINT_DEMOGRAPHY + '-' + section + '-'
+                                                     + file_uid + '-' + country + '.csv')
+                            outputs[section] = stack.enter_context(self._open_output(file_path))
+                            writers[section] = csv.writer(outputs[section], delimiter=',', quotechar='"',
+                                                          quoting=csv.QUOTE_MINIMAL)
+                            write_header[section] = True
+                        start = time.perf_counter()
+                        rows = self._write_ds_resp_in_period(lines, writers[section], period, append_headers,
+                                                             append_data, write_header[section])
+                        self._record_write(ENDPOINT_DEMOGRAPHY + '_' + section, country, rows, start)
+                        write_header[section] = False
+
+        # add metadata, cleanup empty files
+        res_files = []
+        for section in DEMOGRAPHY_SECTIONS.values():
+            if section in outputs:
+                res_files += self._build_result(outputs[section], ENDPOINT_DEMOGRAPHY + '_' + section, DEFAULT_DS_PKEY)
         return res_files
 
-    def _write_ds_resp_in_period(self, csv_data, writer, period, append_headers, append_data, write_header):
+    def _iter_demography_sections(self, lines):
+        '''
+        Splits demography response lines into sections in a single pass.
+
+        Yields (section, lines) tuples, each section starts with a line containing its header and lasts until
+        the next header line, so it does not depend on the empty separator lines and their line endings.
+        Lines before the first known header are skipped. The section lines must be consumed before the next item.
         '''
-        Writes csv response to file.
+        section = None
+
+        def get_section(line):
+            nonlocal section
+            for header, section_name in DEMOGRAPHY_SECTIONS.items():
+                if header in line:
+                    section = section_name
+                    break
+            return section
+
+        for section_name, section_lines in itertools.groupby(lines, get_section):
+            if section_name is not None:
+                yield section_name, section_lines
+
+    def _write_ds_resp_in_period(self, lines, writer, period, append_headers, append_data, write_header):
+        '''
+        Writes csv response to file. Returns number of written data rows.
+
+        lines -- iterable of the response tsv lines (incl. header)
         '''
 
-        reader = csv.reader(io.StringIO(csv_data),
-                            delimiter='\t', quotechar='"')
+        reader = csv.reader(lines, delimiter='\t', quotechar='"')
 
+        rows = 0
         if not write_header:
-            next(reader)
+            next(reader, None)
         for row in reader:
+            if not row:
+                # blank line, e.g. the demography section separators
+                continue
             if write_header:
                 row = [col.replace('%', 'prc') for col in row]
                 writer.writerow(row + append_headers + PERIOD_HEADER)
@@ -302,26 +808,58 @@ class ExtractorService():
             else:
                 writer.writerow(
                     row + append_data + [period[KEY_PERIOD_BEGIN], period[KEY_PERIOD_END], period[KEY_PERIOD_TYPE]])
+                rows += 1
 
-        return True
-
-    def _write_stats_resp_in_period(self, csv_data, writer, period, append_data, write_header):
-        # clean header
-        split_resp = csv_data.splitlines()
-        split_resp[0] = split_resp[0].replace('%', 'prc')
+        return rows
 
-        reader = csv.DictReader(io.StringIO(os.linesep.join(split_resp)),
-                                delimiter='\t', quotechar='"')
-        if write_header:
-            writer.writeheader()
-
-        period_data = {'begin_period': period[KEY_PERIOD_BEGIN],
-                       'end_period': period[KEY_PERIOD_END],
-                       'period_type': period[KEY_PERIOD_TYPE]}
+    def _write_stats_resp_in_period(self, lines, writer, period, append_data, write_header, fieldnames):
+        '''
+        Writes stats response to file. Returns number of written data rows.
 
-        for row in reader:
-            row.update(period_data)
-            row.update(append_data)
-            writer.writerow(row)
+        Result columns are projected from the response header once, each row is then written as a list
+        extended with the country, filter and period values. Response columns missing in fieldnames are ignored,
+        fieldnames missing in the response are left empty.
 
-        return True
+        lines -- iterable of the response tsv lines (incl. header)
+        fieldnames -- result file columns
+        '''
+        reader = csv.reader(lines, delimiter='\t', quotechar='"')
+        if write_header:
+            writer.writerow(fieldnames)
+
+        header = next(reader, None)
+        if header is None:
+            return 0
+        n_cols = len(header)
+
+        # constant values appended after the response columns, the last one fills the missing columns
+        suffix_data = dict(append_data)
+        suffix_data.update({'begin_period': period[KEY_PERIOD_BEGIN],
+                            'end_period': period[KEY_PERIOD_END],
+                            'period_type': period[KEY_PERIOD_TYPE]})
+        suffix_cols = list(suffix_data.keys())
+        suffix = list(suffix_data.values()) + ['']
+
+        col_index = {col.replace('%', 'prc'): i for i, col in enumerate(header)}
+        positions = []
+        for col in fieldnames:
+            if col in suffix_data:
+                positions.append(n_cols + suffix_cols.index(col))
+            else:
+                positions.append(col_index.get(col, n_cols + len(suffix) - 1))
+        project = itemgetter(*positions)
+        written = 0
+
+        def rows():
+            nonlocal written
+            for row in reader:
+                if len(row) != n_cols:
+                    if not row:
+                        continue
+                    # ragged row, pad or cut to the header length
+                    row = (row + [''] * n_cols)[:n_cols]
+                written += 1
+                yield project(row + suffix)
+
+        writer.writerows(rows())
+        return written
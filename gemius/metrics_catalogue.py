@@ -0,0 +1,70 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import csv
+import hashlib
+import io
+
+KEY_METRIC_ID = 'id'
+KEY_METRIC_NAME = 'name'
+
+
+class MetricsCatalogue():
+    '''
+    Index id -> name of metrics available in a set of periods, built from the metrics endpoint responses.
+
+    Identical responses (the metric list rarely changes between periods) are detected by hash and parsed only once.
+    '''
+
+    def __init__(self):
+        self._names = {}
+        self._response_hashes = set()
+        self.responses = 0
+
+    def add_response(self, content):
+        '''
+        Adds raw metrics csv (tab separated) response content. Returns False if identical response was already added.
+        '''
+        self.responses += 1
+        content_hash = hashlib.sha1(content).digest()
+        if content_hash in self._response_hashes:
+            return False
+        self._response_hashes.add(content_hash)
+
+        reader = csv.DictReader(io.TextIOWrapper(io.BytesIO(content), encoding='utf-8'), delimiter='\t',
+                                quotechar='"')
+        for row in reader:
+            self._names.setdefault(row[KEY_METRIC_ID], row[KEY_METRIC_NAME])
+        return True
+
+    @property
+    def unique_responses(self):
+        return len(self._response_hashes)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, metric_id):
+        return str(metric_id) in self._names
+
+    def get_name(self, metric_id):
+        return self._names[str(metric_id)]
+
+    def validate(self, metric_ids):
+        '''
+        Raises ValueError if any of the metric ids is not available.
+        '''
+        invalid_ids = [m for m in metric_ids if m not in self]
+        if invalid_ids:
+            raise ValueError('Some metric IDs are not valid! {}'.format(invalid_ids))
+
+    def to_records(self, metric_ids=None):
+        '''
+        Returns list of {'id', 'name'} dicts, of all metrics or of the specified (validated) metric ids in their order.
+        '''
+        if metric_ids is None:
+            return [{KEY_METRIC_ID: m_id, KEY_METRIC_NAME: name} for m_id, name in self._names.items()]
+        self.validate(metric_ids)
+        return [{KEY_METRIC_ID: str(m_id), KEY_METRIC_NAME: self.get_name(m_id)} for m_id in metric_ids]
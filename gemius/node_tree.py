@@ -0,0 +1,113 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import collections
+import csv
+import io
+
+KEY_ID = 'id'
+KEY_PARENT_ID = 'parent_id'
+
+# stats filter of node subtrees, values in form root_id or root_id:depth
+NODE_SUBTREE_FILTER = 'node_subtree'
+SUBTREE_DEPTH_SEPARATOR = ':'
+
+
+def parse_subtree_spec(spec):
+    '''
+    Returns (root_id, depth) of the subtree filter value, depth is None (whole subtree) when not specified.
+    Depth 0 selects the root only, 1 the root and its children etc.
+    '''
+    root, separator, depth = str(spec).strip().partition(SUBTREE_DEPTH_SEPARATOR)
+    if not root:
+        raise ValueError('Invalid node subtree "{}", expected root_id or root_id:depth'.format(spec))
+    if not separator:
+        return root, None
+    try:
+        depth = int(depth)
+    except ValueError:
+        raise ValueError('Invalid node subtree depth in "{}", expected root_id:depth'.format(spec))
+    if depth < 0:
+        raise ValueError('Invalid node subtree depth in "{}", the depth must not be negative'.format(spec))
+    return root, depth
+
+
+class NodeTreeIndex():
+    '''
+    In-memory parent -> children adjacency list of the node hierarchy, built once from a nodes response.
+
+    Subtrees are expanded locally (breadth first, children in the order of the source table), so the stats
+    filters can be given as subtree roots instead of listing all the node ids.
+    '''
+
+    def __init__(self, edges):
+        '''
+
+        :param edges: iterable of (node_id, parent_id) tuples, parent_id empty for the top level nodes
+        '''
+        self.children = collections.defaultdict(list)
+        self.nodes = set()
+        for node_id, parent_id in edges:
+            self.nodes.add(node_id)
+            if parent_id and parent_id != node_id:
+                self.children[parent_id].append(node_id)
+
+    @classmethod
+    def from_tsv(cls, content):
+        '''
+        Builds index from the raw nodes csv (tab separated) response content.
+        '''
+        reader = csv.reader(io.TextIOWrapper(io.BytesIO(content), encoding='utf-8'), delimiter='\t', quotechar='"')
+        header = next(reader, None)
+        if header is None:
+            return cls([])
+        if KEY_ID not in header or KEY_PARENT_ID not in header:
+            raise ValueError('Node tree requires the {} and {} columns, got {}'.format(KEY_ID, KEY_PARENT_ID, header))
+        id_pos = header.index(KEY_ID)
+        parent_pos = header.index(KEY_PARENT_ID)
+        return cls((row[id_pos], row[parent_pos]) for row in reader if len(row) > max(id_pos, parent_pos))
+
+    @property
+    def size(self):
+        return len(self.nodes)
+
+    def expand(self, subtree_specs):
+        '''
+        Returns (node_ids, missing_roots) - ids of all nodes of the subtrees without duplicates (overlapping
+        subtrees are requested once), in the order of the specs, and the roots not present in the tree.
+
+        :param subtree_specs: list of root_id or root_id:depth values
+        '''
+        node_ids = []
+        seen = set()
+        missing_roots = []
+        for spec in subtree_specs:
+            root, depth = parse_subtree_spec(spec)
+            if root not in self.nodes:
+                missing_roots.append(root)
+                continue
+            for node_id in self._iter_subtree(root, depth):
+                if node_id not in seen:
+                    seen.add(node_id)
+                    node_ids.append(node_id)
+        return node_ids, missing_roots
+
+    def _iter_subtree(self, root, depth):
+        level = [root]
+        visited = {root}
+        level_depth = 0
+        while level:
+            yield from level
+            if depth is not None and level_depth >= depth:
+                return
+            next_level = []
+            for node_id in level:
+                for child in self.children.get(node_id, ()):
+                    # guards against cycles in inconsistent data
+                    if child not in visited:
+                        visited.add(child)
+                        next_level.append(child)
+            level = next_level
+            level_depth += 1
@@ -0,0 +1,130 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import bisect
+import csv
+import functools
+import io
+from datetime import datetime
+
+import pytz
+from dateutil import parser as date_parser
+
+KEY_COUNTRY = 'country'
+KEY_PERIOD_BEGIN = 'begin'
+KEY_PERIOD_END = 'end'
+KEY_PERIOD_TYPE = 'period type'
+
+PERIOD_TYPE_ALL = 'all'
+
+API_DATE_FORMAT = '%Y-%m-%d'
+
+
+class PeriodCatalogue():
+    '''
+    In-memory index of all available periods, built once from a single available-periods response.
+
+    Periods are kept as intervals sorted by begin per country and period type, interval queries are answered
+    by bisecting the sorted begins. Returned periods keep the order of the source table.
+    '''
+
+    def __init__(self, period_records):
+        '''
+
+        :param period_records: list of dicts with keys country, begin, end, period type (begin, end as datetimes)
+        '''
+        # country -> period type -> ([begin], [(position, period)]) both sorted by begin
+        self._index = {}
+        self.size = 0
+        grouped = {}
+        for position, record in enumerate(period_records):
+            period = {KEY_PERIOD_BEGIN: record[KEY_PERIOD_BEGIN],
+                      KEY_PERIOD_END: record[KEY_PERIOD_END],
+                      KEY_PERIOD_TYPE: record[KEY_PERIOD_TYPE]}
+            by_type = grouped.setdefault(record[KEY_COUNTRY], {})
+            by_type.setdefault(record[KEY_PERIOD_TYPE], []).append((position, period))
+            self.size += 1
+
+        for country, by_type in grouped.items():
+            self._index[country] = {}
+            for p_type, periods in by_type.items():
+                periods.sort(key=lambda p: (p[1][KEY_PERIOD_BEGIN], p[0]))
+                self._index[country][p_type] = ([p[KEY_PERIOD_BEGIN] for position, p in periods], periods)
+
+    @classmethod
+    def from_tsv(cls, content):
+        '''
+        Builds catalogue from the raw available-periods csv (tab separated) response content.
+        '''
+        reader = csv.DictReader(io.TextIOWrapper(io.BytesIO(content), encoding='utf-8'), delimiter='\t',
+                                quotechar='"')
+        records = []
+        for row in reader:
+            row[KEY_PERIOD_BEGIN] = _parse_date(row[KEY_PERIOD_BEGIN])
+            row[KEY_PERIOD_END] = _parse_date(row[KEY_PERIOD_END])
+            records.append(row)
+        return cls(records)
+
+    @property
+    def countries(self):
+        return list(self._index.keys())
+
+    def get_periods(self, begin=None, end=None, period_type=None, country_list=None):
+        '''
+        Returns dictionary {country: [period]} of periods beginning in interval [begin, end). The interval is
+        applied only when both begin and end are specified.
+
+        :param begin: datetime or date string
+        :param end: datetime or date string
+        :param period_type: daily, weekly, monthly.. all types returned when not specified or 'all'
+        :param country_list: optional list of countries
+        '''
+        if begin and end:
+            begin = self._to_datetime(begin)
+            end = self._to_datetime(end)
+        else:
+            begin = end = None
+
+        if country_list and country_list[0] is not None:
+            countries = [c for c in self._index if c in country_list]
+        else:
+            countries = list(self._index)
+
+        periods_result = {}
+        for country in countries:
+            in_interval = {p_type: self._get_range(begins, periods, begin, end)
+                           for p_type, (begins, periods) in self._index[country].items()}
+            # countries without any period in the interval are left out, with no period of the type are kept empty
+            if not any(in_interval.values()):
+                continue
+
+            if not period_type or period_type == PERIOD_TYPE_ALL:
+                candidates = sorted(p for periods in in_interval.values() for p in periods)
+            else:
+                candidates = sorted(in_interval.get(period_type, []))
+            periods_result[country] = [period for position, period in candidates]
+        return periods_result
+
+    def _get_range(self, begins, periods, begin, end):
+        if begin is None:
+            return periods
+        return periods[bisect.bisect_left(begins, begin):bisect.bisect_left(begins, end)]
+
+    def _to_datetime(self, value):
+        # naive UTC datetime comparable with the parsed periods
+        if isinstance(value, str):
+            value = date_parser.parse(value)
+        if value.tzinfo is not None:
+            value = value.astimezone(pytz.utc).replace(tzinfo=None)
+        return value
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_date(value):
+    # the same dates repeat for each country
+    try:
+        return datetime.strptime(value, API_DATE_FORMAT)
+    except ValueError:
+        return date_parser.parse(value)
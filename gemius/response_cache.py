@@ -0,0 +1,159 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+CACHE_FILE_SUFFIX = '.cache'
+
+
+class ResponseCache():
+    '''
+    Content addressed on-disk cache of raw API responses.
+
+    Each response is stored in a single file named by the sha256 of its request key. The file modification time
+    is the time of storing (used for the TTL), the access time is updated on each hit and used for the LRU
+    eviction once the total size exceeds max_size. Safe to use from multiple threads and processes sharing the folder,
+    the size tracked by each instance is re-read from the folder on eviction.
+    '''
+
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        '''
+
+        :param cache_dir: cache folder, created if it does not exist
+        :param ttl: max age of an entry in seconds
+        :param max_size: max total size of the cached entries in bytes
+        '''
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(st.st_size for st, path in self._stat_entries())
+
+    def make_key(self, endpoint, country, begin, end, params=None):
+        '''
+        Builds request key. Filter params are normalized, i.e. the order of filters and of their values does not matter.
+        '''
+        norm_params = {}
+        for key, values in (params or {}).items():
+            if not values:
+                continue
+            if isinstance(values, (list, tuple, set)):
+                norm_params[key] = sorted({str(v) for v in values})
+            else:
+                norm_params[key] = str(values)
+
+        raw_key = json.dumps([endpoint, country, str(begin), str(end), norm_params], sort_keys=True)
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        '''
+        Returns tuple (content, encoding) or None when the key is not cached or is expired.
+        '''
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                mtime = os.fstat(cache_file.fileno()).st_mtime
+                if time.time() - mtime > self.ttl:
+                    data = None
+                else:
+                    data = cache_file.read()
+        except FileNotFoundError:
+            data = None
+            mtime = None
+
+        if data is None:
+            if mtime is not None:
+                self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # keep the store time, mark access for LRU
+        try:
+            os.utime(path, (time.time(), mtime))
+        except FileNotFoundError:
+            # evicted by another process meanwhile
+            pass
+        with self._lock:
+            self.hits += 1
+        encoding, content = data.split(b'\n', 1)
+        return content, encoding.decode('ascii') or None
+
+    def put(self, key, content, encoding=None):
+        path = self._entry_path(key)
+        tmp_path = '{}.{}-{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as cache_file:
+            cache_file.write((encoding or '').encode('ascii') + b'\n')
+            cache_file.write(content)
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            if os.path.exists(path):
+                self._size -= os.path.getsize(path)
+            os.replace(tmp_path, path)
+            self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+                    'evictions': self.evictions,
+                    'size_bytes': self._size}
+
+    def _evict(self):
+        # least recently used first, evict down to 90% of the limit to avoid evicting on each put
+        entries = sorted(self._stat_entries(), key=lambda e: e[0].st_atime)
+        self._size = sum(st.st_size for st, path in entries)
+        for st, path in entries:
+            if self._size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            self._size -= st.st_size
+        logging.debug('Response cache evicted to %s bytes', self._size)
+
+    def _remove(self, path):
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self._size -= size
+            except FileNotFoundError:
+                pass
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_FILE_SUFFIX)
+
+    def _list_entries(self):
+        return [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith(CACHE_FILE_SUFFIX)]
+
+    def _stat_entries(self):
+        # (stat, path) of the entries, skipping the ones removed by another process meanwhile
+        entries = []
+        for path in self._list_entries():
+            try:
+                entries.append((os.stat(path), path))
+            except FileNotFoundError:
+                pass
+        return entries
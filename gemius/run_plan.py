@@ -0,0 +1,228 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import collections
+
+# estimates of the requests of endpoints without any history
+DEFAULT_SECONDS_PER_REQUEST = 1.0
+DEFAULT_BYTES_PER_REQUEST = 100 * 1024
+# requests of the past runs weigh at most as much as this many new requests, so the history follows the changes
+HISTORY_MAX_WEIGHT = 1000
+
+SUMMARY_COLUMNS = ['dataset', 'type', 'country', 'periods', 'requests', 'est_MB', 'est_s']
+
+# single API request of the run, params are the filter params of the stats requests
+RequestUnit = collections.namedtuple('RequestUnit', ['endpoint', 'country', 'begin', 'end', 'params'])
+
+
+class RequestHistory():
+    '''
+    Average response size and latency of the requests of past runs by endpoint and country, persisted in the state.
+
+    Structure: {"<endpoint>": {"requests": n, "bytes_per_request": b, "seconds_per_request": s,
+                               "countries": {"<country>": {"requests": n, "bytes_per_request": b, ...}}}}
+    '''
+
+    def __init__(self, history=None):
+        self.history = dict(history or {})
+
+    def update(self, report):
+        '''
+        Adds the requests of a run, report as returned by kbc.instrumentation.PerformanceMetrics.to_dict().
+        '''
+        for group in report['groups']:
+            if not group['requests']:
+                continue
+            endpoint = self.history.setdefault(group['endpoint'], {})
+            self._add(endpoint, group)
+            if group['country']:
+                self._add(endpoint.setdefault('countries', {}).setdefault(group['country'], {}), group)
+
+    def estimate(self, endpoint, country):
+        '''
+        Returns (bytes_per_request, seconds_per_request, known) of the endpoint and country, average of all
+        countries of the endpoint when the country has no history and defaults when the endpoint has none.
+        '''
+        stats = self.history.get(endpoint)
+        if not stats:
+            return DEFAULT_BYTES_PER_REQUEST, DEFAULT_SECONDS_PER_REQUEST, False
+        stats = stats.get('countries', {}).get(country) or stats
+        return stats['bytes_per_request'], stats['seconds_per_request'], True
+
+    def to_dict(self):
+        return self.history
+
+    @staticmethod
+    def _add(stats, group):
+        old_weight = min(stats.get('requests', 0), HISTORY_MAX_WEIGHT)
+        new_weight = group['requests']
+        total = old_weight + new_weight
+        stats['bytes_per_request'] = round((stats.get('bytes_per_request', 0) * old_weight
+                                            + group['response_bytes']) / total)
+        stats['seconds_per_request'] = round((stats.get('seconds_per_request', 0) * old_weight
+                                              + group['latency_sum_s']) / total, 3)
+        stats['requests'] = stats.get('requests', 0) + new_weight
+
+
+class DatasetPlan():
+    '''
+    Requests of one configured dataset, by country. The dataset x country groups are the work units of the run.
+    '''
+
+    def __init__(self, index, dataset, dataset_key, periods, units, filter_params=None, metrics=None):
+        '''
+
+        :param periods: {country: [periods]} to retrieve, as returned by ExtractorService.get_periods_in_interval
+        :param units: {country: [RequestUnit]}
+        :param filter_params: stats filter params loaded from the config
+        :param metrics: stats metrics [{'id', 'name'}] with the names resolved
+        '''
+        self.index = index
+        self.dataset = dataset
+        self.dataset_key = dataset_key
+        self.periods = periods
+        self.units = units
+        self.filter_params = filter_params
+        self.metrics = metrics
+
+    @property
+    def dataset_type(self):
+        return self.dataset.get('dataset_type')
+
+    def countries(self):
+        return [country for country, c_periods in self.periods.items() if c_periods]
+
+
+class RunPlan():
+    '''
+    Explicit list of the API requests a run makes, grouped by dataset and country, with the estimated downloaded
+    bytes and duration based on the RequestHistory.
+
+    In the main process all the requests of the run go through one request queue of the extractor service, up to
+    `concurrency` at once across the groups. When process_workers > 1 the groups are spread over the process pool and
+    the requests of a group are sent in parallel by the service of its process.
+    '''
+
+    def __init__(self, history=None, concurrency=1, process_workers=0, rate_limit=None):
+        '''
+
+        :param history: RequestHistory of the past runs
+        :param concurrency: max number of parallel requests (max_workers or max_in_flight)
+        :param process_workers: size of the process pool, 0 or 1 when the groups are retrieved in the main process
+        :param rate_limit: max requests per second of the client
+        '''
+        self.history = history or RequestHistory()
+        self.concurrency = max(1, int(concurrency or 1))
+        self.process_workers = int(process_workers or 0)
+        self.rate_limit = rate_limit
+        self.datasets = []
+
+    def add(self, dataset_plan):
+        self.datasets.append(dataset_plan)
+
+    @property
+    def request_count(self):
+        return sum(len(units) for ds in self.datasets for units in ds.units.values())
+
+    def groups(self):
+        '''
+        Returns [(dataset_plan, country)] of all dataset x country groups with some requests, in the config order.
+        '''
+        return [(ds, country) for ds in self.datasets for country in ds.countries() if ds.units.get(country)]
+
+    def queue(self):
+        '''
+        Returns the groups ordered by the estimated duration, longest first, so the process pool is not left waiting
+        for a long group started last.
+        '''
+        return sorted(self.groups(), key=lambda g: self.estimate_group(*g)['estimated_seconds'], reverse=True)
+
+    def estimate_group(self, dataset_plan, country):
+        units = dataset_plan.units.get(country) or []
+        est_bytes = est_latency = 0
+        unknown = 0
+        for unit in units:
+            unit_bytes, unit_seconds, known = self.history.estimate(unit.endpoint, unit.country)
+            est_bytes += unit_bytes
+            est_latency += unit_seconds
+            if not known:
+                unknown += 1
+        return {'requests': len(units),
+                'estimated_bytes': int(est_bytes),
+                'estimated_seconds': round(est_latency / max(1, min(self.concurrency, len(units))), 1),
+                'requests_without_history': unknown}
+
+    def estimate(self):
+        '''
+        Returns the estimates of the whole run.
+        '''
+        groups = [self.estimate_group(*g) for g in self.groups()]
+        total = {'requests': sum(g['requests'] for g in groups),
+                 'estimated_bytes': sum(g['estimated_bytes'] for g in groups),
+                 'requests_without_history': sum(g['requests_without_history'] for g in groups)}
+        if self.process_workers > 1 and groups:
+            # groups spread over the pool, the longest one is the lower bound
+            seconds = max(sum(g['estimated_seconds'] for g in groups) / min(self.process_workers, len(groups)),
+                          max(g['estimated_seconds'] for g in groups))
+        else:
+            # one request queue across the groups
+            latency = sum(self.history.estimate(unit.endpoint, unit.country)[1]
+                          for ds, country in self.groups() for unit in ds.units[country])
+            seconds = latency / max(1, min(self.concurrency, total['requests']))
+        if self.rate_limit:
+            seconds = max(seconds, total['requests'] / self.rate_limit)
+        total['estimated_seconds'] = round(seconds, 1)
+        return total
+
+    def to_dict(self):
+        '''
+        Returns the plan with the estimates, requests listed with the number of values of each filter.
+        '''
+        datasets = []
+        for ds in self.datasets:
+            countries = []
+            for country in ds.countries():
+                units = ds.units.get(country) or []
+                countries.append(dict(self.estimate_group(ds, country), country=country,
+                                      periods=len(ds.periods[country]),
+                                      units=[self._unit_to_dict(u) for u in units]))
+            datasets.append({'index': ds.index,
+                             'dataset_type': ds.dataset_type,
+                             'period_type': ds.dataset.get('period_type'),
+                             'dataset_key': ds.dataset_key,
+                             'countries': countries})
+        return {'concurrency': self.concurrency,
+                'process_workers': self.process_workers,
+                'rate_limit': self.rate_limit,
+                'estimate': self.estimate(),
+                'datasets': datasets}
+
+    def summary_table(self):
+        '''
+        Returns the plan as a plain text table, one line per dataset and country.
+        '''
+        rows = []
+        for ds, country in self.groups():
+            est = self.estimate_group(ds, country)
+            rows.append([str(ds.index), ds.dataset_type, country, str(len(ds.periods[country])),
+                         str(est['requests']), '{:.1f}'.format(est['estimated_bytes'] / 1024 / 1024),
+                         '{:.1f}'.format(est['estimated_seconds'])])
+        total = self.estimate()
+        rows.append(['TOTAL', '', '', '', str(total['requests']),
+                     '{:.1f}'.format(total['estimated_bytes'] / 1024 / 1024),
+                     '{:.1f}'.format(total['estimated_seconds'])])
+        widths = [max(len(col), *(len(row[i]) for row in rows)) for i, col in enumerate(SUMMARY_COLUMNS)]
+        lines = ['  '.join(col.ljust(w) for col, w in zip(SUMMARY_COLUMNS, widths))]
+        lines.extend('  '.join(val.ljust(w) for val, w in zip(row, widths)) for row in rows)
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _unit_to_dict(unit):
+        res = {'endpoint': unit.endpoint, 'begin': unit.begin.isoformat() if unit.begin else None,
+               'end': unit.end.isoformat() if unit.end else None}
+        if unit.params:
+            res['filter_values'] = {key: len(values) if isinstance(values, list) else 1
+                                    for key, values in unit.params.items()}
+        return res
@@ -0,0 +1,131 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import itertools
+from urllib.parse import quote
+
+# filters that may be split between requests, the metric filter defines result columns so it is never split
+CHUNKED_FILTERS = ['node', 'geo', 'platform', 'target']
+
+DEFAULT_MAX_FILTER_VALUES = 500
+DEFAULT_MAX_URL_BYTES = 8000
+# reserve for the base url and the single value params (begin, end, country, session..)
+QUERY_BASE_BYTES = 300
+
+# chars left unquoted by requests when building the url
+URL_SAFE_CHARS = "!#$%&'()*+,/:;=?@[]~"
+
+
+class StatsRequestPlanner():
+    '''
+    Splits the multi-value stats filters into chunks so that each request carries at most max_filter_values values
+    of each filter and its url does not exceed max_url_bytes.
+
+    The chunks of all split filters are combined (cartesian product), so each combination of the original
+    filter values is requested exactly once and the results can be simply appended.
+
+    With split_timeout or split_max_bytes set, the requests are sent with these limits and a request exceeding
+    them is bisected at run time (see bisect()).
+    '''
+
+    def __init__(self, max_filter_values=DEFAULT_MAX_FILTER_VALUES, max_url_bytes=DEFAULT_MAX_URL_BYTES,
+                 split_timeout=None, split_max_bytes=None):
+        '''
+
+        :param split_timeout: read timeout (seconds) of a stats request, slower requests are split
+        :param split_max_bytes: max response size (Content-Length) of a stats request, bigger requests are split
+        '''
+        self.max_filter_values = max(1, int(max_filter_values or DEFAULT_MAX_FILTER_VALUES))
+        self.max_url_bytes = int(max_url_bytes or DEFAULT_MAX_URL_BYTES)
+        self.split_timeout = split_timeout or None
+        self.split_max_bytes = split_max_bytes or None
+
+    @property
+    def split_enabled(self):
+        return self.split_timeout is not None or self.split_max_bytes is not None
+
+    def request_limits(self):
+        '''
+        Returns the limits as get_stats_data kwargs, empty when splitting is disabled.
+        '''
+        if not self.split_enabled:
+            return {}
+        return {'timeout': self.split_timeout, 'max_content_length': self.split_max_bytes}
+
+    def bisect(self, filter_params):
+        '''
+        Splits request filter params into two requests by halving the values of the longest chunked filter
+        (node, geo, platform, target). Returns None when none of the filters has more than one value.
+        '''
+        splittable = [key for key in CHUNKED_FILTERS if len(filter_params.get(key) or []) > 1]
+        if not splittable:
+            return None
+        key = max(splittable, key=lambda k: len(filter_params[k]))
+        values = filter_params[key]
+        middle = len(values) // 2
+        return [dict(filter_params, **{key: values[:middle]}), dict(filter_params, **{key: values[middle:]})]
+
+    def plan(self, filter_params):
+        '''
+        Returns list of filter params dictionaries, one per request.
+
+        :param filter_params: stats filter params as passed to Client.get_stats_data (filter_name: [values])
+        '''
+        budgets = {}
+        reserved_bytes = QUERY_BASE_BYTES
+        for key, values in filter_params.items():
+            if not values:
+                continue
+            value_sizes = [self._param_bytes(key, v) for v in values]
+            if key in CHUNKED_FILTERS:
+                max_count = min(len(values), self.max_filter_values)
+                budgets[key] = {'count': max_count,
+                                # worst case size of a chunk limited by count only
+                                'bytes': sum(sorted(value_sizes, reverse=True)[:max_count]),
+                                'min_bytes': max(value_sizes),
+                                'sizes': value_sizes}
+            else:
+                reserved_bytes += sum(value_sizes)
+
+        self._fit_url_budget(budgets, reserved_bytes)
+
+        chunks_by_filter = []
+        for key, budget in budgets.items():
+            chunks_by_filter.append([(key, chunk) for chunk in
+                            self._split(filter_params[key], budget['sizes'], budget['count'], budget['bytes'])])
+
+        plan = []
+        for combination in itertools.product(*chunks_by_filter):
+            request_params = dict(filter_params)
+            request_params.update(combination)
+            plan.append(request_params)
+        return plan
+
+    def _fit_url_budget(self, budgets, reserved_bytes):
+        # halve the byte budget of the biggest filter until the worst chunk combination fits into the url limit
+        while budgets and reserved_bytes + sum(b['bytes'] for b in budgets.values()) > self.max_url_bytes:
+            key = max(budgets, key=lambda k: budgets[k]['bytes'])
+            budget = budgets[key]
+            if budget['bytes'] <= budget['min_bytes']:
+                raise ValueError('Stats filters do not fit into the url length limit of {} bytes '
+                                 'even when split into single values!'.format(self.max_url_bytes))
+            budget['bytes'] = max(budget['min_bytes'], budget['bytes'] // 2)
+
+    def _split(self, values, value_sizes, max_count, max_bytes):
+        chunk = []
+        chunk_bytes = 0
+        for value, size in zip(values, value_sizes):
+            if chunk and (len(chunk) >= max_count or chunk_bytes + size > max_bytes):
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+            chunk.append(value)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    def _param_bytes(self, key, value):
+        # &key=value
+        return len(key) + len(quote(str(value), safe=URL_SAFE_CHARS)) + 2
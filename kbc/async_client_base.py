@@ -0,0 +1,205 @@
+'''
+Asyncio counterpart of kbc.client_base.HttpClientBase.
+
+@author: esner
+'''
+import asyncio
+import time
+from urllib.parse import urlencode
+
+import requests
+
+from kbc.client_base import BufferedResponse, HeavyRequestError, GATEWAY_TIMEOUT
+from kbc.rate_limit import THROTTLE_STATUSES, parse_retry_after
+from kbc.instrumentation import request_labels
+
+try:
+    import aiohttp
+    import yarl
+except ImportError:
+    aiohttp = None
+
+DEFAULT_MAX_IN_FLIGHT = 100
+
+
+class AsyncHttpClientBase:
+    """
+    Base class for async clients built on aiohttp.
+
+    All requests share one aiohttp session. The number of requests in flight is bounded by a semaphore
+    (max_in_flight), retries mimic the urllib3 Retry policy used by the sync HttpClientBase. With a rate_limiter
+    the requests are also paced by it and throttled responses (429, 503) are retried.
+    Responses are read completely and returned as BufferedResponse objects.
+
+    The session is bound to the event loop it was created in, so the client has to be used from a single loop
+    and closed with `await close()` (or `async with`).
+    """
+
+    def __init__(self, base_url, max_retries=10, backoff_factor=0.3, status_forcelist=(500, 502, 504),
+                 default_http_header=[], max_in_flight=DEFAULT_MAX_IN_FLIGHT, rate_limiter=None, metrics=None):
+        if aiohttp is None:
+            raise ImportError('The async client requires the aiohttp package. Install it by "pip install aiohttp".')
+        if not base_url:
+            raise ValueError("Base URL is required.")
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = status_forcelist
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+
+        self._auth_header = default_http_header
+        self._session = None
+        self._semaphore = None
+
+    def _get_session(self):
+        # created lazily so it is bound to the running loop
+        if self._session is None:
+            self._semaphore = asyncio.BoundedSemaphore(self.max_in_flight)
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """
+        Closes the underlying session and releases all pooled connections.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _backoff(self, attempt):
+        # same formula as urllib3 Retry, no sleep before the first retry
+        if attempt <= 1:
+            return 0
+        return self.backoff_factor * (2 ** (attempt - 1))
+
+    async def _request(self, method, url, params=None, fail_fast=False, max_content_length=None, timeout=None,
+                       **kwargs):
+        '''
+        fail_fast -- see kbc.client_base.HttpClientBase._send, the read timeout is set by timeout (seconds)
+        '''
+        session = self._get_session()
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(sock_read=timeout)
+        headers = dict(self._auth_header)
+        headers.update(kwargs.pop('headers', None) or {})
+        # build the query the same way requests does, so both clients send identical urls
+        if isinstance(params, dict):
+            # skip None values, string representation of other values (e.g. dates)
+            query = urlencode({k: v for k, v in params.items() if v is not None}, doseq=True)
+            url = yarl.URL(requests.utils.requote_uri(url + '?' + query), encoded=True)
+            params = None
+        elif isinstance(params, bytes):
+            # pre-built query string (duplicate keys)
+            url = yarl.URL(requests.utils.requote_uri(url + '?' + params.decode('utf-8')), encoded=True)
+            params = None
+
+        attempt = 0
+        while True:
+            res = None
+            throttled = False
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async()
+            try:
+                async with self._semaphore:
+                    async with session.request(method, url, params=params, headers=headers, **kwargs) as r:
+                        if fail_fast:
+                            self._check_fail_fast(r, max_content_length)
+                        content = await r.read()
+                        res = BufferedResponse(content, r.status, dict(r.headers), str(r.url))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if fail_fast and isinstance(e, asyncio.TimeoutError):
+                    raise HeavyRequestError('Request timed out: {}'.format(e)) from e
+                if attempt >= self.max_retries:
+                    raise
+            else:
+                throttled = self.rate_limiter is not None and res.status_code in THROTTLE_STATUSES
+                if (res.status_code not in self.status_forcelist and not throttled) or attempt >= self.max_retries:
+                    res.client_retries = attempt
+                    return res
+            finally:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.release(res.status_code if res is not None else None,
+                                              parse_retry_after(res.headers.get('Retry-After'))
+                                              if res is not None else None)
+            attempt += 1
+            if not throttled:
+                # throttled requests are paced by the rate limiter
+                await asyncio.sleep(self._backoff(attempt))
+
+    @staticmethod
+    def _check_fail_fast(r, max_content_length):
+        if r.status == GATEWAY_TIMEOUT:
+            raise HeavyRequestError('Request failed with the gateway timeout (HTTP 504)')
+        if max_content_length and r.content_length and r.content_length > max_content_length:
+            raise HeavyRequestError('Response size {} B exceeds the limit of {} B'.format(r.content_length,
+                                                                                       max_content_length))
+
+    def _record_request(self, url, params, res, start):
+        '''
+        Records the request to metrics if set. res is None when the request failed without a response.
+        '''
+        if self.metrics is None:
+            return
+        endpoint, country = request_labels(url, params)
+        latency = time.perf_counter() - start
+        if res is None:
+            self.metrics.record_request(endpoint, country, latency)
+        else:
+            self.metrics.record_request(endpoint, country, latency, res.status_code, len(res.content),
+                                        res.client_retries)
+
+    async def _get_raw(self, url, params=None, **kwargs):
+        """
+        Async GET returning BufferedResponse.
+
+        Raises:
+            Exception: If the API request fails.
+        """
+        start = time.perf_counter()
+        try:
+            r = await self._request('GET', url, params=params, **kwargs)
+        except Exception:
+            self._record_request(url, params, None, start)
+            raise
+        self._record_request(url, params, r, start)
+        try:
+            r.raise_for_status()
+        except requests.HTTPError:
+            # Handle different error codes
+            raise Exception('Request failed with code: {}, message: {}'.format(r.status_code, r.text))
+        else:
+            return r
+
+    async def get(self, url, params=None, **kwargs):
+        r = await self._get_raw(url, params, **kwargs)
+        return r.json()
+
+    async def _post_raw(self, url, **kwargs):
+        """
+        Async POST returning BufferedResponse.
+
+        Raises:
+            requests.HTTPError: If the API request fails.
+        """
+        start = time.perf_counter()
+        try:
+            r = await self._request('POST', url, **kwargs)
+        except Exception:
+            self._record_request(url, kwargs.get('params'), None, start)
+            raise
+        self._record_request(url, kwargs.get('params'), r, start)
+        r.raise_for_status()
+        return r
+
+    async def post(self, url, **kwargs):
+        r = await self._post_raw(url, **kwargs)
+        return r.json()
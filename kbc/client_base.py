@@ -6,24 +6,97 @@ Created on 5. 10. 2018
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
+from requests.packages.urllib3.exceptions import ReadTimeoutError
 import json
+import time
+
+from kbc.rate_limit import THROTTLE_STATUSES, parse_retry_after
+from kbc.instrumentation import request_labels, response_bytes
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+# gateway timeout, in fail-fast mode treated as a request too heavy for the server
+GATEWAY_TIMEOUT = 504
+
+
+class HeavyRequestError(Exception):
+    """
+    Raised in the fail-fast mode when the request timed out (read timeout or HTTP 504) or its response
+    exceeds the max content length. Such request is not retried, it should be split into smaller ones.
+    """
+
+
+class BufferedResponse:
+    """
+    Minimal requests.Response look-alike over an already read response body.
+
+    Used where the body does not come from a requests session (e.g. the async client) so the consumers
+    can handle all responses the same way.
+    """
+
+    def __init__(self, content, status_code=200, headers=None, url=None, encoding=None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers or {})
+        self.url = url
+        self.encoding = encoding or requests.utils.get_encoding_from_headers(self.headers) or 'utf-8'
+        # retries made by the client that produced the response
+        self.client_retries = 0
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_lines(self, chunk_size=None, decode_unicode=False, delimiter=None):
+        content = self.text if decode_unicode else self.content
+        lines = content.split(delimiter) if delimiter else content.splitlines()
+        for line in lines:
+            yield line
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            raise requests.HTTPError('{} Error for url: {}'.format(self.status_code, self.url), response=self)
+
+    def close(self):
+        pass
 
 
 class HttpClientBase:
     """
     Base class for implementing a single endpoint related to a single entities
 
+    All requests are sent through a single long-lived, pooled session so the underlying
+    connections are kept alive and reused between calls. Call close() when done
+    or use the client as a context manager.
+
     Attributes:
         base_url (str): The base URL for this endpoint.
     """
 
-    def __init__(self, base_url, max_retries = 10, backoff_factor = 0.3, status_forcelist = (500, 502, 504), default_http_header=[]):
+    def __init__(self, base_url, max_retries = 10, backoff_factor = 0.3, status_forcelist = (500, 502, 504), default_http_header=[],
+                 pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False,
+                 rate_limiter=None, metrics=None):
         """
         Create an endpoint.
 
         Args
             root_url (str): Root url of API.
+            pool_connections (int): Number of connection pools to cache (one per host).
+            pool_maxsize (int): Maximum number of connections kept alive in a pool. Should be at least
+                                the number of threads using the client concurrently.
+            pool_block (bool): Whether the pool should block when no free connection is available
+                               instead of opening a new (non-reused) connection.
+            rate_limiter (kbc.rate_limit.AdaptiveRateLimiter): Optional limiter shared by all requests
+                               of the client. Throttled responses (429, 503) are then retried
+                               (up to max_retries) after the limiter backs off.
+            metrics (kbc.instrumentation.PerformanceMetrics): Optional collector the requests made
+                               through _get_raw / _post_raw are recorded to.
 
+        Requests sent with fail_fast=True go through a separate session which does not retry read timeouts
+        and gateway timeouts, see _send().
         """
         if not base_url:
             raise ValueError("Base URL is required.")
@@ -31,23 +104,139 @@ class HttpClientBase:
         self.max_retries = max_retries
         self.backoff_factor = backoff_factor
         self.status_forcelist = status_forcelist
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
 
         self._auth_header = default_http_header
+        self._session = self.requests_retry_session()
+        self._fail_fast_session = None
 
-    def requests_retry_session(self, session=None):
+    def requests_retry_session(self, session=None, fail_fast=False):
+        '''
+        fail_fast -- read timeouts and gateway timeouts (504) are not retried
+        '''
         session = session or requests.Session()
+        status_forcelist = self.status_forcelist
+        if fail_fast:
+            status_forcelist = [s for s in status_forcelist if s != GATEWAY_TIMEOUT]
         retry = Retry(
             total=self.max_retries,
-            read=self.max_retries,
+            # False re-raises the read timeout itself
+            read=False if fail_fast else self.max_retries,
             connect=self.max_retries,
             backoff_factor=self.backoff_factor,
-            status_forcelist=self.status_forcelist
+            status_forcelist=status_forcelist,
+            # with a rate limiter the throttled responses (429, 503 + Retry-After) must reach it
+            respect_retry_after_header=self.rate_limiter is None
             )
-        adapter = HTTPAdapter(max_retries=retry)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize, pool_block=self.pool_block)
         session.mount('http://', adapter)
         session.mount('https://', adapter)
         return session
 
+    def close(self):
+        """
+        Closes the underlying session and releases all pooled connections.
+        """
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self._fail_fast_session is not None:
+            self._fail_fast_session.close()
+            self._fail_fast_session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _request(self, method, url, *args, **kwargs):
+        if self._session is None:
+            raise RuntimeError('The client has already been closed.')
+        # headers are passed per request, the shared session must stay untouched (thread safety)
+        headers = dict(self._auth_header)
+        headers.update(kwargs.pop('headers', None) or {})
+        if self.rate_limiter is None:
+            return self._send(method, url, *args, headers=headers, **kwargs)
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            status_code = retry_after = None
+            try:
+                r = self._send(method, url, *args, headers=headers, **kwargs)
+                status_code = r.status_code
+                retry_after = parse_retry_after(r.headers.get('Retry-After'))
+            finally:
+                self.rate_limiter.release(status_code, retry_after)
+            if status_code not in THROTTLE_STATUSES or attempt >= self.max_retries:
+                r.client_retries = attempt
+                return r
+            r.close()
+            attempt += 1
+
+    def _send(self, method, url, *args, fail_fast=False, max_content_length=None, **kwargs):
+        '''
+        Sends the request through the session.
+
+        fail_fast -- the request is sent once (connection errors and 500, 502 are still retried), a read timeout
+                     (set by the timeout argument), HTTP 504 or Content-Length over max_content_length raise
+                     HeavyRequestError
+        '''
+        if not fail_fast:
+            return self._session.request(method, url, *args, **kwargs)
+
+        if self._fail_fast_session is None:
+            self._fail_fast_session = self.requests_retry_session(fail_fast=True)
+        stream = kwargs.pop('stream', False)
+        try:
+            # headers first, the body is downloaded only when it is not too big
+            r = self._fail_fast_session.request(method, url, *args, stream=True, **kwargs)
+        except requests.ReadTimeout as e:
+            raise HeavyRequestError('Request timed out: {}'.format(e)) from e
+
+        if r.status_code == GATEWAY_TIMEOUT:
+            r.close()
+            raise HeavyRequestError('Request failed with the gateway timeout (HTTP 504)')
+        try:
+            content_length = int(r.headers.get('Content-Length') or 0)
+        except ValueError:
+            content_length = 0
+        if max_content_length and content_length > max_content_length:
+            r.close()
+            raise HeavyRequestError('Response size {} B exceeds the limit of {} B'.format(content_length,
+                                                                                       max_content_length))
+        if not stream:
+            try:
+                r.content
+            except requests.ConnectionError as e:
+                if e.args and isinstance(e.args[0], ReadTimeoutError):
+                    raise HeavyRequestError('Response download timed out: {}'.format(e)) from e
+                raise
+        return r
+
+    def _record_request(self, url, params, res, start, stream=False):
+        '''
+        Records the request to metrics if set. res is None when the request failed without a response.
+        '''
+        if self.metrics is None:
+            return
+        endpoint, country = request_labels(url, params)
+        latency = time.perf_counter() - start
+        if res is None:
+            self.metrics.record_request(endpoint, country, latency)
+            return
+        # retries done by urllib3 + by the client itself (throttling, session renewal)
+        retries = getattr(res, 'client_retries', 0)
+        urllib3_retries = getattr(getattr(res, 'raw', None), 'retries', None)
+        if urllib3_retries is not None:
+            retries += len(urllib3_retries.history)
+        self.metrics.record_request(endpoint, country, latency, res.status_code, response_bytes(res, stream), retries)
 
     def _get_raw(self, url, params=None, **kwargs):
         """
@@ -67,12 +256,13 @@ class HttpClientBase:
         Raises:
             requests.HTTPError: If the API request fails.
         """
-        s = requests.Session()
-        
-        headers = kwargs.pop('headers', {})
-        headers.update(self._auth_header)
-        s.headers.update(headers)
-        r = self.requests_retry_session(session=s).request('GET', url = url, params = params, **kwargs)
+        start = time.perf_counter()
+        try:
+            r = self._request('GET', url, params=params, **kwargs)
+        except Exception:
+            self._record_request(url, params, None, start)
+            raise
+        self._record_request(url, params, r, start, kwargs.get('stream', False))
         try:
             r.raise_for_status()
         except requests.HTTPError:
@@ -85,7 +275,7 @@ class HttpClientBase:
         r = self._get_raw(url, params, **kwargs)
         return r.json()
 
-    def _post_raw(self, *args, **kwargs):
+    def _post_raw(self, url, *args, **kwargs):
         """
         Construct a requests POST call with args and kwargs and process the
         results.
@@ -100,11 +290,13 @@ class HttpClientBase:
         Raises:
             requests.HTTPError: If the API request fails.
         """
-        s = requests.Session()
-        headers = kwargs.pop('headers', {})
-        headers.update(self._auth_header)
-        s.headers.update(headers)
-        r = self.requests_retry_session(session=s).request('POST', *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            r = self._request('POST', url, *args, **kwargs)
+        except Exception:
+            self._record_request(url, kwargs.get('params'), None, start)
+            raise
+        self._record_request(url, kwargs.get('params'), r, start, kwargs.get('stream', False))
         try:
             r.raise_for_status()
         except requests.HTTPError:
@@ -128,19 +320,9 @@ class HttpClientBase:
         Raises:
             requests.HTTPError: If the API request fails.
         """
-        s = requests.Session()
-        headers = kwargs.pop('headers', {})
-        headers.update(self._auth_header)
-        r = self.requests_retry_session(session=s).request('POST', headers=headers, *args, **kwargs)
-        try:
-            r.raise_for_status()
-        except requests.HTTPError:
-            # Handle different error codes
-            raise
-        else:
-            return r.json()
+        return self._post_raw(*args, **kwargs).json()
 
-    def _patch(self, *args, **kwargs):
+    def _patch(self, url, *args, **kwargs):
         """
         Construct a requests POST call with args and kwargs and process the
         results.
@@ -155,9 +337,7 @@ class HttpClientBase:
         Raises:
             requests.HTTPError: If the API request fails.
         """
-        headers = kwargs.pop('headers', {})
-        headers.update(self._auth_header)
-        r = requests.patch(headers=headers, *args, **kwargs)
+        r = self._request('PATCH', url, *args, **kwargs)
         try:
             r.raise_for_status()
         except requests.HTTPError:
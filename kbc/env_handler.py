@@ -32,6 +32,7 @@ class KBCEnvHandler:
         self.cfg_params = self.configuration.get_parameters()
         self.tables_out_path = os.path.join(data_path, 'out', 'tables')
         self.tables_in_path = os.path.join(data_path, 'in', 'tables')
+        self.files_out_path = os.path.join(data_path, 'out', 'files')
 
         self._mandatory_params = mandatory_params
 
@@ -110,8 +111,9 @@ class KBCEnvHandler:
     def get_state_file(self):
         logging.getLogger().info('Loading state file..')
         state_file_path = os.path.join(self.data_path, 'in', 'state.json')
-        if os.path.isfile(state_file_path):
+        if not os.path.isfile(state_file_path):
             logging.getLogger().info('State file not found. First run?')
+            return {}
         try:
             with open(state_file_path, 'r') \
                     as state_file:
@@ -121,7 +123,17 @@ class KBCEnvHandler:
                 "State file state.json unable to read "
             )
 
-    def create_sliced_tables(self, folder_name, pkey=None, incremental=False, src_delimiter=DEFAULT_DEL, src_enclosure=DEFAULT_ENCLOSURE, dest_bucket=None):
+    def write_state_file(self, state_dict):
+        '''
+        Stores state dictionary into DATA_PATH/out/state.json, it will be available in the next run.
+        '''
+        if not isinstance(state_dict, dict):
+            raise TypeError('Dictionary expected as a state file datatype!')
+
+        with open(os.path.join(self.data_path, 'out', 'state.json'), 'w+') as state_file:
+            json.dump(state_dict, state_file)
+
+    def create_sliced_tables(self, folder_name, pkey=None, incremental=False, src_delimiter=DEFAULT_DEL, src_enclosure=DEFAULT_ENCLOSURE, dest_bucket=None, columns=None, table_name=None):
         """
         Creates prepares sliced tables from all files in DATA_PATH/out/tables/{folder_name} - i.e. removes all headers
         and creates single manifest file based on provided parameters.
@@ -130,6 +142,9 @@ class KBCEnvHandler:
         src_enclosure -- enclosure of the source file ["]
         src_delimiter -- delimiter of the source file [,]
         dest_bucket -- name of the destination bucket (optional)
+        columns -- header of the slices (optional), when specified the slices are expected to contain no header
+                   and are left untouched (may be gzip compressed)
+        table_name -- destination table name (optional), folder_name by default
 
 
         """
@@ -146,10 +161,16 @@ class KBCEnvHandler:
         files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if os.path.isfile(
             os.path.join(folder_path, f))]
 
-        header = self.get_and_remove_headers_in_all(
-            files, src_delimiter, src_enclosure)
+        if columns:
+            header = columns
+        else:
+            header = self.get_and_remove_headers_in_all(
+                files, src_delimiter, src_enclosure)
+
         if dest_bucket:
-            destination = dest_bucket + '.' + folder_name
+            destination = dest_bucket + '.' + (table_name or folder_name)
+        else:
+            destination = ''
 
         log.info('Creating manifest file..')
         self.configuration.write_table_manifest(
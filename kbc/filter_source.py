@@ -0,0 +1,159 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import csv
+import gzip
+import json
+import os
+
+
+def numeric_sort_key(value):
+    '''
+    Sort key ordering numeric ids by their value (2 before 10) followed by the other values alphabetically.
+    '''
+    try:
+        return 0, int(value), value
+    except ValueError:
+        return 1, 0, value
+
+
+def unique_values(values, sort=False):
+    '''
+    Returns the non-empty values without duplicates (first occurrence kept), optionally sorted.
+    '''
+    seen = set()
+    result = []
+    for value in values:
+        value = str(value).strip()
+        if value and value not in seen:
+            seen.add(value)
+            result.append(value)
+    if sort:
+        result.sort(key=numeric_sort_key)
+    return result
+
+
+class FilterSourceLoader:
+    """
+    Streams filter values of one column of an input table (a csv file with header or a folder of sliced files
+    described by the table manifest), one row at a time.
+
+    Empty values and duplicates are skipped, the first occurrence of each value is kept, so only the unique values
+    are held in memory. With sort=True the values are returned sorted (numeric ids by value), which makes the stats
+    request chunks independent of the order of the input table and so cacheable across runs.
+    """
+
+    def __init__(self, file_path, column=None, sort=False, delimiter=',', enclosure='"', encoding='utf-8'):
+        '''
+
+        :param file_path: path of the table csv or of the sliced table folder
+        :param column: column name or 0-based position of the values, the first column by default
+        '''
+        self.file_path = file_path
+        self.column = column
+        self.sort = sort
+        self.delimiter = delimiter
+        self.enclosure = enclosure
+        self.encoding = encoding
+        self._header = None
+
+    def load(self):
+        '''
+        Returns list of the unique values of the column.
+        '''
+        return [value for value, row in self.iter_unique_rows()]
+
+    def load_with(self, other_column=None):
+        '''
+        Returns list of (value, other_value) of the first row of each unique value, other_value is None
+        when the row does not contain other_column.
+
+        :param other_column: column name or 0-based position, the column next to the value column by default
+        '''
+        records = []
+        other_pos = None
+        for value, row in self.iter_unique_rows():
+            if other_pos is None:
+                if other_column is None or other_column == '':
+                    other_pos = self._column_position(self._header, self.column) + 1
+                else:
+                    other_pos = self._column_position(self._header, other_column)
+            records.append((value, row[other_pos] if other_pos < len(row) else None))
+        return records
+
+    def iter_unique_rows(self):
+        '''
+        Yields (value, row) of the first row of each unique non-empty value, in the order of the table
+        (in sorted order when sort is set - then all unique rows are collected first).
+        '''
+        rows = self._iter_unique_rows()
+        if self.sort:
+            rows = iter(sorted(rows, key=lambda r: numeric_sort_key(r[0])))
+        return rows
+
+    def _iter_unique_rows(self):
+        seen = set()
+        pos = None
+        for row in self._iter_rows():
+            if pos is None:
+                pos = self._column_position(self._header, self.column)
+            if pos >= len(row):
+                continue
+            value = row[pos].strip()
+            if not value or value in seen:
+                continue
+            seen.add(value)
+            yield value, row
+
+    def _iter_rows(self):
+        '''
+        Yields data rows of the table, the header is stored in _header.
+        '''
+        if os.path.isdir(self.file_path):
+            # sliced table, slices have no header, columns are listed in the manifest
+            self._header = self._get_manifest_columns()
+            for slice_name in sorted(os.listdir(self.file_path)):
+                slice_path = os.path.join(self.file_path, slice_name)
+                if os.path.isfile(slice_path) and not slice_name.endswith('.manifest'):
+                    with self._open(slice_path) as input_:
+                        yield from self._reader(input_)
+            return
+
+        with self._open(self.file_path) as input_:
+            reader = self._reader(input_)
+            self._header = next(reader, None)
+            if self._header is None:
+                return
+            yield from reader
+
+    def _reader(self, input_):
+        return csv.reader(input_, delimiter=self.delimiter, quotechar=self.enclosure)
+
+    def _open(self, path):
+        if path.endswith('.gz'):
+            return gzip.open(path, 'rt', encoding=self.encoding, newline='')
+        return open(path, 'r', encoding=self.encoding, newline='')
+
+    def _get_manifest_columns(self):
+        manifest_path = self.file_path.rstrip(os.sep) + '.manifest'
+        if not os.path.exists(manifest_path):
+            raise ValueError('Sliced table {} has no manifest with the columns'.format(self.file_path))
+        with open(manifest_path, 'r') as manifest:
+            return json.load(manifest).get('columns') or []
+
+    def _column_position(self, header, column):
+        if column is None or column == '':
+            return 0
+        if header and column in header:
+            return header.index(column)
+        try:
+            pos = int(column)
+        except (TypeError, ValueError):
+            raise ValueError('Column "{}" not found in table {}, available columns: {}'.format(
+                column, os.path.basename(self.file_path), header))
+        if pos < 0 or (header and pos >= len(header)):
+            raise ValueError('Column position {} out of range of table {} with {} columns'.format(
+                pos, os.path.basename(self.file_path), len(header)))
+        return pos
@@ -0,0 +1,190 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import threading
+from urllib.parse import urlparse, parse_qs
+
+# upper bounds of the request latency histogram buckets in seconds, the last bucket is unbounded
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+SUMMARY_COLUMNS = ['endpoint', 'country', 'requests', 'errors', 'retries', 'cache_hits', 'p50_s', 'p95_s', 'max_s',
+                   'MB', 'rows', 'write_s']
+
+
+def request_labels(url, params=None):
+    '''
+    Returns (endpoint, country) labels of a request - last url path segment and the country param.
+    '''
+    endpoint = urlparse(str(url)).path.rstrip('/').rsplit('/', 1)[-1]
+    if isinstance(params, bytes):
+        country = parse_qs(params.decode('utf-8')).get('country', [None])[0]
+    elif isinstance(params, dict):
+        country = params.get('country')
+    else:
+        country = None
+    return endpoint, country
+
+
+def response_bytes(res, stream=False):
+    '''
+    Size of the response body, Content-Length for streamed responses which are not read yet (0 when unknown).
+    '''
+    if not stream:
+        return len(res.content)
+    try:
+        return int(res.headers.get('Content-Length') or 0)
+    except ValueError:
+        return 0
+
+
+def _new_group():
+    return {'requests': 0,
+            'errors': 0,
+            'retries': 0,
+            'cache_hits': 0,
+            'response_bytes': 0,
+            'rows_written': 0,
+            'write_time_s': 0.0,
+            'latency_sum_s': 0.0,
+            'latency_max_s': 0.0,
+            'latency_histogram': [0] * (len(LATENCY_BUCKETS) + 1)}
+
+
+class PerformanceMetrics:
+    """
+    Collects per request and per write statistics grouped by endpoint and country. Thread safe, one instance is
+    shared by the client and the extractor service of a run.
+
+    Requests are recorded with their latency (incl. retries), retry count, status and response size, writes with
+    the number of rows and the time spent parsing the response and writing the output. The time of streamed responses
+    includes reading the body, which happens while writing.
+    """
+
+    def __init__(self):
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def record_request(self, endpoint, country, latency, status_code=None, response_bytes=0, retries=0):
+        '''
+
+        :param status_code: None when the request failed without a response
+        '''
+        with self._lock:
+            group = self._get_group(endpoint, country)
+            group['requests'] += 1
+            if status_code is None or status_code >= 400:
+                group['errors'] += 1
+            group['retries'] += retries
+            group['response_bytes'] += response_bytes
+            group['latency_sum_s'] += latency
+            group['latency_max_s'] = max(group['latency_max_s'], latency)
+            group['latency_histogram'][self._bucket(latency)] += 1
+
+    def record_cache_hit(self, endpoint, country, response_bytes=0):
+        with self._lock:
+            group = self._get_group(endpoint, country)
+            group['cache_hits'] += 1
+            group['response_bytes'] += response_bytes
+
+    def record_write(self, endpoint, country, rows, seconds):
+        with self._lock:
+            group = self._get_group(endpoint, country)
+            group['rows_written'] += rows
+            group['write_time_s'] += seconds
+
+    def merge(self, report):
+        '''
+        Adds statistics of a report returned by to_dict() (e.g. from another process).
+        '''
+        with self._lock:
+            for src in report['groups']:
+                group = self._get_group(src['endpoint'], src['country'])
+                for key in ['requests', 'errors', 'retries', 'cache_hits', 'response_bytes', 'rows_written',
+                            'write_time_s', 'latency_sum_s']:
+                    group[key] += src[key]
+                group['latency_max_s'] = max(group['latency_max_s'], src['latency_max_s'])
+                group['latency_histogram'] = [a + b for a, b in zip(group['latency_histogram'],
+                                                                    src['latency_histogram'])]
+
+    def to_dict(self):
+        '''
+        Returns the report: {'latency_buckets': [...], 'groups': [{'endpoint', 'country', <statistics>}],
+        'totals': {<statistics>}}
+        '''
+        with self._lock:
+            groups = []
+            totals = _new_group()
+            for (endpoint, country), group in sorted(self._groups.items()):
+                groups.append(dict(self._with_percentiles(group), endpoint=endpoint, country=country))
+                for key in ['requests', 'errors', 'retries', 'cache_hits', 'response_bytes', 'rows_written',
+                            'write_time_s', 'latency_sum_s']:
+                    totals[key] += group[key]
+                totals['latency_max_s'] = max(totals['latency_max_s'], group['latency_max_s'])
+                totals['latency_histogram'] = [a + b for a, b in zip(totals['latency_histogram'],
+                                                                     group['latency_histogram'])]
+            return {'latency_buckets': list(LATENCY_BUCKETS) + [None],
+                    'groups': groups,
+                    'totals': self._with_percentiles(totals)}
+
+    def summary_table(self):
+        '''
+        Returns the report as a plain text table, one line per endpoint and country.
+        '''
+        report = self.to_dict()
+        rows = [self._summary_row(g, g['endpoint'], g['country']) for g in report['groups']]
+        rows.append(self._summary_row(report['totals'], 'TOTAL', ''))
+        widths = [max(len(col), *(len(row[i]) for row in rows)) for i, col in enumerate(SUMMARY_COLUMNS)]
+        lines = ['  '.join(col.ljust(w) for col, w in zip(SUMMARY_COLUMNS, widths))]
+        lines.extend('  '.join(val.ljust(w) for val, w in zip(row, widths)) for row in rows)
+        return '\n'.join(lines)
+
+    def _summary_row(self, group, endpoint, country):
+        return [endpoint, country or '', str(group['requests']), str(group['errors']), str(group['retries']),
+                str(group['cache_hits']), self._format_latency(group['latency_p50_s']),
+                self._format_latency(group['latency_p95_s']), '{:.3f}'.format(group['latency_max_s']),
+                '{:.1f}'.format(group['response_bytes'] / 1024 / 1024), str(group['rows_written']),
+                '{:.2f}'.format(group['write_time_s'])]
+
+    @staticmethod
+    def _format_latency(value):
+        return '-' if value is None else '<={}'.format(value)
+
+    def _get_group(self, endpoint, country):
+        key = (endpoint, country or '')
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _new_group()
+        return group
+
+    @staticmethod
+    def _bucket(latency):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                return i
+        return len(LATENCY_BUCKETS)
+
+    @staticmethod
+    def _with_percentiles(group):
+        '''
+        Copy of the group with rounded values and p50/p95 latency (upper bound of the bucket, max latency
+        in the last one).
+        '''
+        group = dict(group)
+        group['latency_histogram'] = list(group['latency_histogram'])
+        total = sum(group['latency_histogram'])
+        for name, quantile in [('latency_p50_s', 0.5), ('latency_p95_s', 0.95)]:
+            group[name] = None
+            if not total:
+                continue
+            seen = 0
+            for i, count in enumerate(group['latency_histogram']):
+                seen += count
+                if seen >= quantile * total:
+                    group[name] = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else round(group['latency_max_s'], 3)
+                    break
+        group['write_time_s'] = round(group['write_time_s'], 3)
+        group['latency_sum_s'] = round(group['latency_sum_s'], 3)
+        group['latency_max_s'] = round(group['latency_max_s'], 3)
+        return group
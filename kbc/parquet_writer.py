@@ -0,0 +1,122 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import itertools
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DEFAULT_BATCH_ROWS = 100000
+DEFAULT_COMPRESSION = 'zstd'
+
+
+class ParquetRowWriter:
+    """
+    csv.writer like object writing rows of text values into a typed Parquet file.
+
+    The first written row is the header. Rows are buffered and converted column-wise once batch_rows rows are
+    collected, each batch is written as one row group. Values of numeric_columns are stored as doubles
+    (empty values as nulls), dictionary_columns are dictionary encoded strings, other columns plain strings.
+
+    The file is created with the first batch, so no file exists when no data rows were written.
+    """
+
+    def __init__(self, file_path, numeric_columns=(), dictionary_columns=(), batch_rows=DEFAULT_BATCH_ROWS,
+                 compression=DEFAULT_COMPRESSION):
+        if pyarrow is None:
+            raise ImportError('Parquet output requires the pyarrow package. Install it by "pip install pyarrow".')
+        self.name = file_path
+        self.numeric_columns = set(numeric_columns)
+        self.dictionary_columns = set(dictionary_columns)
+        self.batch_rows = batch_rows or DEFAULT_BATCH_ROWS
+        self.compression = compression
+
+        self.columns = None
+        self.schema = None
+        self.rows_written = 0
+
+        self._rows = []
+        self._writer = None
+
+    def writerow(self, row):
+        if self.columns is None:
+            self._set_columns(row)
+            return
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_rows:
+            self._flush()
+
+    def writerows(self, rows):
+        rows = iter(rows)
+        if self.columns is None:
+            header = next(rows, None)
+            if header is None:
+                return
+            self._set_columns(header)
+        while True:
+            # consume whole batches at once
+            batch = list(itertools.islice(rows, self.batch_rows - len(self._rows)))
+            if not batch:
+                return
+            self._rows.extend(batch)
+            if len(self._rows) >= self.batch_rows:
+                self._flush()
+
+    def close(self):
+        if self._rows:
+            self._flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _set_columns(self, header):
+        self.columns = list(header)
+        fields = []
+        for col in self.columns:
+            if col in self.numeric_columns:
+                fields.append(pyarrow.field(col, pyarrow.float64()))
+            elif col in self.dictionary_columns:
+                fields.append(pyarrow.field(col, pyarrow.dictionary(pyarrow.int32(), pyarrow.string())))
+            else:
+                fields.append(pyarrow.field(col, pyarrow.string()))
+        self.schema = pyarrow.schema(fields)
+
+    def _flush(self):
+        values = list(zip(*self._rows))
+        arrays = [self._to_array(field, col_values) for field, col_values in zip(self.schema, values)]
+        table = pyarrow.Table.from_arrays(arrays, schema=self.schema)
+        if self._writer is None:
+            self._writer = pyarrow.parquet.ParquetWriter(self.name, self.schema, compression=self.compression)
+        self._writer.write_table(table)
+        self.rows_written += len(self._rows)
+        self._rows = []
+
+    @staticmethod
+    def _to_array(field, values):
+        try:
+            array = pyarrow.array(values, type=pyarrow.string())
+        except pyarrow.ArrowTypeError:
+            # non-string values (e.g. period datetimes) are stored as text, the same way csv.writer writes them
+            array = pyarrow.array(['' if v is None else str(v) for v in values], type=pyarrow.string())
+        if pyarrow.types.is_floating(field.type):
+            array = pyarrow.compute.if_else(pyarrow.compute.equal(array, ''), pyarrow.scalar(None, pyarrow.string()),
+                                            array)
+            try:
+                return array.cast(field.type)
+            except pyarrow.ArrowInvalid as e:
+                raise ValueError('Column "{}" contains non-numeric values: {}'.format(field.name, e)) from e
+        if pyarrow.types.is_dictionary(field.type):
+            return array.dictionary_encode()
+        return array
@@ -0,0 +1,255 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import collections
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILING_OFF = 'off'
+# cProfile of the main thread + tracemalloc allocation sites, noticeable overhead
+PROFILING_FULL = 'full'
+# statistical stack sampling of all threads, low overhead
+PROFILING_SAMPLING = 'sampling'
+PROFILING_MODES = [PROFILING_OFF, PROFILING_FULL, PROFILING_SAMPLING]
+
+# overrides the config parameter, so a run can be profiled without changing the configuration
+PROFILING_ENV_VAR = 'KBC_PROFILING'
+
+DEFAULT_SAMPLE_INTERVAL = 0.01
+DEFAULT_TOP_ENTRIES = 30
+# frames stored per traced allocation, 1 is enough for the allocation sites by line
+DEFAULT_TRACEMALLOC_FRAMES = 1
+# traced memory is checked for a new peak this often [s]
+DEFAULT_PEAK_POLL_INTERVAL = 0.1
+# a new peak snapshot is taken once the traced memory grows by this fraction over the last one,
+# so a steadily growing run does not take a snapshot on every check
+PEAK_SNAPSHOT_GROWTH = 0.1
+
+
+def resolve_profiling_mode(config_value=None):
+    '''
+    Returns the profiling mode set by the env variable or by the config value, off by default.
+    '''
+    mode = (os.environ.get(PROFILING_ENV_VAR) or config_value or PROFILING_OFF).strip().lower()
+    if mode not in PROFILING_MODES:
+        raise ValueError('Unsupported profiling mode "{}", supported modes: {}'.format(mode, PROFILING_MODES))
+    return mode
+
+
+class StackSampler(threading.Thread):
+    """
+    Daemon thread taking snapshots of the stacks of all other threads every `interval` seconds.
+    Identical stacks are counted, so the result is a statistical profile of where the threads spend their time
+    (incl. waiting on the network).
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        threading.Thread.__init__(self, name='stack-sampler', daemon=True)
+        self.interval = interval
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.stacks[self._get_stack(frame)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed_stacks(self):
+        '''
+        Returns lines in the collapsed stack format ("outer;...;inner count"), readable by flamegraph.pl
+        or speedscope.
+        '''
+        return ['{} {}'.format(';'.join(stack), count) for stack, count in self.stacks.most_common()]
+
+    def top_functions(self, limit=DEFAULT_TOP_ENTRIES):
+        '''
+        Returns [(function, samples)] of the functions most often on top of a stack.
+        '''
+        own = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+        return own.most_common(limit)
+
+    @staticmethod
+    def _get_stack(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+
+class PeakMemorySampler(threading.Thread):
+    """
+    Daemon thread checking the traced memory every `interval` seconds and taking a tracemalloc snapshot
+    whenever it reaches a new high (by more than PEAK_SNAPSHOT_GROWTH), so the allocation sites behind the peak
+    are known even when the memory is released before the end of the run.
+
+    The memory is polled, so the snapshot is the highest one seen by the checks, a short spike between two checks
+    may be higher. tracemalloc must be started before.
+    """
+
+    def __init__(self, interval=DEFAULT_PEAK_POLL_INTERVAL):
+        threading.Thread.__init__(self, name='peak-memory-sampler', daemon=True)
+        self.interval = interval
+        self.snapshot = None
+        self.snapshot_size = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.check()
+
+    def check(self):
+        '''
+        Takes a snapshot when the traced memory is a new high.
+        '''
+        current, peak = tracemalloc.get_traced_memory()
+        if self.snapshot is None or current > self.snapshot_size * (1 + PEAK_SNAPSHOT_GROWTH):
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_size = current
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RunProfiler:
+    """
+    Context manager profiling the enclosed code and storing the results as files in out_path.
+
+    full mode - cProfile of the current thread (where the responses are parsed and written) stored as
+    <prefix>.prof (for snakeviz / pstats) and <prefix>-stats.txt (top functions by cumulative time),
+    tracemalloc top allocation sites at the (sampled) memory peak and of the memory still allocated at the end
+    stored as <prefix>-allocations.txt.
+
+    sampling mode - StackSampler of all threads stored as <prefix>-samples.txt (collapsed stacks) and
+    <prefix>-stats.txt (top functions by samples).
+
+    Paths of the written files are available in `artifacts` after the exit.
+    """
+
+    def __init__(self, mode, out_path, prefix='profile', sample_interval=DEFAULT_SAMPLE_INTERVAL,
+                 top_entries=DEFAULT_TOP_ENTRIES, tracemalloc_frames=DEFAULT_TRACEMALLOC_FRAMES,
+                 peak_poll_interval=DEFAULT_PEAK_POLL_INTERVAL):
+        if mode not in PROFILING_MODES:
+            raise ValueError('Unsupported profiling mode "{}", supported modes: {}'.format(mode, PROFILING_MODES))
+        self.mode = mode
+        self.out_path = out_path
+        self.prefix = prefix
+        self.sample_interval = sample_interval
+        self.top_entries = top_entries
+        self.tracemalloc_frames = tracemalloc_frames
+        self.peak_poll_interval = peak_poll_interval
+        self.artifacts = []
+
+        self._profile = None
+        self._sampler = None
+        self._peak_sampler = None
+        self._start = None
+
+    @property
+    def enabled(self):
+        return self.mode != PROFILING_OFF
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        logging.info('Profiling the run in %s mode..', self.mode)
+        self._start = time.perf_counter()
+        if self.mode == PROFILING_FULL:
+            tracemalloc.start(self.tracemalloc_frames)
+            self._peak_sampler = PeakMemorySampler(self.peak_poll_interval)
+            self._peak_sampler.start()
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = StackSampler(self.sample_interval)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.enabled:
+            return
+        # the results are stored even when the run failed, they are most useful then
+        elapsed = time.perf_counter() - self._start
+        os.makedirs(self.out_path, exist_ok=True)
+        if self.mode == PROFILING_FULL:
+            self._profile.disable()
+            self._peak_sampler.stop()
+            # the memory may have peaked since the last check
+            self._peak_sampler.check()
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self._store_profile()
+            self._store_allocations(snapshot, current, peak, self._peak_sampler.snapshot,
+                                    self._peak_sampler.snapshot_size)
+        else:
+            self._sampler.stop()
+            self._store_samples(elapsed)
+        logging.info('Profiling results stored in %s', ', '.join(os.path.basename(a) for a in self.artifacts))
+
+    def _store_profile(self):
+        prof_path = self._artifact_path('.prof')
+        self._profile.dump_stats(prof_path)
+        self.artifacts.append(prof_path)
+
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_entries)
+        self._write_text('-stats.txt', out.getvalue())
+
+    def _store_allocations(self, snapshot, current, peak, peak_snapshot, peak_snapshot_size):
+        lines = ['Traced memory peak: {:.1f} MiB, at the peak snapshot: {:.1f} MiB, at the end: {:.1f} MiB'.format(
+                     peak / 1024 / 1024, peak_snapshot_size / 1024 / 1024, current / 1024 / 1024),
+                 '',
+                 'Top {} allocation sites at the peak snapshot (memory checked every {}s):'.format(
+                     self.top_entries, self.peak_poll_interval)]
+        lines.extend(self._top_allocations(peak_snapshot))
+        lines.extend(['', 'Top {} allocation sites still allocated at the end:'.format(self.top_entries)])
+        lines.extend(self._top_allocations(snapshot))
+        self._write_text('-allocations.txt', '\n'.join(lines) + '\n')
+
+    def _top_allocations(self, snapshot):
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                           tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                                           tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+                                           tracemalloc.Filter(False, __file__)])
+        return [str(stat) for stat in snapshot.statistics('lineno')[:self.top_entries]]
+
+    def _store_samples(self, elapsed):
+        self._write_text('-samples.txt', '\n'.join(self._sampler.collapsed_stacks()) + '\n')
+
+        lines = ['{} samples in {:.1f}s (interval {}s), all threads'.format(self._sampler.samples, elapsed,
+                                                                             self.sample_interval),
+                 'Top {} functions by samples:'.format(self.top_entries)]
+        lines.extend('{:>8} {}'.format(count, function) for function, count in
+                     self._sampler.top_functions(self.top_entries))
+        self._write_text('-stats.txt', '\n'.join(lines) + '\n')
+
+    def _write_text(self, suffix, content):
+        path = self._artifact_path(suffix)
+        with open(path, 'w') as out:
+            out.write(content)
+        self.artifacts.append(path)
+
+    def _artifact_path(self, suffix):
+        return os.path.join(self.out_path, self.prefix + suffix)
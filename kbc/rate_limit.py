@@ -0,0 +1,203 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import asyncio
+import email.utils
+import logging
+import threading
+import time
+
+# responses signalling the server is overloaded / throttling the client
+THROTTLE_STATUSES = (429, 503)
+
+DEFAULT_RATE = 10.0
+DEFAULT_MIN_RATE = 0.2
+DEFAULT_MAX_CONCURRENCY = 10
+# rate increase in requests/s per second of successful requests
+DEFAULT_INCREASE_STEP = 1.0
+DEFAULT_DECREASE_FACTOR = 0.5
+# throttled responses of requests sent before the last decrease are not counted again
+DEFAULT_DECREASE_COOLDOWN = 1.0
+# async waiters cannot be notified by a release, they poll
+ASYNC_POLL_INTERVAL = 0.01
+
+
+def parse_retry_after(value):
+    '''
+    Returns Retry-After header value (delta-seconds or HTTP-date) in seconds, None when missing or invalid.
+    '''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class AdaptiveRateLimiter:
+    """
+    Client-wide token bucket rate limiter with an AIMD (additive increase, multiplicative decrease) controller
+    of the request rate and of the number of concurrent requests.
+
+    Each request takes a token from the bucket (refilled at `rate` tokens per second, up to `burst`) and
+    a concurrency slot. A throttled response (429, 503) multiplies the rate and the concurrency limit
+    by decrease_factor and, when it carries Retry-After, pauses all requests for the given time. Successful responses
+    raise them additively back towards max_rate and max_concurrency.
+
+    Thread safe, shared by all threads using one client. The async client uses the same instance
+    through acquire_async().
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, max_rate=None, min_rate=DEFAULT_MIN_RATE,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, burst=None, increase_step=DEFAULT_INCREASE_STEP,
+                 decrease_factor=DEFAULT_DECREASE_FACTOR, decrease_cooldown=DEFAULT_DECREASE_COOLDOWN):
+        '''
+
+        :param rate: initial rate in requests per second
+        :param max_rate: max rate the limiter ramps up to, rate by default
+        :param min_rate: the rate is never decreased below
+        :param max_concurrency: max number of concurrent requests
+        :param burst: size of the token bucket, max(1, max_concurrency) by default
+        :param increase_step: rate increase (requests/s) per second worth of successful requests
+        :param decrease_factor: the rate and concurrency limit multiplier on a throttled response
+        :param decrease_cooldown: min number of seconds between two decreases
+        '''
+        if not rate or rate <= 0:
+            raise ValueError('Rate must be a positive number, got {}'.format(rate))
+        self.max_rate = max(max_rate or rate, rate)
+        self.min_rate = min(min_rate, rate)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.burst = burst or self.max_concurrency
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+
+        self.requests = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+
+        self._rate = float(rate)
+        self._concurrency_limit = float(self.max_concurrency)
+        self._tokens = float(self.burst)
+        self._in_flight = 0
+        self._last_refill = time.monotonic()
+        self._last_decrease = None
+        self._pause_until = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def rate(self):
+        '''
+        Current rate limit in requests per second.
+        '''
+        return self._rate
+
+    @property
+    def concurrency_limit(self):
+        '''
+        Current max number of concurrent requests.
+        '''
+        return int(self._concurrency_limit)
+
+    def acquire(self):
+        '''
+        Blocks until the request may be sent. Each acquire() must be followed by release().
+        '''
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                wait = self._try_acquire()
+                if wait == 0:
+                    break
+                # None - wait for a released slot
+                self._cond.wait(wait)
+            self.wait_time += time.monotonic() - start
+
+    async def acquire_async(self):
+        '''
+        Async counterpart of acquire().
+        '''
+        start = time.monotonic()
+        while True:
+            with self._cond:
+                wait = self._try_acquire()
+                if wait == 0:
+                    self.wait_time += time.monotonic() - start
+                    return
+            await asyncio.sleep(ASYNC_POLL_INTERVAL if wait is None else wait)
+
+    def release(self, status_code=None, retry_after=None):
+        '''
+        Releases the concurrency slot and adjusts the limits by the response.
+
+        :param status_code: response status, None when the request failed without a response (no adjustment)
+        :param retry_after: Retry-After of the response in seconds
+        '''
+        with self._cond:
+            self._in_flight -= 1
+            if status_code in THROTTLE_STATUSES:
+                self._decrease(status_code, retry_after)
+            elif status_code is not None and status_code < 500:
+                self._increase()
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'rate': round(self._rate, 2),
+                    'concurrency_limit': int(self._concurrency_limit),
+                    'in_flight': self._in_flight,
+                    'requests': self.requests,
+                    'throttled': self.throttled,
+                    'wait_time_s': round(self.wait_time, 3)}
+
+    def _try_acquire(self):
+        '''
+        Takes a token and a concurrency slot when available. Returns 0 when acquired, otherwise number of seconds
+        to wait before the next attempt or None when waiting for a released slot. Must be called under the lock.
+        '''
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+        if now < self._pause_until:
+            return self._pause_until - now
+        if self._in_flight >= int(self._concurrency_limit):
+            return None
+        if self._tokens < 1:
+            return (1 - self._tokens) / self._rate
+
+        self._tokens -= 1
+        self._in_flight += 1
+        self.requests += 1
+        return 0
+
+    def _increase(self):
+        # +increase_step per second worth of requests, +1 concurrent request per full window
+        self._rate = min(self.max_rate, self._rate + self.increase_step / self._rate)
+        self._concurrency_limit = min(self.max_concurrency, self._concurrency_limit + 1 / self._concurrency_limit)
+
+    def _decrease(self, status_code, retry_after):
+        self.throttled += 1
+        now = time.monotonic()
+        if retry_after:
+            self._pause_until = max(self._pause_until, now + retry_after)
+        if self._last_decrease is not None and now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self._rate = max(self.min_rate, self._rate * self.decrease_factor)
+        self._concurrency_limit = max(1.0, self._concurrency_limit * self.decrease_factor)
+        # drop the accumulated burst
+        self._tokens = min(self._tokens, 0.0)
+        logging.warning('Throttled by the server (HTTP %s%s), rate limit decreased to %.2f req/s, '
+                        '%s concurrent requests', status_code,
+                        ', retry after {}s'.format(retry_after) if retry_after else '', self._rate,
+                        int(self._concurrency_limit))
@@ -0,0 +1,88 @@
+'''
+Created on 18. 10. 2026
+
+@author: esner
+'''
+import csv
+import gzip
+import os
+
+DEFAULT_SLICE_MAX_ROWS = 1000000
+DEFAULT_SLICE_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_COMPRESS_LEVEL = 6
+
+
+class SlicedFileWriter:
+    """
+    Text file-like object writing csv lines into a folder of (gzip compressed) slices of bounded size.
+
+    The folder is a KBC sliced table: slices contain no header, the first written line is taken as the header and
+    exposed in `columns` so it can be passed to the table manifest. New slice is started once the current one
+    reaches max_rows rows or max_bytes (uncompressed) bytes.
+
+    Each write() call must contain whole rows only, which is how csv.writer writes (one call per row).
+    """
+
+    def __init__(self, folder_path, max_rows=DEFAULT_SLICE_MAX_ROWS, max_bytes=DEFAULT_SLICE_MAX_BYTES, compress=True,
+                 delimiter=',', enclosure='"', encoding='utf-8', compress_level=DEFAULT_COMPRESS_LEVEL):
+        self.name = folder_path
+        self.max_rows = max_rows or DEFAULT_SLICE_MAX_ROWS
+        self.max_bytes = max_bytes or DEFAULT_SLICE_MAX_BYTES
+        self.compress = compress
+        self.delimiter = delimiter
+        self.enclosure = enclosure
+        self.encoding = encoding
+        self.compress_level = compress_level
+
+        self.columns = None
+        self.rows_written = 0
+        self.slices = []
+
+        self._slice = None
+        self._slice_rows = 0
+        self._slice_bytes = 0
+
+        os.makedirs(folder_path, exist_ok=True)
+
+    def write(self, s):
+        if self.columns is None:
+            self.columns = next(csv.reader([s], delimiter=self.delimiter, quotechar=self.enclosure))
+            return len(s)
+
+        data = s.encode(self.encoding)
+        if self._slice is None or self._slice_rows >= self.max_rows or (
+                self._slice_rows > 0 and self._slice_bytes + len(data) > self.max_bytes):
+            self._next_slice()
+        self._slice.write(data)
+        self._slice_rows += 1
+        self._slice_bytes += len(data)
+        self.rows_written += 1
+        return len(s)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def close(self):
+        if self._slice is not None:
+            self._slice.close()
+            self._slice = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _next_slice(self):
+        self.close()
+        slice_name = 'part-{:05d}.csv'.format(len(self.slices) + 1)
+        if self.compress:
+            slice_path = os.path.join(self.name, slice_name + '.gz')
+            self._slice = gzip.open(slice_path, 'wb', compresslevel=self.compress_level)
+        else:
+            slice_path = os.path.join(self.name, slice_name)
+            self._slice = open(slice_path, 'wb')
+        self.slices.append(slice_path)
+        self._slice_rows = 0
+        self._slice_bytes = 0
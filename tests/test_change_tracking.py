@@ -0,0 +1,145 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+
+from gemius.change_tracking import ChangeIntervalWriter
+from gemius.extractor_service import ExtractorService, OUTPUT_MODE_CHANGES, VALID_FROM
+
+HEADER = ['id', 'country', 'parent_id', 'name', 'begin_period', 'end_period', 'period_type']
+KEY = ['id', 'country']
+
+
+class ListWriter:
+
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(list(row))
+
+
+def _day(day):
+    return datetime(2026, 10, day)
+
+
+def _run(days, open_intervals=None):
+    '''
+    Writes daily snapshots {day: [(id, parent_id, name)]}, returns (written rows without header, open intervals).
+    '''
+    out = ListWriter()
+    writer = ChangeIntervalWriter(out, KEY, open_intervals)
+    writer.writerow(HEADER)
+    for day, nodes in sorted(days.items()):
+        for node_id, parent_id, name in nodes:
+            writer.writerow([node_id, 'cz', parent_id, name, _day(day), _day(day), 'daily'])
+    writer.finish()
+    assert out.rows[0] == HEADER[:-3] + ['valid_from', 'valid_to']
+    return out.rows[1:], writer.open_intervals()
+
+
+def _row(node_id, parent_id, name, valid_from, valid_to):
+    return [node_id, 'cz', parent_id, name, _day(valid_from), _day(valid_to)]
+
+
+def _open_interval(node_id, parent_id, name, valid_from, valid_to):
+    attributes_hash = hashlib.md5('\x1f'.join([node_id, 'cz', parent_id, name]).encode('utf-8')).hexdigest()[:16]
+    return [attributes_hash, _day(valid_from).isoformat(), _day(valid_to).isoformat()]
+
+
+def test_consecutive_windows_extend_open_interval():
+    first, open_intervals = _run({1: [('1', '0', 'a')], 2: [('1', '0', 'a')]})
+    assert first == [_row('1', '0', 'a', 1, 2)]
+
+    second, open_intervals = _run({3: [('1', '0', 'a')], 4: [('1', '0', 'a')]}, open_intervals)
+    # same key and valid_from, replaces the row of the first run
+    assert second == [_row('1', '0', 'a', 1, 4)]
+    # only the attributes hash is kept in the state, not the row
+    assert open_intervals == {'1\x1fcz': _open_interval('1', '0', 'a', 1, 4)}
+
+
+def test_interval_ending_the_day_before_is_continued():
+    _, open_intervals = _run({1: [('1', '0', 'a'), ('2', '0', 'x')], 2: [('1', '0', 'a'), ('2', '0', 'x')]})
+
+    # no lookback, the previous intervals end exactly the day before the first period
+    second, open_intervals = _run({3: [('1', '0', 'a'), ('2', '0', 'y')]}, open_intervals)
+    # 2 changed, its closed row written by the previous run stays valid
+    assert second == [_row('1', '0', 'a', 1, 3), _row('2', '0', 'y', 3, 3)]
+    assert open_intervals == {'1\x1fcz': _open_interval('1', '0', 'a', 1, 3),
+                              '2\x1fcz': _open_interval('2', '0', 'y', 3, 3)}
+
+
+def test_lookback_overlap_is_not_duplicated():
+    _, open_intervals = _run({1: [('1', '0', 'a')], 2: [('1', '0', 'a')], 3: [('1', '0', 'a')]})
+
+    second, _ = _run({2: [('1', '0', 'a')], 3: [('1', '0', 'a')], 4: [('1', '0', 'a')]}, open_intervals)
+    assert second == [_row('1', '0', 'a', 1, 4)]
+
+
+def test_change_in_lookback_closes_previous_interval():
+    _, open_intervals = _run({1: [('1', '0', 'a')], 2: [('1', '0', 'a')], 3: [('1', '0', 'a')]})
+
+    # lookback of two days, the name changed on the 3rd
+    second, open_intervals = _run({2: [('1', '0', 'a')], 3: [('1', '0', 'b')], 4: [('1', '0', 'b')]},
+                                  open_intervals)
+    assert second == [_row('1', '0', 'a', 1, 2), _row('1', '0', 'b', 3, 4)]
+    assert open_intervals == {'1\x1fcz': _open_interval('1', '0', 'b', 3, 4)}
+
+
+def test_restated_first_period_keeps_previous_row(caplog):
+    _, open_intervals = _run({1: [('1', '0', 'a')], 2: [('1', '0', 'a')], 3: [('1', '0', 'a')]})
+
+    # the 3rd re-extracted with a different name, the row of the previous run cannot be rebuilt
+    with caplog.at_level(logging.WARNING):
+        second, open_intervals = _run({3: [('1', '0', 'b')], 4: [('1', '0', 'b')]}, open_intervals)
+    assert second == [_row('1', '0', 'b', 3, 4)]
+    assert '1 intervals of the previous run changed in the lookback periods' in caplog.text
+
+
+def test_missing_key_closes_interval():
+    _, open_intervals = _run({1: [('1', '0', 'a'), ('2', '0', 'x')], 2: [('1', '0', 'a'), ('2', '0', 'x')]})
+
+    second, open_intervals = _run({3: [('1', '0', 'a')]}, open_intervals)
+    # the row of 2 closed on the 2nd was written by the previous run
+    assert second == [_row('1', '0', 'a', 1, 3)]
+    assert list(open_intervals) == ['1\x1fcz']
+
+    # missing in the lookback period
+    _, open_intervals = _run({1: [('1', '0', 'a'), ('2', '0', 'x')], 2: [('1', '0', 'a'), ('2', '0', 'x')]})
+    second, open_intervals = _run({2: [('1', '0', 'a'), ('2', '0', 'x')], 3: [('1', '0', 'a')]}, open_intervals)
+    assert second == [_row('2', '0', 'x', 1, 2), _row('1', '0', 'a', 1, 3)]
+
+
+def test_gap_between_windows_starts_new_interval():
+    _, open_intervals = _run({1: [('1', '0', 'a')]})
+
+    second, _ = _run({5: [('1', '0', 'a')]}, open_intervals)
+    assert second == [_row('1', '0', 'a', 5, 5)]
+
+
+def test_window_without_periods_keeps_open_intervals():
+    _, open_intervals = _run({1: [('1', '0', 'a')]})
+
+    second, kept = _run({}, open_intervals)
+    assert second == []
+    assert kept == open_intervals
+
+
+def test_reparenting_is_change_of_the_same_key():
+    rows, _ = _run({1: [('1', '0', 'a')], 2: [('1', '5', 'a')]})
+    assert rows == [_row('1', '0', 'a', 1, 1), _row('1', '5', 'a', 2, 2)]
+
+
+def test_changes_mode_key_excludes_parent_id():
+    service = ExtractorService(object())
+    for ds_type in ['nodes', 'geos', 'platforms']:
+        assert service._get_ds_pkey(ds_type, OUTPUT_MODE_CHANGES) == ['id', 'country', VALID_FROM]
+    assert 'parent_id' in service._get_ds_pkey('nodes')
+
+
+def test_intervals_survive_state_serialization():
+    _, open_intervals = _run({1: [('1', '0', 'a')]})
+
+    second, _ = _run({2: [('1', '0', 'a')]}, json.loads(json.dumps(open_intervals)))
+    assert second == [_row('1', '0', 'a', 1, 2)]
+    assert isinstance(second[0][-1], datetime) and second[0][-1] - second[0][-2] == timedelta(days=1)
@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from gemius.client import Client
+
+BASE_URL = 'https://gemius.test/v1/'
+
+
+def _response(status_code, body):
+    res = requests.Response()
+    res.status_code = status_code
+    res._content = body.encode('utf-8')
+    res._content_consumed = True
+    res.encoding = 'utf-8'
+    return res
+
+
+class FakeGemius:
+    '''
+    Stubbed Client._send accepting only the token of the last login.
+    '''
+
+    def __init__(self, token='expired', expired_status=401, expired_body='', barrier=None):
+        self.token = token
+        self.expired_status = expired_status
+        self.expired_body = expired_body
+        self.barrier = barrier
+        self.logins = 0
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def send(self, method, url, *args, params=None, **kwargs):
+        if url == BASE_URL + 'open-session':
+            # slow enough for the other threads to queue up for the login
+            time.sleep(0.05)
+            with self._lock:
+                self.logins += 1
+                self.token = 'token-{}'.format(self.logins)
+            return _response(200, json.dumps({'data': {'session': self.token}}))
+
+        session = params['session']
+        with self._lock:
+            self.requests.append(session)
+        if session != self.token or self.token == 'expired':
+            if self.barrier is not None:
+                self.barrier.wait(timeout=5)
+            return _response(self.expired_status, self.expired_body)
+        return _response(200, 'id\tname\r\n')
+
+
+@pytest.fixture
+def stub_send(monkeypatch):
+    '''
+    Returns function routing the requests of all clients to the fake server, the login is sent by the constructor.
+    '''
+    def stub(send):
+        monkeypatch.setattr(Client, '_send', lambda self, *args, **kwargs: send(*args, **kwargs))
+    return stub
+
+
+def _client(session_token='stored'):
+    return Client('user', 'pass', BASE_URL, session_token=session_token)
+
+
+def test_stored_session_is_reused(stub_send):
+    server = FakeGemius(token='stored')
+
+    stub_send(server.send)
+    with _client() as client:
+        assert client.get_standard_dataset('nodes', '2026-10-01', '2026-10-01', 'CZ', 'csv').status_code == 200
+    assert server.logins == 0
+    assert server.requests == ['stored']
+
+
+def test_login_without_stored_session(stub_send):
+    server = FakeGemius()
+
+    stub_send(server.send)
+    with _client(session_token=None) as client:
+        assert client.session == 'token-1'
+        client.get_standard_dataset('nodes', '2026-10-01', '2026-10-01', 'CZ', 'csv')
+    assert server.logins == 1
+    assert server.requests == ['token-1']
+
+
+@pytest.mark.parametrize('status_code, body', [(401, ''), (403, 'Forbidden'),
+                                               (400, '{"error": "Invalid SESSION token"}')])
+def test_expired_session_relogin(stub_send, status_code, body):
+    server = FakeGemius(expired_status=status_code, expired_body=body)
+
+    stub_send(server.send)
+    with _client() as client:
+        res = client.get_standard_dataset('nodes', '2026-10-01', '2026-10-01', 'CZ', 'csv')
+        assert res.status_code == 200
+        assert res.client_retries == 1
+        # the renewed token is what gets stored in the state
+        assert client.session == 'token-1'
+    assert server.logins == 1
+    assert server.requests == ['stored', 'token-1']
+
+
+def test_other_errors_do_not_relogin(stub_send):
+    server = FakeGemius(expired_status=400, expired_body='Invalid period')
+
+    stub_send(server.send)
+    with _client() as client, pytest.raises(Exception, match='Invalid period'):
+        client.get_standard_dataset('nodes', '2026-10-01', '2026-10-01', 'CZ', 'csv')
+    assert server.logins == 0
+    assert server.requests == ['stored']
+
+
+def test_relogin_once_per_request(stub_send):
+    server = FakeGemius()
+
+    def new_token_rejected(method, url, *args, **kwargs):
+        res = server.send(method, url, *args, **kwargs)
+        # every token is rejected
+        server.token = 'expired'
+        return res
+
+    stub_send(new_token_rejected)
+    with _client() as client:
+        with pytest.raises(Exception, match='401'):
+            client.get_standard_dataset('nodes', '2026-10-01', '2026-10-01', 'CZ', 'csv')
+    assert server.logins == 1
+    assert server.requests == ['stored', 'token-1']
+
+
+def test_concurrent_expiry_logs_in_once(stub_send):
+    threads = 8
+    server = FakeGemius(barrier=threading.Barrier(threads))
+
+    stub_send(server.send)
+    with _client() as client, ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(lambda i: client.get_standard_dataset('nodes', '2026-10-01', '2026-10-01', 'CZ',
+                                                                      'csv'), range(threads)))
+
+        assert [res.status_code for res in results] == [200] * threads
+        assert client.session == 'token-1'
+    assert server.logins == 1
+    assert sorted(server.requests) == ['stored'] * threads + ['token-1'] * threads
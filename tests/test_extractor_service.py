@@ -0,0 +1,84 @@
+import io
+
+import requests
+import urllib3
+
+from kbc.client_base import BufferedResponse
+from gemius.extractor_service import ExtractorService
+
+PERIOD = {'begin': '2026-10-01', 'end': '2026-10-01', 'period type': 'daily'}
+
+# no charset in the content type - requests would decode it as latin-1, "ą" is C4 85 in utf-8 (85 = NEL)
+TSV = 'id\tname\r\n1\tZażółć ą\r\n2\t"multi\r\nline"\r\n'.encode('utf-8')
+EXPECTED = [['1', 'Zażółć ą'], ['2', 'multi\r\nline']]
+
+
+class ListWriter:
+
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(list(row))
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+def _buffered_response(content):
+    res = requests.Response()
+    res._content = content
+    res.status_code = 200
+    res.headers['Content-Type'] = 'text/csv'
+    res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+    return res
+
+
+def _streamed_response(content):
+    res = requests.Response()
+    res.raw = urllib3.HTTPResponse(body=io.BytesIO(content), preload_content=False)
+    res.status_code = 200
+    res.headers['Content-Type'] = 'text/csv'
+    res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+    return res
+
+
+def _responses(content):
+    return [_buffered_response(content), _streamed_response(content),
+            BufferedResponse(content, headers={'Content-Type': 'text/csv'})]
+
+
+def test_ds_writer_keeps_non_ascii_and_multiline_values():
+    service = ExtractorService(object())
+    for res in _responses(TSV):
+        writer = ListWriter()
+        with service._open_resp_text(res) as lines:
+            rows = service._write_ds_resp_in_period(lines, writer, PERIOD, ['country'], ['CZ'], True)
+        assert rows == 2
+        assert writer.rows[0] == ['id', 'name', 'country', 'begin_period', 'end_period', 'period_type']
+        assert [row[:2] for row in writer.rows[1:]] == EXPECTED
+        assert writer.rows[1][2:] == ['CZ', '2026-10-01', '2026-10-01', 'daily']
+
+
+def test_stats_writer_keeps_non_ascii_and_multiline_values():
+    service = ExtractorService(object())
+    fieldnames = ['name', 'country', 'id', 'begin_period', 'end_period', 'period_type']
+    for res in _responses(TSV):
+        writer = ListWriter()
+        with service._open_resp_text(res) as lines:
+            rows = service._write_stats_resp_in_period(lines, writer, PERIOD, {'country': 'CZ'}, True, fieldnames)
+        assert rows == 2
+        assert writer.rows == [fieldnames,
+                               ['Zażółć ą', 'CZ', '1', '2026-10-01', '2026-10-01', 'daily'],
+                               ['multi\r\nline', 'CZ', '2', '2026-10-01', '2026-10-01', 'daily']]
+
+
+def test_stats_writer_counts_rows_not_lines():
+    service = ExtractorService(object())
+    content = 'id\tname\r\n1\t"a\r\nb\r\nc"\r\n\r\n2\tx\r\n\r\n'.encode('utf-8')
+    writer = ListWriter()
+    with service._open_resp_text(_buffered_response(content)) as lines:
+        rows = service._write_stats_resp_in_period(lines, writer, PERIOD, {}, False, ['id', 'name'])
+    assert rows == 2
+    assert writer.rows == [['1', 'a\r\nb\r\nc'], ['2', 'x']]
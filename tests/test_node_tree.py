@@ -0,0 +1,71 @@
+import logging
+
+import pytest
+
+from kbc.client_base import BufferedResponse
+from gemius.extractor_service import ExtractorService
+from gemius.node_tree import NodeTreeIndex, parse_subtree_spec
+from gemius.stats_planner import StatsRequestPlanner
+
+# 1 -> 2 -> 4
+#        -> 5 -> 7
+#   -> 3 -> 6
+EDGES = [('1', ''), ('2', '1'), ('3', '1'), ('4', '2'), ('5', '2'), ('6', '3'), ('7', '5')]
+
+
+def test_expand_whole_subtree_breadth_first():
+    assert NodeTreeIndex(EDGES).expand(['1']) == (['1', '2', '3', '4', '5', '6', '7'], [])
+    assert NodeTreeIndex(EDGES).expand(['2']) == (['2', '4', '5', '7'], [])
+
+
+def test_expand_limited_depth():
+    tree = NodeTreeIndex(EDGES)
+
+    assert tree.expand(['1:0']) == (['1'], [])
+    assert tree.expand(['1:1']) == (['1', '2', '3'], [])
+    assert tree.expand(['2:1']) == (['2', '4', '5'], [])
+
+
+def test_expand_overlapping_subtrees_once():
+    assert NodeTreeIndex(EDGES).expand(['2', '1:1', '5']) == (['2', '4', '5', '7', '1', '3'], [])
+
+
+def test_expand_reports_missing_roots():
+    assert NodeTreeIndex(EDGES).expand(['9', '3']) == (['3', '6'], ['9'])
+
+
+def test_expand_survives_cycles():
+    tree = NodeTreeIndex([('1', '3'), ('2', '1'), ('3', '2')])
+
+    assert tree.expand(['1']) == (['1', '2', '3'], [])
+
+
+def test_from_tsv():
+    content = 'id\tname\tparent_id\r\n1\tRoot\t\r\n2\t"Child\tą"\t1\r\n'.encode('utf-8')
+
+    tree = NodeTreeIndex.from_tsv(content)
+    assert tree.size == 2
+    assert tree.expand(['1']) == (['1', '2'], [])
+
+
+class NodesClient:
+
+    def get_dataset_generic(self, endpoint_name, begin, end, country, output_type='csv', **params):
+        rows = ['{}\t{}'.format(node_id, parent_id) for node_id, parent_id in EDGES]
+        return BufferedResponse('\r\n'.join(['id\tparent_id'] + rows).encode('utf-8'))
+
+
+def test_subtree_filters_split_into_chunks(caplog):
+    service = ExtractorService(NodesClient(), stats_planner=StatsRequestPlanner(max_filter_values=3))
+    period = {'begin': '2026-10-01', 'end': '2026-10-01', 'period type': 'daily'}
+
+    with caplog.at_level(logging.INFO):
+        plan = service._plan_subtree_filters('CZ', [period], {'metric': ['1']}, ['1'])(period)
+    assert [p['node'] for p in plan] == [['1', '2', '3'], ['4', '5', '6'], ['7']]
+    assert 'expanded into 7 - 7 nodes per period' in caplog.text
+
+
+@pytest.mark.parametrize('spec', ['', ':1', '1:x', '1:-1'])
+def test_invalid_subtree_spec(spec):
+    with pytest.raises(ValueError):
+        parse_subtree_spec(spec)
@@ -0,0 +1,26 @@
+import os
+import time
+
+from kbc.profiling import PROFILING_FULL, RunProfiler
+
+
+def _allocate_and_release():
+    buffers = [bytearray(1024 * 1024) for _ in range(20)]
+    # let the sampler see the peak
+    time.sleep(0.1)
+    return len(buffers)
+
+
+def test_allocations_report_sites_of_the_peak(tmp_path):
+    with RunProfiler(PROFILING_FULL, str(tmp_path), peak_poll_interval=0.01) as profiler:
+        _allocate_and_release()
+
+    allocations_path = os.path.join(str(tmp_path), 'profile-allocations.txt')
+    assert allocations_path in profiler.artifacts
+    with open(allocations_path) as allocations:
+        at_peak, at_end = allocations.read().split('still allocated at the end:')
+
+    site = 'test_profiling.py:{}: size='.format(_allocate_and_release.__code__.co_firstlineno + 1)
+    assert site + '20.0 MiB' in at_peak
+    # released before the end
+    assert site + '20.0 MiB' not in at_end
@@ -0,0 +1,104 @@
+import asyncio
+import email.utils
+import time
+
+from kbc.rate_limit import AdaptiveRateLimiter, parse_retry_after
+
+
+def _request(limiter, status_code, retry_after=None):
+    limiter.acquire()
+    limiter.release(status_code, retry_after)
+
+
+def test_throttled_response_decreases_rate_and_concurrency():
+    limiter = AdaptiveRateLimiter(rate=100, max_concurrency=8, decrease_cooldown=0)
+
+    _request(limiter, 429)
+    assert limiter.rate == 50
+    assert limiter.concurrency_limit == 4
+    _request(limiter, 503)
+    assert limiter.rate == 25
+    assert limiter.concurrency_limit == 2
+    assert limiter.stats()['throttled'] == 2
+
+
+def test_decrease_limited_by_min_rate_and_one_request():
+    limiter = AdaptiveRateLimiter(rate=100, min_rate=30, max_concurrency=2, decrease_cooldown=0)
+
+    for _ in range(3):
+        _request(limiter, 429)
+    assert limiter.rate == 30
+    assert limiter.concurrency_limit == 1
+
+
+def test_decrease_once_per_cooldown():
+    limiter = AdaptiveRateLimiter(rate=100, decrease_cooldown=60)
+
+    _request(limiter, 429)
+    _request(limiter, 429)
+    assert limiter.rate == 50
+    assert limiter.stats()['throttled'] == 2
+
+
+def test_successful_responses_increase_up_to_max():
+    limiter = AdaptiveRateLimiter(rate=100, max_rate=110, max_concurrency=4, increase_step=100, decrease_cooldown=0)
+    _request(limiter, 429)
+    assert (limiter.rate, limiter.concurrency_limit) == (50, 2)
+
+    _request(limiter, 200)
+    assert limiter.rate == 52
+    for _ in range(60):
+        _request(limiter, 200)
+    assert limiter.rate == 110
+    assert limiter.concurrency_limit == 4
+
+
+def test_server_errors_and_failures_do_not_adjust():
+    limiter = AdaptiveRateLimiter(rate=100, max_rate=200)
+
+    _request(limiter, 500)
+    _request(limiter, None)
+    assert limiter.rate == 100
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_concurrency_limit_blocks_until_release():
+    limiter = AdaptiveRateLimiter(rate=1000, max_concurrency=1, burst=2)
+    limiter.acquire()
+    assert limiter._try_acquire() is None
+
+    limiter.release(200)
+    assert limiter._try_acquire() == 0
+
+
+def test_retry_after_pauses_requests():
+    limiter = AdaptiveRateLimiter(rate=1000, max_concurrency=4)
+
+    _request(limiter, 429, retry_after=0.2)
+    start = time.monotonic()
+    _request(limiter, 200)
+    assert time.monotonic() - start >= 0.15
+
+
+def test_async_acquire():
+    limiter = AdaptiveRateLimiter(rate=1000, max_concurrency=2)
+
+    async def request():
+        await limiter.acquire_async()
+        await asyncio.sleep(0.01)
+        limiter.release(200)
+
+    async def run():
+        await asyncio.gather(*(request() for _ in range(5)))
+
+    asyncio.run(run())
+    assert limiter.stats()['requests'] == 5
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('2') == 2.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    http_date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < parse_retry_after(http_date) <= 30
@@ -0,0 +1,71 @@
+import os
+import time
+
+from gemius.response_cache import ResponseCache
+
+
+def _age(cache, key, seconds):
+    path = cache._entry_path(key)
+    st = os.stat(path)
+    os.utime(path, (st.st_atime - seconds, st.st_mtime - seconds))
+
+
+def test_key_ignores_order_of_filters_and_values(tmp_path):
+    cache_key = ResponseCache(str(tmp_path)).make_key
+    key = cache_key('stats', 'CZ', '2026-10-01', '2026-10-01', {'node': ['2', '1'], 'metric': ['a']})
+
+    assert key == cache_key('stats', 'CZ', '2026-10-01', '2026-10-01', {'metric': ['a'], 'node': ['1', '2']})
+    assert key == cache_key('stats', 'CZ', '2026-10-01', '2026-10-01', {'metric': ('a',), 'node': [1, 2, 2], 'geo': []})
+    assert key != cache_key('stats', 'CZ', '2026-10-01', '2026-10-01', {'metric': ['a'], 'node': ['1']})
+    assert key != cache_key('stats', 'SK', '2026-10-01', '2026-10-01', {'node': ['2', '1'], 'metric': ['a']})
+
+
+def test_key_stable_across_instances(tmp_path):
+    params = {'node': ['1', '2']}
+
+    assert (ResponseCache(str(tmp_path / 'a')).make_key('nodes', 'CZ', '2026-10-01', '2026-10-01', params)
+            == ResponseCache(str(tmp_path / 'b')).make_key('nodes', 'CZ', '2026-10-01', '2026-10-01', params))
+
+
+def test_put_get_roundtrip(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put('k', b'id\tname\r\n1\t\xc4\x85\r\n', 'utf-8')
+    cache.put('no-encoding', b'data')
+
+    assert cache.get('k') == (b'id\tname\r\n1\t\xc4\x85\r\n', 'utf-8')
+    assert cache.get('no-encoding') == (b'data', None)
+    assert cache.get('missing') is None
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+    # reopened cache sees the stored entries
+    assert ResponseCache(str(tmp_path)).get('k') is not None
+
+
+def test_expired_entry_is_removed(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=60)
+    cache.put('old', b'x' * 10)
+    cache.put('new', b'y' * 10)
+    _age(cache, 'old', 120)
+
+    assert cache.get('old') is None
+    assert not os.path.exists(cache._entry_path('old'))
+    assert cache.get('new') == (b'y' * 10, None)
+    assert cache.stats()['size_bytes'] == os.path.getsize(cache._entry_path('new'))
+
+
+def test_least_recently_used_entries_evicted(tmp_path):
+    # entry = encoding line + 100 bytes
+    cache = ResponseCache(str(tmp_path), max_size=350)
+    for index, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, b'x' * 100)
+        _age(cache, key, 100 - index * 10)
+    # hit updates the access time, "a" is now the most recently used
+    assert cache.get('a') is not None
+    time.sleep(0.01)
+
+    # evicted down to 90 % of the limit - the least recently used entry only
+    cache.put('d', b'x' * 100)
+    assert cache.get('b') is None
+    assert [key for key in ['a', 'c', 'd'] if cache.get(key) is None] == []
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['size_bytes'] <= 350 * 0.9
@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from gemius.extractor_service import ExtractorService
+from gemius.run_plan import DatasetPlan, RunPlan
+
+PERIODS = [{'begin': '2026-10-0{}'.format(day), 'end': '2026-10-0{}'.format(day), 'period type': 'daily'}
+           for day in (1, 2)]
+
+
+class BarrierClient:
+    '''
+    Fake client whose requests wait until `parties` requests are in flight at once.
+    '''
+
+    def __init__(self, parties):
+        self.barrier = threading.Barrier(parties, timeout=5)
+        self.calls = []
+
+    def get_dataset_generic(self, endpoint_name, begin, end, country, output_type='csv', stream=False, **params):
+        self.calls.append((endpoint_name, country, begin))
+        self.barrier.wait()
+        return (endpoint_name, country, begin)
+
+
+def _retrieve(service, endpoint_name, country, period_list):
+    return [res for period, res in service._get_ds_in_periods(endpoint_name, period_list, country)]
+
+
+def test_shared_queue_spans_groups():
+    # one request per group, both groups in flight at once
+    client = BarrierClient(parties=2)
+    service = ExtractorService(client, max_workers=2)
+    units = service.plan_dataset_requests('nodes', {'CZ': PERIODS[:1]})['CZ'] + \
+        service.plan_dataset_requests('geos', {'SK': PERIODS[1:]})['SK']
+
+    with service.shared_request_queue(units):
+        assert _retrieve(service, 'nodes', 'CZ', PERIODS[:1]) == [('nodes', 'CZ', '2026-10-01')]
+        assert _retrieve(service, 'geos', 'SK', PERIODS[1:]) == [('geos', 'SK', '2026-10-02')]
+    assert len(client.calls) == 2
+
+
+def test_request_not_planned_raises():
+    service = ExtractorService(BarrierClient(parties=1))
+    units = service.plan_dataset_requests('nodes', {'CZ': PERIODS})['CZ']
+
+    with pytest.raises(RuntimeError):
+        with service.shared_request_queue(units):
+            _retrieve(service, 'geos', 'CZ', PERIODS)
+
+
+def test_unretrieved_planned_requests_raise():
+    service = ExtractorService(BarrierClient(parties=1))
+    units = service.plan_dataset_requests('nodes', {'CZ': PERIODS})['CZ']
+
+    with pytest.raises(RuntimeError):
+        with service.shared_request_queue(units):
+            _retrieve(service, 'nodes', 'CZ', PERIODS[:1])
+
+
+def test_estimate_of_shared_queue_spans_groups():
+    service = ExtractorService(object())
+    plan = RunPlan(concurrency=4)
+    for index, endpoint in enumerate(['nodes', 'geos']):
+        units = service.plan_dataset_requests(endpoint, {'CZ': PERIODS})
+        plan.add(DatasetPlan(index, {'dataset_type': endpoint}, endpoint, {'CZ': PERIODS}, units))
+
+    groups = [plan.estimate_group(*g) for g in plan.groups()]
+    # 4 requests of two groups sent 4 at once, not two groups of 2 one after another
+    assert plan.estimate()['estimated_seconds'] == pytest.approx(groups[0]['estimated_seconds'], abs=0.1)
@@ -0,0 +1,70 @@
+import itertools
+
+import pytest
+
+from gemius.stats_planner import StatsRequestPlanner
+
+
+def _combinations(plan):
+    '''
+    Returns list of all (node, geo) combinations requested by the plan.
+    '''
+    return [combination for params in plan
+            for combination in itertools.product(params.get('node') or [None], params.get('geo') or [None])]
+
+
+def test_small_filters_are_not_split():
+    params = {'metric': ['1', '2'], 'node': ['1', '2', '3']}
+    assert StatsRequestPlanner().plan(params) == [params]
+
+
+def test_filters_split_by_value_count():
+    plan = StatsRequestPlanner(max_filter_values=2).plan({'metric': ['1', '2', '3'], 'node': ['1', '2', '3', '4', '5']})
+
+    assert [p['node'] for p in plan] == [['1', '2'], ['3', '4'], ['5']]
+    # the metric filter defines the result columns, it is never split
+    assert all(p['metric'] == ['1', '2', '3'] for p in plan)
+
+
+def test_split_filters_are_combined_exactly_once():
+    params = {'node': [str(i) for i in range(5)], 'geo': [str(i) for i in range(3)]}
+    plan = StatsRequestPlanner(max_filter_values=2).plan(params)
+
+    assert len(plan) == 3 * 2
+    combinations = _combinations(plan)
+    assert len(combinations) == len(set(combinations))
+    assert set(combinations) == set(itertools.product(params['node'], params['geo']))
+
+
+def test_filters_split_by_url_length():
+    params = {'metric': ['1'], 'node': ['{:05d}'.format(i) for i in range(200)]}
+    planner = StatsRequestPlanner(max_url_bytes=1000)
+    plan = planner.plan(params)
+
+    assert len(plan) > 1
+    assert [v for p in plan for v in p['node']] == params['node']
+    for request_params in plan:
+        url_bytes = sum(planner._param_bytes(key, v) for key, values in request_params.items() for v in values)
+        assert url_bytes <= 1000
+
+
+def test_single_value_over_url_limit_raises():
+    with pytest.raises(ValueError):
+        StatsRequestPlanner(max_url_bytes=310).plan({'node': ['x' * 100]})
+
+
+def test_bisect_halves_longest_chunked_filter():
+    params = {'metric': ['1', '2', '3', '4', '5'], 'node': ['1', '2', '3'], 'geo': ['1', '2']}
+
+    first, second = StatsRequestPlanner().bisect(params)
+    assert first == dict(params, node=['1'])
+    assert second == dict(params, node=['2', '3'])
+
+
+def test_bisect_single_values_returns_none():
+    assert StatsRequestPlanner().bisect({'metric': ['1', '2'], 'node': ['1'], 'geo': []}) is None
+
+
+def test_request_limits_only_when_splitting_enabled():
+    assert StatsRequestPlanner().request_limits() == {}
+    assert StatsRequestPlanner(split_timeout=5).request_limits() == {'timeout': 5, 'max_content_length': None}
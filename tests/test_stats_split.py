@@ -0,0 +1,58 @@
+from kbc.client_base import HeavyRequestError
+from gemius.extractor_service import ExtractorService
+from gemius.stats_planner import StatsRequestPlanner
+
+PERIOD = {'begin': '2026-10-01', 'end': '2026-10-01', 'period type': 'daily'}
+
+
+class HeavyStatsClient:
+    '''
+    Fake client failing the stats requests with more than max_nodes nodes while the split limits are set.
+    '''
+
+    def __init__(self, max_nodes):
+        self.max_nodes = max_nodes
+        self.calls = []
+
+    def get_dataset_generic(self, endpoint_name, begin, end, country, output_type='csv', stream=False,
+                            timeout=None, max_content_length=None, **params):
+        limited = timeout is not None or max_content_length is not None
+        self.calls.append((params['node'], limited))
+        if limited and len(params['node']) > self.max_nodes:
+            raise HeavyRequestError('too heavy')
+        return params['node']
+
+
+def _get_stats(client, nodes, max_workers=1):
+    service = ExtractorService(client, max_workers, stats_planner=StatsRequestPlanner(split_timeout=10))
+    return [res for period, res in service._get_ds_in_periods('stats', [PERIOD], 'CZ', metric=['1'], node=nodes)]
+
+
+def test_heavy_request_is_bisected_recursively():
+    client = HeavyStatsClient(max_nodes=1)
+
+    results = _get_stats(client, ['1', '2', '3', '4'])
+    assert results == [['1'], ['2'], ['3'], ['4']]
+    assert client.calls == [(['1', '2', '3', '4'], True), (['1', '2'], True), (['1'], True), (['2'], True),
+                            (['3', '4'], True), (['3'], True), (['4'], True)]
+
+
+def test_uneven_halves_keep_order():
+    client = HeavyStatsClient(max_nodes=2)
+
+    assert _get_stats(client, ['1', '2', '3', '4', '5'], max_workers=4) == [['1', '2'], ['3'], ['4', '5']]
+
+
+def test_unsplittable_request_is_retried_without_limits():
+    client = HeavyStatsClient(max_nodes=0)
+
+    assert _get_stats(client, ['1', '2']) == [['1'], ['2']]
+    assert client.calls == [(['1', '2'], True), (['1'], True), (['1'], False), (['2'], True), (['2'], False)]
+
+
+def test_limits_not_sent_when_splitting_disabled():
+    client = HeavyStatsClient(max_nodes=0)
+    service = ExtractorService(client)
+
+    assert [res for period, res in service._get_ds_in_periods('stats', [PERIOD], 'CZ', node=['1', '2'])] == [['1', '2']]
+    assert client.calls == [(['1', '2'], False)]